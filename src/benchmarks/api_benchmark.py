@@ -0,0 +1,334 @@
+"""
+End-to-end API benchmark driven by the Insomnia export of the endpoints (src/API-Endpoints).
+
+Every request of the export becomes a scenario run through the real app (create_app()) with the test
+client: the export gives the method, path, JSON body and whether a bearer token is sent, and the
+benchmark substitutes its own users, portfolio, transaction and assets for the IDs and emails of the
+export. Requests that delete or create a user's only portfolio get a fresh throwaway user or portfolio
+before every call, outside of the timing. For every scenario the script reports the p50, p95 and p99
+latency, the mean latency, the throughput (requests per second, one request at a time) and the number of
+SQL statements per request, and it can save the results as JSON and compare them with a previous run.
+
+The benchmark creates its users (with the export's password) and assets, serves prices from the fake price
+provider instead of CoinGecko, and deletes everything it created again when it is done. Run it against a local
+database only.
+
+Register and login requests hash passwords with BCRYPT_LOG_ROUNDS, lower it to focus on the rest of the
+request.
+
+Usage (from the src folder, with DATABASE_URI and JWT_SECRET_KEY set and the tables created):
+    python -m benchmarks.api_benchmark --requests 200 --output before.json
+    python -m benchmarks.api_benchmark --requests 200 --output after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+
+# The background price refresher would call the price provider, prices are read from the database
+os.environ.setdefault("PRICE_REFRESH_INTERVAL", "0")
+
+from flask import url_for
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+from werkzeug.exceptions import MethodNotAllowed, NotFound
+from werkzeug.routing import RequestRedirect
+
+from main import create_app
+from init import db, bcrypt, price_cache
+from models.assets import Asset
+from models.portfolios import Portfolio
+from models.users import User
+from services.price_provider import FakePriceProvider
+
+# Insomnia export of the API, one request per endpoint with example bodies
+EXPORT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "API-Endpoints")
+# Endpoints restricted to admins, every other authenticated request is sent as the portfolio owner
+ADMIN_ENDPOINTS = {
+    "auth.delete_user",
+    "portfolios.get_all_portfolios",
+    "portfolios.delete_portfolio",
+    "transactions.retrieve_all_transactions",
+    "ownedAssets.retrieve_owned_assets",
+}
+# Number of throwaway assets, traded and looked up in turn
+ASSET_COUNT = 10
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def load_export(path):
+    """
+    Functionality: Reads the requests of an Insomnia (v4) export.
+
+    Input: The path of the export.
+    Output: A list of dictionaries with the request 'name', its folder ('group'), 'method', 'path', JSON 'body' (or None) and whether it sends a bearer token ('auth').
+    """
+    with open(path, encoding="utf-8") as file:
+        resources = json.load(file)["resources"]
+    groups = {resource["_id"]: resource["name"] for resource in resources if resource["_type"] == "request_group"}
+    requests = []
+    for resource in resources:
+        if resource["_type"] != "request":
+            continue
+        url = resource["url"]
+        path = "/" + url.split("://", 1)[-1].split("/", 1)[-1] if "://" in url else url
+        text = resource.get("body", {}).get("text")
+        requests.append({
+            "name": resource["name"],
+            "group": groups.get(resource.get("parentId"), ""),
+            "method": resource["method"],
+            "path": path,
+            "body": json.loads(text) if text else None,
+            "auth": resource.get("authentication", {}).get("type") == "bearer"
+        })
+    return requests
+
+
+def build_scenarios(app, requests):
+    """
+    Functionality: Matches the exported requests to the app's routes, following redirects such as a missing trailing slash.
+
+    Input: The app and the requests of the export (see load_export).
+    Output: A list of scenarios (the request with its 'endpoint', 'rule' and URL 'args') and a list of the names of the requests matching no route.
+    """
+    adapter = app.url_map.bind("localhost")
+    scenarios, unmatched = [], []
+    for request in requests:
+        path = request["path"]
+        for _ in range(2):
+            try:
+                rule, args = adapter.match(path, request["method"], return_rule=True)
+                scenarios.append(dict(request, endpoint=rule.endpoint, rule=rule.rule, args=args))
+                break
+            except RequestRedirect as redirect:
+                path = redirect.new_url.split("localhost", 1)[-1]
+            except (NotFound, MethodNotAllowed):
+                unmatched.append(request["name"])
+                break
+    return scenarios, unmatched
+
+
+class Fixtures:
+    """
+    Functionality: The users, portfolio, transaction and assets the scenarios run against, and the throwaway ones created for destructive requests. Every user's email starts with the run's tag so teardown() can find them all.
+    """
+
+    def __init__(self, app, password):
+        self.app = app
+        self.password = password
+        self.tag = uuid.uuid4().hex[:12]
+        self.counter = 0
+        self.asset_ids = []
+
+    def email(self, name):
+        return f"benchmark-{self.tag}-{name}@email.com"
+
+    def setup(self):
+        with self.app.app_context():
+            password_hash = bcrypt.generate_password_hash(self.password).decode("utf-8")
+            now = datetime.now(timezone.utc)
+            assets = [
+                Asset(assetID=f"benchmark-{self.tag}-{index}", marketCapPos=0, symbol=f"BENCH{index}", name=f"Benchmark {self.tag} {index}", price=1.0 + index, lastUpdated=now)
+                for index in range(ASSET_COUNT)
+            ]
+            admin = User(email=self.email("admin"), password=password_hash, is_admin=True)
+            user = User(email=self.email("user"), password=password_hash)
+            db.session.add_all(assets + [admin, user, Portfolio(name="Benchmark", description="API benchmark", date=date.today(), user=user)])
+            db.session.commit()
+            self.asset_ids = [asset.assetID for asset in assets]
+            # Serve the stored prices of the benchmark assets, without network access
+            price_cache.provider = FakePriceProvider([
+                {"id": asset.assetID, "symbol": asset.symbol.lower(), "name": asset.name, "market_cap_rank": 0, "current_price": asset.price}
+                for asset in assets
+            ])
+
+        # Log in through the API, and give the portfolio a position and a transaction to look up
+        client = self.app.test_client()
+        self.admin_token = self.login(client, self.email("admin"))
+        self.user_token = self.login(client, self.email("user"))
+        response = client.post("/transactions/trade", json={"transactionType": "buy", "quantity": 100, "assetID": self.asset_ids[0]}, headers=self.headers(self.user_token))
+        self.transaction_id = response.get_json()["transactionID"]
+        self.portfolio_id = response.get_json()["portfolioID"]
+
+    def login(self, client, email):
+        response = client.post("/auth/login", json={"email": email, "password": self.password})
+        return response.get_json()["token"]
+
+    @staticmethod
+    def headers(token):
+        return {"Authorization": f"Bearer {token}"}
+
+    def throwaway_user(self, with_portfolio=False):
+        # A user created outside of the timing, returned with a token minted like POST /auth/login does
+        self.counter += 1
+        with self.app.app_context():
+            user = User(email=self.email(f"throwaway-{self.counter}"), password="not-a-valid-hash")
+            portfolio = Portfolio(name="Throwaway", description="API benchmark", date=date.today(), user=user) if with_portfolio else None
+            db.session.add_all([user] + ([portfolio] if portfolio else []))
+            db.session.commit()
+            claims = {"is_admin": False, "portfolioID": portfolio.portfolioID if portfolio else None, "ver": user.tokenVersion}
+            token = create_access_token(identity=str(user.userID), expires_delta=timedelta(hours=1), additional_claims=claims)
+            return user.userID, portfolio.portfolioID if portfolio else None, token
+
+    def teardown(self):
+        # Deleting the users and assets cascades to their portfolios, transactions, owned assets and lots
+        with self.app.app_context():
+            for user in db.session.scalars(db.select(User).where(User.email.like(f"benchmark-{self.tag}-%"))):
+                db.session.delete(user)
+            db.session.flush()
+            for asset in db.session.scalars(db.select(Asset).where(Asset.assetID.in_(self.asset_ids))):
+                db.session.delete(asset)
+            db.session.commit()
+
+    def prepare(self, scenario, iteration):
+        """
+        Functionality: Builds one call of a scenario, replacing the IDs and emails of the export with the benchmark's own.
+
+        Input: The scenario and the number of the call.
+        Output: The path, JSON body and headers of the call.
+        """
+        endpoint, args, body = scenario["endpoint"], dict(scenario["args"]), dict(scenario["body"] or {})
+        token = self.admin_token if endpoint in ADMIN_ENDPOINTS else self.user_token
+
+        if endpoint == "auth.auth_register":
+            self.counter += 1
+            body["email"] = self.email(f"registered-{self.counter}")
+        elif endpoint == "auth.auth_login":
+            body["email"] = self.email("admin" if body.get("email", "").startswith("admin") else "user")
+            body["password"] = self.password
+        elif endpoint == "auth.delete_user":
+            args["user_id"] = self.throwaway_user()[0]
+        elif endpoint == "portfolios.create_portfolio":
+            token = self.throwaway_user()[2]
+        elif endpoint == "portfolios.delete_portfolio":
+            args["portfolio_id"] = self.throwaway_user(with_portfolio=True)[1]
+        else:
+            if "portfolio_id" in args:
+                args["portfolio_id"] = self.portfolio_id
+            if "transaction_id" in args:
+                args["transaction_id"] = self.transaction_id
+            if "asset_id" in args:
+                args["asset_id"] = self.asset_ids[iteration % ASSET_COUNT]
+        if "assetID" in body:
+            body["assetID"] = self.asset_ids[iteration % ASSET_COUNT]
+
+        with self.app.test_request_context():
+            path = url_for(endpoint, **args)
+        return path, body or None, self.headers(token) if scenario["auth"] else {}
+
+
+def run_scenario(app, fixtures, scenario, requests, warmup, statements):
+    client = app.test_client()
+    latencies, sql_counts, errors = [], [], 0
+    for iteration in range(warmup + requests):
+        path, body, headers = fixtures.prepare(scenario, iteration)
+        statements.clear()
+        start = time.perf_counter()
+        response = client.open(path, method=scenario["method"], json=body, headers=headers)
+        elapsed = time.perf_counter() - start
+        if iteration < warmup:
+            continue
+        latencies.append(elapsed)
+        sql_counts.append(len(statements))
+        errors += response.status_code >= 400
+    return {
+        "method": scenario["method"],
+        "rule": scenario["rule"],
+        "group": scenario["group"],
+        "requests": requests,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 3),
+        "throughput_rps": round(len(latencies) / sum(latencies), 1),
+        "sql_per_request": round(statistics.mean(sql_counts), 2)
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Functionality: Prints the change of every endpoint's p50, p95 and SQL statements per request against a previous run.
+
+    Input: The results of this run and of the baseline run (as saved with --output), and the p95 slowdown in percent above which an endpoint is reported as a regression.
+    Output: A list of the regressions found: a slower p95 by more than the threshold, or more SQL statements per request.
+    """
+    regressions = []
+    print(f"\n{'request':<38} {'p50 change':>11} {'p95 change':>11} {'sql/request':>14}")
+    for key, current in results["endpoints"].items():
+        previous = baseline["endpoints"].get(key)
+        if previous is None:
+            print(f"{key:<38} {'new':>11}")
+            continue
+        p50 = (current["p50_ms"] / previous["p50_ms"] - 1) * 100 if previous["p50_ms"] else 0
+        p95 = (current["p95_ms"] / previous["p95_ms"] - 1) * 100 if previous["p95_ms"] else 0
+        sql = f"{previous['sql_per_request']:g} -> {current['sql_per_request']:g}"
+        print(f"{key:<38} {p50:>+10.1f}% {p95:>+10.1f}% {sql:>14}")
+        if p95 > threshold:
+            regressions.append(f"{key}: p95 {previous['p95_ms']} ms -> {current['p95_ms']} ms ({p95:+.1f}%)")
+        if current["sql_per_request"] > previous["sql_per_request"]:
+            regressions.append(f"{key}: {sql} SQL statements per request")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--export", default=EXPORT_PATH, help="Insomnia export to generate the scenarios from.")
+    parser.add_argument("--requests", type=int, default=200, help="Timed requests per scenario.")
+    parser.add_argument("--warmup", type=int, default=10, help="Untimed requests per scenario before the timed ones.")
+    parser.add_argument("--password", default="123456", help="Password of the benchmark users, the one of the export's login requests.")
+    parser.add_argument("--output", help="Save the results as JSON to this file.")
+    parser.add_argument("--compare", help="Compare the results with a previous run saved with --output.")
+    parser.add_argument("--threshold", type=float, default=10.0, help="p95 slowdown in percent reported as a regression by --compare.")
+    args = parser.parse_args()
+
+    app = create_app()
+    scenarios, unmatched = build_scenarios(app, load_export(args.export))
+    for name in unmatched:
+        print(f"Skipping '{name}', it matches no route of the app.")
+
+    # Count the SQL statements sent while a request runs, requests run one at a time
+    statements = []
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", lambda *_: statements.append(None))
+
+    fixtures = Fixtures(app, args.password)
+    fixtures.setup()
+    results = {"created": datetime.now(timezone.utc).isoformat(), "requests": args.requests, "endpoints": {}}
+    try:
+        print(f"{'request':<38} {'route':<46} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'sql/req':>8} {'errors':>7}")
+        for scenario in scenarios:
+            # Requests are keyed by their name in the export, as several may share a route (such as the two logins)
+            result = run_scenario(app, fixtures, scenario, args.requests, args.warmup, statements)
+            results["endpoints"][scenario["name"]] = result
+            route = f"{scenario['method']} {scenario['rule']}"
+            print(f"{scenario['name']:<38} {route:<46} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['throughput_rps']:>8.1f} {result['sql_per_request']:>8.2f} {result['errors']:>7}")
+    finally:
+        fixtures.teardown()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+        print(f"Results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        if regressions:
+            print("REGRESSIONS:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            sys.exit(1)
+        print("OK: no regression against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Login throughput benchmark for choosing BCRYPT_LOG_ROUNDS and BCRYPT_WORKERS.
+
+For every bcrypt work factor given, the script measures the time of a single hash and then runs a
+burst of concurrent logins through the real app (create_app() and POST /auth/login), reporting the
+login throughput and latency. Pick the highest work factor whose throughput still covers the expected
+login peak (for example market open) with the worker count you plan to run.
+
+The benchmark creates its own user for every work factor and deletes it again when it is done.
+
+Usage (from the src folder, with DATABASE_URI and JWT_SECRET_KEY set and the tables created):
+    python -m benchmarks.login_throughput --rounds 10 11 12 13 --clients 16 --logins 10 --workers 4
+"""
+import argparse
+import os
+import statistics
+import threading
+import time
+import uuid
+
+# The background price refresher is not needed for logins
+os.environ.setdefault("PRICE_REFRESH_INTERVAL", "0")
+
+import bcrypt as bcrypt_lib
+
+from main import create_app
+from init import db
+from models.users import User
+
+PASSWORD = "benchmark-password"
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def run_logins(app, email, clients, logins_per_client):
+    barrier = threading.Barrier(clients)
+    statuses, latencies = [], []
+    lock = threading.Lock()
+
+    def worker():
+        client = app.test_client()
+        local_statuses, local_latencies = [], []
+        barrier.wait()
+        for _ in range(logins_per_client):
+            start = time.perf_counter()
+            response = client.post("/auth/login", json={"email": email, "password": PASSWORD})
+            local_latencies.append(time.perf_counter() - start)
+            local_statuses.append(response.status_code)
+        with lock:
+            statuses.extend(local_statuses)
+            latencies.extend(local_latencies)
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return statuses, latencies, time.perf_counter() - start
+
+
+def benchmark_rounds(rounds, args):
+    # Configure the app for this work factor before creating it
+    os.environ["BCRYPT_LOG_ROUNDS"] = str(rounds)
+    os.environ["BCRYPT_WORKERS"] = str(args.workers)
+    app = create_app()
+
+    # Time a single hash at this work factor
+    start = time.perf_counter()
+    pw_hash = bcrypt_lib.hashpw(PASSWORD.encode("utf-8"), bcrypt_lib.gensalt(rounds=rounds)).decode("utf-8")
+    hash_time = time.perf_counter() - start
+
+    # Create a throwaway user whose hash already uses this work factor, so no rehash is triggered
+    email = f"benchmark-{uuid.uuid4().hex[:12]}@email.com"
+    with app.app_context():
+        user = User(email=email, password=pw_hash)
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.userID
+
+    try:
+        statuses, latencies, elapsed = run_logins(app, email, args.clients, args.logins)
+    finally:
+        with app.app_context():
+            db.session.delete(db.session.get(User, user_id))
+            db.session.commit()
+
+    return {
+        "rounds": rounds,
+        "hash_ms": hash_time * 1000,
+        "logins_per_second": len(statuses) / elapsed,
+        "ok": statuses.count(200),
+        "busy": statuses.count(503),
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 11, 12, 13], help="bcrypt work factors to compare.")
+    parser.add_argument("--clients", type=int, default=16, help="Number of concurrent clients logging in.")
+    parser.add_argument("--logins", type=int, default=10, help="Number of logins per client.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="BCRYPT_WORKERS, the size of the hashing pool.")
+    args = parser.parse_args()
+
+    print(f"Clients: {args.clients}, logins per client: {args.logins}, hashing workers: {args.workers}")
+    print(f"{'rounds':>6} {'hash ms':>8} {'logins/s':>9} {'ok':>5} {'503':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for rounds in args.rounds:
+        result = benchmark_rounds(rounds, args)
+        print(
+            f"{result['rounds']:>6} {result['hash_ms']:>8.1f} {result['logins_per_second']:>9.1f} {result['ok']:>5} {result['busy']:>5} "
+            f"{result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+SQL statement count check for the portfolio endpoints (see PORTFOLIO_LOAD_OPTIONS in controllers/portfolios_controller.py).
+
+The script seeds a small and then a large set of portfolios, each holding as many owned assets as there are
+portfolios in the set, and calls through the real app (create_app()):
+- GET /portfolios/, the admin list, paged over exactly the seeded portfolios,
+- GET /portfolios/search/<portfolio_id>, the detail of one seeded portfolio,
+counting the SQL statements each request sends. The owned assets are loaded with the portfolios, so both
+endpoints must send the same number of statements whatever the number of portfolios and owned assets. A
+relationship loaded lazily while serializing (an N+1 query) makes the counts grow with the data and fails the check.
+
+The check creates its own users, portfolios and assets and deletes them again when it is done, it makes no
+calls to CoinGecko. Run it against a local database only.
+
+Usage (from the src folder, with DATABASE_URI and JWT_SECRET_KEY set and the tables created):
+    python -m benchmarks.portfolio_queries --small 5 --large 50
+"""
+import argparse
+import os
+import sys
+import uuid
+from datetime import date, datetime, timezone
+
+# The background price refresher is not needed, no prices are read
+os.environ.setdefault("PRICE_REFRESH_INTERVAL", "0")
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+
+from main import create_app
+from init import db
+from models.assets import Asset
+from models.ownedAssets import OwnedAsset
+from models.portfolios import Portfolio
+from models.users import User
+from utils.pagination import encode_cursor
+
+
+def setup_assets(app, tag, count):
+    # Create the throwaway assets held by the seeded portfolios
+    with app.app_context():
+        now = datetime.now(timezone.utc)
+        assets = [
+            Asset(assetID=f"benchmark-{tag}-{index}", marketCapPos=0, symbol=f"BENCH{index}", name=f"Benchmark {tag} {index}", price=1.0 + index, lastUpdated=now)
+            for index in range(count)
+        ]
+        admin = User(email=f"benchmark-{tag}-admin@email.com", password="not-a-valid-hash", is_admin=True)
+        db.session.add_all(assets + [admin])
+        db.session.commit()
+        return [asset.assetID for asset in assets], create_access_token(identity=str(admin.userID))
+
+
+def seed_portfolios(app, tag, asset_ids, count):
+    """
+    Functionality: Creates 'count' throwaway users, each with a portfolio holding the first 'count' assets.
+
+    Input: The app, the run's tag, the IDs of the throwaway assets and the number of portfolios.
+    Output: The list of the created portfolio IDs, in creation (and ID) order.
+    """
+    with app.app_context():
+        portfolios = []
+        for index in range(count):
+            user = User(email=f"benchmark-{tag}-{count}-{index}@email.com", password="not-a-valid-hash")
+            portfolio = Portfolio(name="Benchmark", description="Portfolio queries check", date=date.today(), holdings=float(count), user=user)
+            portfolio.ownedAssets = [
+                OwnedAsset(symbol=f"BENCH{position}", name=f"Benchmark {tag} {position}", quantity=1, price=1.0, assetID=asset_id)
+                for position, asset_id in enumerate(asset_ids[:count])
+            ]
+            portfolios.append(portfolio)
+        db.session.add_all(portfolios)
+        db.session.commit()
+        return [portfolio.portfolioID for portfolio in portfolios]
+
+
+def delete_users(app, prefix):
+    # Deleting the users cascades to their portfolios and owned assets
+    with app.app_context():
+        for user in db.session.scalars(db.select(User).where(User.email.like(f"{prefix}%"))):
+            db.session.delete(user)
+        db.session.commit()
+
+
+def teardown(app, tag, asset_ids):
+    delete_users(app, f"benchmark-{tag}-")
+    with app.app_context():
+        for asset in db.session.scalars(db.select(Asset).where(Asset.assetID.in_(asset_ids))):
+            db.session.delete(asset)
+        db.session.commit()
+
+
+def count_statements(app, token, portfolio_ids, statements):
+    """
+    Functionality: Calls the portfolio list and detail endpoints and counts the SQL statements each one sends.
+
+    Input: The app, the admin's token, the IDs of the seeded portfolios and the list the statement listener appends to.
+    Output: A dictionary mapping each endpoint to the number of statements its request sent.
+
+    Errors:
+    - Raises RuntimeError if a request fails or the list does not return exactly the seeded portfolios.
+    """
+    client = app.test_client()
+    headers = {"Authorization": f"Bearer {token}"}
+    # Page over exactly the seeded portfolios, starting directly before the first one
+    calls = {
+        "GET /portfolios/": f"/portfolios/?limit={len(portfolio_ids)}&cursor={encode_cursor(portfolio_ids[0] - 1)}",
+        "GET /portfolios/search/<portfolio_id>": f"/portfolios/search/{portfolio_ids[0]}",
+    }
+    counts = {}
+    for endpoint, path in calls.items():
+        # Warm up first, so one-off lookups cached per worker (such as the token version) are not counted
+        client.get(path, headers=headers)
+        statements.clear()
+        response = client.get(path, headers=headers)
+        counts[endpoint] = len(statements)
+        if response.status_code != 200:
+            raise RuntimeError(f"{endpoint} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        body = response.get_json()
+        if endpoint == "GET /portfolios/" and [portfolio["portfolioID"] for portfolio in body["data"]] != portfolio_ids:
+            raise RuntimeError(f"{endpoint} did not return the {len(portfolio_ids)} seeded portfolios")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--small", type=int, default=5, help="Portfolios (and owned assets per portfolio) seeded for the first run.")
+    parser.add_argument("--large", type=int, default=50, help="Portfolios (and owned assets per portfolio) seeded for the second run.")
+    args = parser.parse_args()
+    if not 1 <= args.small < args.large <= 1000:
+        parser.error("expected 1 <= --small < --large <= 1000 (the largest page the list endpoint returns)")
+
+    app = create_app()
+    # Count the SQL statements sent while a request runs, requests run one at a time
+    statements = []
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", lambda *_: statements.append(None))
+
+    tag = uuid.uuid4().hex[:12]
+    asset_ids, token = setup_assets(app, tag, args.large)
+    results = {}
+    try:
+        for size in (args.small, args.large):
+            portfolio_ids = seed_portfolios(app, tag, asset_ids, size)
+            try:
+                results[size] = count_statements(app, token, portfolio_ids, statements)
+            finally:
+                # Keep the admin, only the seeded portfolios' users are removed between runs
+                delete_users(app, f"benchmark-{tag}-{size}-")
+    finally:
+        teardown(app, tag, asset_ids)
+
+    failures = []
+    print(f"{'endpoint':<40} " + " ".join(f"{f'{size} portfolios':>15}" for size in results))
+    for endpoint in results[args.small]:
+        counts = [results[size][endpoint] for size in results]
+        print(f"{endpoint:<40} " + " ".join(f"{count:>15}" for count in counts))
+        if len(set(counts)) > 1:
+            failures.append(f"{endpoint} sent {counts[0]} statements for {args.small} portfolios and {counts[1]} for {args.large}")
+    if failures:
+        print("FAILED:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("OK: the portfolio endpoints send the same number of SQL statements whatever the number of portfolios.")
+
+
+if __name__ == "__main__":
+    main()
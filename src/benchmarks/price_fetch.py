@@ -0,0 +1,53 @@
+"""
+Price fetch benchmark, comparing a serial fetch of a large asset universe with the chunked parallel fetch.
+
+The script fetches the market data of '--assets' coins through the fake price provider (no network
+access), with every call taking '--latency' milliseconds as a round trip to CoinGecko would. The serial
+fetch makes one call per chunk of '--chunk-size' coin IDs after the other; the parallel fetch is the app's
+price provider (ConfiguredPriceProvider) with PRICE_PROVIDER_WORKERS threads. Both must return the same
+market data.
+
+Usage (from the src folder):
+    python -m benchmarks.price_fetch --assets 5000 --latency 300 --workers 20
+"""
+import argparse
+import time
+
+from flask import Flask
+
+from services.price_provider import ConfiguredPriceProvider, FakePriceProvider
+from utils.fixtures import load_markets_fixture
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--assets", type=int, default=5000, help="Coins in the fetched universe.")
+    parser.add_argument("--latency", type=float, default=300, help="Milliseconds every provider call takes.")
+    parser.add_argument("--chunk-size", type=int, default=250, help="Coin IDs fetched per call.")
+    parser.add_argument("--workers", type=int, default=20, help="Threads fetching the chunks in parallel.")
+    args = parser.parse_args()
+
+    extra_assets = max(args.assets - len(load_markets_fixture()), 0)
+    app = Flask(__name__)
+    app.config.update(
+        PRICE_PROVIDER="fake", PRICE_PROVIDER_FAKE_ASSETS=extra_assets, PRICE_PROVIDER_FAKE_LATENCY_MS=args.latency,
+        PRICE_PROVIDER_CHUNK_SIZE=args.chunk_size, PRICE_PROVIDER_WORKERS=args.workers
+    )
+    parallel = ConfiguredPriceProvider(app=app)
+    serial = FakePriceProvider(extra_assets=extra_assets, latency=args.latency / 1000)
+    serial.chunk_size = args.chunk_size
+    ids = [coin["id"] for coin in serial.get_top_coins(args.assets)]
+
+    results = {}
+    for label, provider in (("serial", serial), ("parallel", parallel)):
+        start = time.perf_counter()
+        results[label] = provider.get_markets(ids)
+        elapsed = time.perf_counter() - start
+        print(f"{label:<9} {len(results[label])} coins in {-(-len(ids) // args.chunk_size)} calls: {elapsed:.2f}s ({elapsed / (args.latency / 1000):.1f} round trips)")
+
+    if results["serial"] != results["parallel"]:
+        raise SystemExit("The serial and parallel fetches returned different market data.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Serialization benchmark for the list endpoints, comparing the marshmallow path with the fast column path.
+
+The script adds a throwaway portfolio with many transactions, then pages through GET /transactions,
+GET /assets/owned and GET /assets of the real app (create_app()) with FAST_JSON_SERIALIZATION off and on.
+For every endpoint it checks that both paths return byte for byte the same responses, and reports the
+time per page. It also times serialization alone (rows already loaded) for a page of transactions, to
+separate it from the query.
+
+The benchmark deletes its user, portfolio, asset and transactions again when it is done, and makes no
+calls to CoinGecko.
+
+Usage (from the src folder, with DATABASE_URI and JWT_SECRET_KEY set and the tables created):
+    python -m benchmarks.serialization --transactions 50000 --limit 1000 --repeat 5
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+
+# The background price refresher is not needed for reads
+os.environ.setdefault("PRICE_REFRESH_INTERVAL", "0")
+
+from flask_jwt_extended import create_access_token
+
+from main import create_app
+from init import db
+from models.assets import Asset
+from models.ownedAssets import OwnedAsset
+from models.portfolios import Portfolio
+from models.transactions import Transaction
+from models.users import User
+from controllers.transactions_controller import transactions_serializer
+from utils.pagination import paginate_keyset
+
+
+def setup(app, count):
+    # Create a throwaway admin with a portfolio holding 'count' transactions of a throwaway asset
+    tag = uuid.uuid4().hex[:12]
+    with app.app_context():
+        asset = Asset(assetID=f"benchmark-{tag}", marketCapPos=0, symbol="BENCH", name=f"Benchmark {tag}", price=1.25, lastUpdated=datetime.now(timezone.utc))
+        user = User(email=f"benchmark-{tag}@email.com", password="not-a-valid-hash", is_admin=True)
+        portfolio = Portfolio(name="Benchmark", description="Serialization benchmark", date=date.today(), user=user)
+        db.session.add_all([
+            asset,
+            user,
+            portfolio,
+            OwnedAsset(symbol=asset.symbol, name=asset.name, quantity=count, price=1.25, asset=asset, portfolio=portfolio)
+        ])
+        db.session.flush()
+        start = date.today() - timedelta(days=count // 100)
+        db.session.execute(db.insert(Transaction), [
+            {
+                "transactionType": "buy",
+                "quantity": 1 + index % 50,
+                "price": 1.25 + index % 997 / 100,
+                "totalCost": (1 + index % 50) * (1.25 + index % 997 / 100),
+                "date": start + timedelta(days=index // 100),
+                "assetID": asset.assetID,
+                "portfolioID": portfolio.portfolioID
+            }
+            for index in range(count)
+        ])
+        db.session.commit()
+        claims = {"is_admin": True, "portfolioID": portfolio.portfolioID, "ver": user.tokenVersion}
+        token = create_access_token(identity=str(user.userID), additional_claims=claims)
+        return asset.assetID, user.userID, token
+
+
+def teardown(app, asset_id, user_id):
+    # Deleting the user and asset cascades to the portfolio, transactions and owned assets
+    with app.app_context():
+        db.session.delete(db.session.get(User, user_id))
+        db.session.delete(db.session.get(Asset, asset_id))
+        db.session.commit()
+
+
+def fetch_all(client, url, headers, limit):
+    # Page through a paginated endpoint (or fetch a list endpoint), returning the bodies and the time per page
+    bodies, timings = [], []
+    cursor = None
+    while True:
+        query = {"limit": limit}
+        if cursor:
+            query["cursor"] = cursor
+        start = time.perf_counter()
+        response = client.get(url, headers=headers, query_string=query)
+        timings.append(time.perf_counter() - start)
+        bodies.append(response.data)
+        payload = response.get_json()
+        cursor = payload.get("next_cursor") if isinstance(payload, dict) else None
+        if not cursor:
+            return bodies, timings
+
+
+def compare_endpoint(app, url, headers, limit, repeat):
+    client = app.test_client()
+    results = {}
+    for fast in (False, True):
+        app.config["FAST_JSON_SERIALIZATION"] = fast
+        best = None
+        for _ in range(repeat):
+            bodies, timings = fetch_all(client, url, headers, limit)
+            if best is None or sum(timings) < sum(best[1]):
+                best = (bodies, timings)
+        results[fast] = best
+    identical = results[False][0] == results[True][0]
+    return len(results[True][0]), sum(results[False][1]) / len(results[False][1]), sum(results[True][1]) / len(results[True][1]), identical
+
+
+def serialization_only(app, limit, repeat):
+    # Time serialization alone on one page of rows that are already loaded
+    timings = {}
+    with app.test_request_context(query_string={"limit": limit}):
+        for fast in (False, True):
+            app.config["FAST_JSON_SERIALIZATION"] = fast
+            rows, next_cursor = paginate_keyset(transactions_serializer.select(), Transaction.transactionID, scalars=transactions_serializer.selects_entities())
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                response = app.make_response(transactions_serializer.page_response(rows, next_cursor))
+                response.get_data()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings[fast] = (best, len(rows))
+            db.session.expunge_all()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transactions", type=int, default=50000, help="Number of transactions to create.")
+    parser.add_argument("--limit", type=int, default=1000, help="Page size requested from the paginated endpoints.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per path, the fastest is reported.")
+    args = parser.parse_args()
+
+    app = create_app()
+    asset_id, user_id, token = setup(app, args.transactions)
+    headers = {"Authorization": f"Bearer {token}"}
+    failures = []
+    try:
+        print(f"{'endpoint':<16} {'pages':>6} {'schema ms/page':>15} {'fast ms/page':>13} {'speedup':>8} {'identical':>10}")
+        for url in ("/transactions/", "/assets/owned/", "/assets/"):
+            pages, slow, fast, identical = compare_endpoint(app, url, headers, args.limit, args.repeat)
+            print(f"{url:<16} {pages:>6} {slow * 1000:>15.2f} {fast * 1000:>13.2f} {slow / fast:>7.1f}x {str(identical):>10}")
+            if not identical:
+                failures.append(f"{url} responses differ between the schema and the fast path")
+
+        timings = serialization_only(app, args.limit, args.repeat)
+        (slow, rows), (fast, _) = timings[False], timings[True]
+        print(f"Serialization only, {rows} transactions: schema {slow * 1000:.2f} ms, fast {fast * 1000:.2f} ms ({slow / fast:.1f}x)")
+    finally:
+        teardown(app, asset_id, user_id)
+
+    if failures:
+        print("FAILED:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("OK: the fast path returns the same bytes as the marshmallow path.")
+
+
+if __name__ == "__main__":
+    main()
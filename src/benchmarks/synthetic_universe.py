@@ -0,0 +1,57 @@
+"""
+Check that the fake price provider serves every asset created by 'flask db seed-synthetic'.
+
+The script adds the assets of a synthetic data set of '--assets' assets (see seed_assets in
+services/synthetic_data.py) inside a transaction that is rolled back, so the database is left unchanged,
+and looks their IDs up through the fake price provider configured with the made up coins past the bundled
+snapshot, as PRICE_PROVIDER_FAKE_ASSETS should be set for that data set. Every seeded asset must be known
+to the provider with the same symbol and name, otherwise its price is never refreshed and
+'flask db sync-assets --mark-delisted' would mark it delisted.
+
+Usage (from the src folder, with DATABASE_URI set and the tables created):
+    python -m benchmarks.synthetic_universe --assets 5000
+"""
+import argparse
+import os
+import random
+import sys
+
+# The background price refresher is not needed, no prices are read
+os.environ.setdefault("PRICE_REFRESH_INTERVAL", "0")
+
+from main import create_app
+from init import db
+from services.price_provider import FakePriceProvider
+from services.synthetic_data import seed_assets
+from utils.fixtures import load_markets_fixture
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--assets", type=int, default=5000, help="Assets of the synthetic data set.")
+    args = parser.parse_args()
+
+    coins = load_markets_fixture()
+    app = create_app()
+    with app.app_context(), db.engine.connect() as conn:
+        # Seed as 'flask db seed-synthetic' does, then undo it
+        seeded = seed_assets(conn, conn.connection.cursor(), coins, args.assets, random.Random(0))
+        conn.rollback()
+
+    provider = FakePriceProvider(coins, extra_assets=max(args.assets - len(coins), 0))
+    markets = provider.get_markets([asset_id for asset_id, *_ in seeded])
+    failures = [
+        f"{asset_id} ({symbol}, {name})" for asset_id, symbol, name, _ in seeded
+        if asset_id not in markets or (markets[asset_id]["symbol"].upper(), markets[asset_id]["name"]) != (symbol, name)
+    ]
+    print(f"Seeded assets: {len(seeded)}, served by the fake price provider: {len(seeded) - len(failures)}")
+    if failures:
+        print("FAILED, not served or served under another symbol or name:")
+        for failure in failures[:20]:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("OK: every seeded asset is served by the fake price provider.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Concurrent trade stress test for POST /transactions/trade.
+
+Many threads sell the same asset out of the same portfolio at once through the real app (create_app()),
+so every trade contends for the same portfolio and owned asset rows. Afterwards the script checks that:
+- the portfolio was never oversold (exactly as many sells succeeded as there were units to sell),
+- the owned asset quantity matches the successful sells,
+- the portfolio holdings match the transactions ledger,
+- no request failed with a server error,
+and reports the throughput and latency of the trades under contention.
+
+The test creates its own user, portfolio and asset and deletes them again when it is done, it makes no
+calls to CoinGecko. It must run against PostgreSQL, as it relies on row locking.
+
+Usage (from the src folder, with DATABASE_URI and JWT_SECRET_KEY set and the tables created):
+    python -m benchmarks.trade_contention --threads 16 --trades 50 --quantity 400
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+import uuid
+from datetime import date, datetime, timezone
+
+# The background price refresher is not needed, prices are read from the database
+os.environ.setdefault("PRICE_REFRESH_INTERVAL", "0")
+
+from flask_jwt_extended import create_access_token
+
+from main import create_app
+from init import db
+from models.assets import Asset
+from models.ownedAssets import OwnedAsset
+from models.portfolios import Portfolio
+from models.transactions import Transaction
+from models.users import User
+
+
+def setup(app, quantity):
+    # Create a throwaway user owning 'quantity' units of a throwaway asset
+    tag = uuid.uuid4().hex[:12]
+    with app.app_context():
+        asset = Asset(assetID=f"benchmark-{tag}", marketCapPos=0, symbol="BENCH", name=f"Benchmark {tag}", price=1.0, lastUpdated=datetime.now(timezone.utc))
+        user = User(email=f"benchmark-{tag}@email.com", password="not-a-valid-hash")
+        portfolio = Portfolio(name="Benchmark", description="Trade contention benchmark", date=date.today(), holdings=quantity * 1.0, user=user)
+        db.session.add_all([
+            asset,
+            user,
+            portfolio,
+            Transaction(transactionType="buy", quantity=quantity, price=1.0, totalCost=quantity * 1.0, date=date.today(), asset=asset, portfolio=portfolio),
+            OwnedAsset(symbol=asset.symbol, name=asset.name, quantity=quantity, price=1.0, asset=asset, portfolio=portfolio)
+        ])
+        db.session.commit()
+        token = create_access_token(identity=str(user.userID))
+        return asset.assetID, user.userID, portfolio.portfolioID, token
+
+
+def teardown(app, asset_id, user_id):
+    # Deleting the user and asset cascades to the portfolio, transactions and owned assets
+    with app.app_context():
+        db.session.delete(db.session.get(User, user_id))
+        db.session.delete(db.session.get(Asset, asset_id))
+        db.session.commit()
+
+
+def run_trades(app, token, asset_id, threads, trades_per_thread):
+    headers = {"Authorization": f"Bearer {token}"}
+    body = {"transactionType": "sell", "quantity": 1, "assetID": asset_id}
+    barrier = threading.Barrier(threads)
+    statuses, latencies = [], []
+    lock = threading.Lock()
+
+    def worker():
+        client = app.test_client()
+        local_statuses, local_latencies = [], []
+        # Start every thread at the same time to maximise contention
+        barrier.wait()
+        for _ in range(trades_per_thread):
+            start = time.perf_counter()
+            response = client.post("/transactions/trade", json=body, headers=headers)
+            local_latencies.append(time.perf_counter() - start)
+            local_statuses.append(response.status_code)
+        with lock:
+            statuses.extend(local_statuses)
+            latencies.extend(local_latencies)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return statuses, latencies, time.perf_counter() - start
+
+
+def check(app, asset_id, portfolio_id, quantity, statuses):
+    failures = []
+    sold = statuses.count(201)
+    rejected = statuses.count(400)
+    attempts = len(statuses)
+
+    if sold != min(quantity, attempts):
+        failures.append(f"{sold} sells succeeded, expected {min(quantity, attempts)}")
+    if sold + rejected != attempts:
+        failures.append(f"{attempts - sold - rejected} requests failed with an unexpected status: {sorted(set(statuses) - {201, 400})}")
+
+    with app.app_context():
+        owned = db.session.scalar(db.select(OwnedAsset.quantity).filter_by(portfolioID=portfolio_id, assetID=asset_id)) or 0
+        sells = db.session.scalar(db.select(db.func.count()).select_from(Transaction).filter_by(portfolioID=portfolio_id, transactionType="sell"))
+        holdings = db.session.scalar(db.select(Portfolio.holdings).filter_by(portfolioID=portfolio_id))
+        ledger = db.session.scalar(db.select(db.func.sum(Transaction.totalCost)).filter_by(portfolioID=portfolio_id))
+
+    if owned != quantity - sold:
+        failures.append(f"Owned quantity is {owned}, expected {quantity - sold}")
+    if owned < 0:
+        failures.append(f"Portfolio was oversold, owned quantity is {owned}")
+    if sells != sold:
+        failures.append(f"{sells} sell transactions recorded, expected {sold}")
+    if abs(holdings - ledger) > 1e-6:
+        failures.append(f"Holdings are {holdings}, the transactions ledger totals {ledger}")
+    return failures
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16, help="Number of concurrent clients.")
+    parser.add_argument("--trades", type=int, default=50, help="Number of sells submitted by each client.")
+    parser.add_argument("--quantity", type=int, default=400, help="Units owned before the test, fewer than the total sells so some must be rejected.")
+    args = parser.parse_args()
+
+    app = create_app()
+    asset_id, user_id, portfolio_id, token = setup(app, args.quantity)
+    try:
+        statuses, latencies, elapsed = run_trades(app, token, asset_id, args.threads, args.trades)
+        failures = check(app, asset_id, portfolio_id, args.quantity, statuses)
+    finally:
+        teardown(app, asset_id, user_id)
+
+    print(f"Clients: {args.threads}, trades: {len(statuses)}, units owned: {args.quantity}")
+    print(f"Accepted: {statuses.count(201)}, rejected: {statuses.count(400)}")
+    print(f"Throughput: {len(statuses) / elapsed:.1f} trades/s over {elapsed:.2f}s")
+    print(
+        f"Latency ms: p50 {percentile(latencies, 0.50) * 1000:.1f}, "
+        f"p95 {percentile(latencies, 0.95) * 1000:.1f}, "
+        f"p99 {percentile(latencies, 0.99) * 1000:.1f}, "
+        f"mean {statistics.mean(latencies) * 1000:.1f}"
+    )
+    if failures:
+        print("FAILED:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("OK: no oversell, owned assets and holdings match the transactions ledger.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+from flask import Blueprint
+from flask_jwt_extended import jwt_required
+
+from init import db
+from services.db_pool import pool_stats
+from controllers.auth_controller import authorise_as_admin
+
+admin_bp = Blueprint("admin", __name__, url_prefix="/admin")
+
+
+# Retrieve the state of the database connection pool
+@admin_bp.route("/pool")
+@jwt_required()
+@authorise_as_admin()
+def retrieve_pool_stats():
+    """
+    Endpoint: GET /admin/pool
+
+    Functionality: Retrieves the state of this worker's database connection pool: its size and overflow limits, the number of connections checked out, idle and opened as overflow, and how long requests waited for a connection (mean, maximum and p50/p95/p99 of recent checkouts, and the number of checkouts that timed out). Every gunicorn worker has its own pool, so the numbers cover the worker that served the request. They are used to size DB_POOL_SIZE and DB_MAX_OVERFLOW for the worker count. This endpoint is restricted to administrators.
+
+    Input: None.
+    Output: A JSON object containing the pool counters and settings, and HTTP status code 200 (OK).
+
+    Errors:
+    - Returns a 403 Forbidden error message and status code if the requester is not an admin.
+
+    Requires:
+    - A valid JWT token in the Authorization header belonging to an administrative user.
+    """
+    return pool_stats(db.engine), 200
@@ -1,17 +1,44 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-
-from init import db, cg
+import re
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from flask import Blueprint, request, jsonify, current_app, Response, abort
+from flask_jwt_extended import jwt_required
+from sqlalchemy.dialects.postgresql import aggregate_order_by, array_agg, insert as pg_insert
+from werkzeug.http import http_date
+
+from init import db, price_provider, price_cache
 from models.assets import Asset, assets_schema, asset_schema
+from models.priceHistory import PriceHistory
+from controllers.auth_controller import authorise_as_admin
+from utils.serializers import RowSerializer
 
 assets_bp = Blueprint("assets", __name__, url_prefix="/assets")
+
+# Serializes asset lists straight from the selected columns (see FAST_JSON_SERIALIZATION)
+assets_serializer = RowSerializer(Asset, assets_schema)
+
+# Version of the stored asset prices, 'etag' is a strong entity tag and 'lastModified' the latest refresh time
+PriceVersion = namedtuple("PriceVersion", ["etag", "lastModified"])
+
+# Price history resolutions, '<count><unit>' such as '5m', and their unit lengths in seconds
+HISTORY_RESOLUTION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+# Maximum number of buckets returned by a single price history request
+MAX_HISTORY_BUCKETS = 5000
+HISTORY_MODES = ("ohlc", "last")
+
+# Price version cached by this worker, (PriceVersion, expiry time)
+_price_version = None
+_price_version_lock = threading.Lock()
  
 
-def get_all_assets():
+def get_all_assets(count=250):
         """
-        Functionality: Fetches and returns a list of cryptocurrency assets with their market data including symbol, name, and current price in USD. This function makes an external API call to CoinGecko to retrieve the market data for up to 250 cryptocurrencies, ensuring a comprehensive dataset is obtained.
+        Functionality: Fetches and returns a list of cryptocurrency assets with their market data including symbol, name, and current price in USD. This function calls the configured price provider (CoinGecko unless PRICE_PROVIDER says otherwise, see services/price_provider.py) to retrieve the market data of the 'count' largest cryptocurrencies by market cap, fetched in pages of PRICE_PROVIDER_CHUNK_SIZE coins in parallel, ensuring a comprehensive dataset is obtained.
 
-        Input: None. This function does not require any input parameters as it retrieves data based on predefined settings such as 'vs_currency' set to 'usd'.
+        Input: The number of cryptocurrencies to fetch, 250 by default. Prices are retrieved with 'vs_currency' set to 'usd'.
 
         Output: A list of Asset instances, each populated with the 'assetID', 'marketCapPos', 'symbol', 'name', and 'price' of a cryptocurrency. These Asset instances are ready to be processed further, such as being added to a database.
 
@@ -20,74 +47,294 @@ def get_all_assets():
         """
         try:
             # Fetch market data for cryptocurrencies in USD
-            coins_market = cg.get_coins_markets(vs_currency='usd', per_page=250, page=1)
-            print("trying to fetch assets")
+            coins_market = price_provider.get_top_coins(count, vs_currency='usd')
+            fetched_at = datetime.now(timezone.utc)
+            # Keep the fetched market data in the price cache for later price lookups
+            price_cache.put_many(coins_market)
             assets = []
             # Extract symbol, name, and price in USD for each cryptocurrency
-            unique_coins = []  # Use a set to track unique coin IDs
+            unique_coins = set()  # Use a set to track unique coin IDs
             for coin in coins_market:
                 # Check if coin ID is already processed to ensure uniqueness
-                if coin not in unique_coins:
-                    unique_coins.append(coin['id'])
+                if coin['id'] not in unique_coins:
+                    unique_coins.add(coin['id'])
                     assets.append(
                         Asset(
                             assetID= coin['id'],
                             marketCapPos= coin['market_cap_rank'],
                             symbol= coin['symbol'].upper(),
                             name= coin['name'],
-                            price= coin['current_price']
+                            price= coin['current_price'],
+                            lastUpdated= fetched_at
                         ) 
                     )
                 else:
-                    print(f"Coin id '{coin['id']}' allready added.") 
+                    current_app.logger.debug("Coin id '%s' already added.", coin['id'])
             
             return assets
         except Exception as e:
+            current_app.logger.warning("Unable to retrieve assets from the price provider: %s", e)
             # Handle exceptions by returning an error message and a 501 status code
             return jsonify({"error": "Service Unavailable. Unable to retrieve data from CoinGecko at this time."}), 503
         
 
+# Key for the advisory lock that serialises price refreshes across app workers
+PRICE_REFRESH_LOCK_KEY = 4242001
+
+
 def update_asset_prices():
     """
-    Functionality: Updates the prices and market capitalization positions of all assets listed in the database by fetching the latest market data from CoinGecko. This operation ensures that the asset information in the database reflects the current market conditions accurately.
+    Functionality: Updates the prices and market capitalization positions of all assets listed in the database by fetching the latest market data from CoinGecko through the price cache. This operation ensures that the asset information in the database reflects the current market conditions accurately. It is run by the background price refresher (see 'services/price_refresher.py') and is never called from inside a request handler.
 
     Input: None. This operation does not require any input as it affects all assets stored in the database.
 
-    Output: None. While this operation does not return any direct output to the caller, it updates asset records in the database with the latest pricing and market capitalization data.
+    Output: The number of assets that were updated, 0 if another worker is already refreshing the prices, or None if the refresh failed. Every updated asset has its 'lastUpdated' timestamp set to the time its market data was fetched.
 
     Errors: 
-    - Potential errors during the process, such as issues with fetching data from CoinGecko or database update failures, are not directly handled by this function. These errors are to be caught and managed by the application's global error handlers.
+    - If CoinGecko is unavailable, the last known prices held by the price cache are used and 'lastUpdated' keeps reporting their real age.
+    - Errors while updating the database, or CoinGecko failures with nothing cached, are logged and the session is rolled back, leaving the previously stored prices in place.
 
     Requires:
     - Proper configuration and access to the CoinGecko API, as well as write access to the database where asset records are stored.
     """
     try:
-        # Retrieve all assets from the database ordered by market cap position
-        stmt = db.select(Asset).order_by(Asset.marketCapPos)
+        # Only one worker may refresh at a time, skip if the advisory lock is already held
+        if db.engine.dialect.name == "postgresql":
+            locked = db.session.scalar(db.select(db.func.pg_try_advisory_xact_lock(PRICE_REFRESH_LOCK_KEY)))
+            if not locked:
+                db.session.rollback()
+                return 0
+
+        # Retrieve all listed assets from the database ordered by market cap position, delisted ones have no price to refresh
+        stmt = db.select(Asset).where(Asset.delistedAt.is_(None)).order_by(Asset.marketCapPos)
         assets = db.session.execute(stmt).scalars().all()
 
         # Compile asset IDs for data fetch
         asset_ids = [asset.assetID for asset in assets]
 
-        # Fetch updated market data from CoinGecko
-        market_data = cg.get_coins_markets(vs_currency='usd', ids=','.join(asset_ids))
-
-        # Map CoinGecko IDs to their market data
-        market_data_map = {data['id']: data for data in market_data}
+        # Fetch updated market data, mapped by CoinGecko ID, through the price cache. Expired prices are fetched now rather than
+        # revalidated in the background, otherwise the stored prices would always lag one refresh behind
+        market_data_map = price_cache.get_many(asset_ids, fresh=True)
 
         # Update database records with fetched data
+        updated = 0
+        history = []
         for asset in assets:
             # Use the mapping to access the market data for each asset
-            data = market_data_map.get(asset.assetID)
-            if data:
-                asset.price = data.get('current_price', asset.price)  # Update price
-                asset.marketCapPos = data.get('market_cap_rank', asset.marketCapPos)  # Update market cap position
-        # Commit updates to the database
+            cached = market_data_map.get(asset.assetID)
+            # Skip assets whose stored price is already as recent as the cached one
+            if cached and (asset.lastUpdated is None or cached.fetchedAt > asset.lastUpdated):
+                asset.price = cached.data.get('current_price', asset.price)  # Update price
+                asset.marketCapPos = cached.data.get('market_cap_rank', asset.marketCapPos)  # Update market cap position
+                asset.lastUpdated = cached.fetchedAt  # Record when the price was fetched
+                history.append({"assetID": asset.assetID, "timestamp": asset.lastUpdated, "price": asset.price})
+                updated += 1
+        # Append the new prices to the price history with multi-row inserts
+        if history:
+            db.session.execute(pg_insert(PriceHistory).on_conflict_do_nothing(), history)
+        # Commit updates to the database (this also releases the advisory lock)
         db.session.commit()
-        return
-    except Exception as e:
-            # Handle exceptions by returning an error message and a 501 status code
-            return jsonify({"error": "Service Unavailable. Unable to retrieve data from CoinGecko at this time."}), 503
+        # Let this worker's clients see the new prices straight away
+        if updated:
+            invalidate_price_version()
+        return updated
+    except Exception:
+        # Keep the previously stored prices and log the failure
+        db.session.rollback()
+        current_app.logger.exception("Unable to retrieve data from CoinGecko at this time.")
+        return None
+
+
+def get_last_price_refresh():
+    """
+    Functionality: Returns the time of the most recent price refresh, used by the background refresher to decide if a refresh is due.
+
+    Input: None.
+    Output: A timezone aware datetime of the latest 'lastUpdated' value in the assets table, or None if no prices have been stored yet.
+    """
+    return db.session.scalar(db.select(db.func.max(Asset.lastUpdated)))
+
+
+def make_price_version(last_updated, count, delisted=0):
+    # The version changes whenever a price is refreshed, an asset is added or removed, or an asset is delisted
+    if last_updated is None:
+        return None
+    return PriceVersion(f"{count}-{delisted}-{int(last_updated.timestamp() * 1000000):x}", last_updated)
+
+
+def get_price_version():
+    """
+    Functionality: Returns the version of the stored asset prices, which changes with every price refresh. The version is cached by each worker for PRICE_VERSION_TTL seconds, so conditional requests can usually be answered without querying the database. The cache is cleared as soon as this worker refreshes the prices, refreshes made by other workers are picked up within PRICE_VERSION_TTL seconds.
+
+    Input: None.
+    Output: A PriceVersion, or None if no prices have been stored yet.
+    """
+    global _price_version
+    now = time.monotonic()
+    cached = _price_version
+    if cached and cached[1] > now:
+        return cached[0]
+
+    last_updated, count, delisted = db.session.execute(db.select(db.func.max(Asset.lastUpdated), db.func.count(), db.func.count(Asset.delistedAt))).one()
+    version = make_price_version(last_updated, count, delisted)
+    with _price_version_lock:
+        _price_version = (version, now + current_app.config.get("PRICE_VERSION_TTL", 2))
+    return version
+
+
+def invalidate_price_version():
+    # Clear this worker's cached price version, the next request reads it from the database again
+    global _price_version
+    with _price_version_lock:
+        _price_version = None
+
+
+def price_version_headers(version):
+    """
+    Functionality: Builds the validator headers of a response serving asset prices, so clients can revalidate it with a conditional request.
+
+    Input: The PriceVersion of the prices served, or None.
+    Output: A dictionary containing the 'ETag', 'Last-Modified' and 'Cache-Control' headers, or an empty dictionary if no prices have been stored yet.
+    """
+    if version is None:
+        return {}
+    return {
+        "ETag": f'"{version.etag}"',
+        "Last-Modified": http_date(version.lastModified),
+        # Caches may store the response but must revalidate it before every use
+        "Cache-Control": "no-cache"
+    }
+
+
+def not_modified_response(version):
+    """
+    Functionality: Answers a conditional GET without loading or serializing anything, if the client already holds the current version of the prices. 'If-None-Match' takes precedence over 'If-Modified-Since', as required by RFC 9110.
+
+    Input: The current PriceVersion, or None.
+    Output: A 304 Not Modified response if the client's copy is current, otherwise None.
+    """
+    if version is None:
+        return None
+    if request.if_none_match:
+        modified = not request.if_none_match.contains_weak(version.etag)
+    elif request.if_modified_since:
+        modified = version.lastModified.replace(microsecond=0) > request.if_modified_since
+    else:
+        return None
+    if modified:
+        return None
+    return Response(status=304, headers=price_version_headers(version))
+
+
+def parse_resolution(value):
+    """
+    Functionality: Parses a price history resolution such as '30s', '5m', '1h' or '1d'.
+
+    Input: The resolution string.
+    Output: The bucket length in seconds.
+
+    Errors:
+    - Aborts with a 400 Bad Request error if the resolution is invalid.
+    """
+    match = re.fullmatch(r"(\d+)([smhd])", value)
+    if not match or int(match.group(1)) == 0:
+        abort(400, description=f"Invalid resolution '{value}', use a number followed by s, m, h or d, such as '5m'")
+    return int(match.group(1)) * HISTORY_RESOLUTION_UNITS[match.group(2)]
+
+
+def parse_datetime_arg(name, default):
+    """
+    Functionality: Reads an optional ISO 8601 date or datetime from the query parameters of the current request. Values without a timezone are taken as UTC.
+
+    Input: The name of the query parameter, and the value to use if it was not given.
+    Output: A timezone aware datetime.
+
+    Errors:
+    - Aborts with a 400 Bad Request error if the value is not a valid date or datetime.
+    """
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        abort(400, description=f"Invalid '{name}' datetime '{value}', use ISO 8601 such as 2024-03-01 or 2024-03-01T12:00:00Z")
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def price_history_buckets(asset_id, start, end, step, mode):
+    """
+    Functionality: Downsamples the price history of an asset into buckets of 'step' seconds, aligned to the Unix epoch (so daily buckets start at midnight UTC). The aggregation runs in PostgreSQL over the (assetID, timestamp) primary key, so only one row per bucket leaves the database however many prices were recorded.
+
+    Input:
+    - asset_id: The asset to query.
+    - start, end: The time range, start included and end excluded.
+    - step: The bucket length in seconds.
+    - mode: 'ohlc' for the open, high, low and close price of every bucket, or 'last' for its last price.
+
+    Output: A list of dictionaries, one per bucket holding at least one price, ordered by time. Each has the bucket's start 'timestamp' and either 'open', 'high', 'low' and 'close', or 'price'.
+    """
+    bucket = (db.func.floor(db.extract("epoch", PriceHistory.timestamp) / step) * step).label("bucket")
+    # The last price of a bucket is the first of its prices ordered newest first
+    close = array_agg(aggregate_order_by(PriceHistory.price, PriceHistory.timestamp.desc()))[1]
+    if mode == "ohlc":
+        columns = [
+            array_agg(aggregate_order_by(PriceHistory.price, PriceHistory.timestamp))[1].label("open"),
+            db.func.max(PriceHistory.price).label("high"),
+            db.func.min(PriceHistory.price).label("low"),
+            close.label("close")
+        ]
+    else:
+        columns = [close.label("price")]
+
+    stmt = (
+        db.select(bucket, *columns)
+        .where(PriceHistory.assetID == asset_id, PriceHistory.timestamp >= start, PriceHistory.timestamp < end)
+        .group_by(bucket)
+        .order_by(bucket)
+    )
+    buckets = []
+    for row in db.session.execute(stmt):
+        values = row._asdict()
+        values["timestamp"] = datetime.fromtimestamp(float(values.pop("bucket")), timezone.utc).isoformat()
+        buckets.append(values)
+    return buckets
+
+
+def price_age_headers(*assets):
+    """
+    Functionality: Builds the response headers reporting how stale the prices served in a response are. The age reported is that of the oldest price in the response, in whole seconds.
+
+    Input: One or more Asset instances whose prices are being served.
+    Output: A dictionary containing the 'X-Price-Age' header, or an empty dictionary if any of the prices has never been refreshed.
+    """
+    timestamps = [asset.lastUpdated for asset in assets]
+    if not timestamps or None in timestamps:
+        return {}
+    age = datetime.now(timezone.utc) - min(timestamps)
+    return {"X-Price-Age": str(max(int(age.total_seconds()), 0))}
+
+
+# Retrieve the price cache counters
+@assets_bp.route("/cache")
+@jwt_required()
+@authorise_as_admin()
+def retrieve_price_cache_stats():
+    """
+    Endpoint: GET /assets/cache
+
+    Functionality: Retrieves the counters of the price cache sitting in front of CoinGecko (hits, misses, coalesced requests, stale prices served, upstream fetches and errors) along with its current size and settings. These are used to tune the cache TTL. This endpoint is restricted to administrators.
+
+    Input: None.
+    Output: A JSON object containing the price cache counters and settings, and HTTP status code 200 (OK).
+
+    Errors:
+    - Returns a 403 Forbidden error message and status code if the requester is not an admin.
+
+    Requires:
+    - A valid JWT token in the Authorization header belonging to an administrative user.
+    """
+    return price_cache.stats(), 200
 
 
 # Retrieve all available assets
@@ -96,13 +343,15 @@ def retrieve_all_assets():
     """
     Endpoint: GET /assets
 
-    Functionality: Retrieves a comprehensive list of all available assets from the database, including their symbols, names, current prices, and market capitalization positions. Prior to retrieval, this endpoint updates the price and market cap ranking of each asset to ensure the most current data is provided.
+    Functionality: Retrieves a comprehensive list of all available assets from the database, including their symbols, names, current prices, and market capitalization positions. Prices are kept fresh by the background price refresher, so this endpoint only reads from the database.
 
     Input: None. This request does not require any input parameters, making it accessible to anyone seeking information on available assets.
 
     Output: 
     - A JSON array containing the details of all assets, ordered by their market capitalization position. 
     - HTTP status code 200 (OK) is returned alongside the assets list upon successful retrieval.
+    - An 'X-Price-Age' header with the age in seconds of the oldest price served.
+    - 'ETag' and 'Last-Modified' headers identifying the version of the prices. A request sending them back in 'If-None-Match' or 'If-Modified-Since' gets an empty 304 Not Modified response while the prices have not been refreshed, without the assets being loaded again.
 
     Errors:
     - If no assets are found within the database, the endpoint returns a JSON object with an error message and a 404 Not Found status code.
@@ -111,17 +360,23 @@ def retrieve_all_assets():
     - No authentication or specific permissions are required for accessing this endpoint, allowing public access for querying all assets.
     """
 
-    # Call function to update asset prices and market cap positions
-    update_asset_prices()
+    # Answer from the cached price version if the client already has the current prices
+    not_modified = not_modified_response(get_price_version())
+    if not_modified:
+        return not_modified
 
     # Construct query to retrieve all assets, ordered by market cap position
-    stmt = db.select(Asset).order_by(Asset.marketCapPos)
-    assets = db.session.execute(stmt).scalars().all() 
+    stmt = assets_serializer.select().order_by(Asset.marketCapPos)
+    assets = assets_serializer.all(stmt)
 
     # If assets exist in the database
     if assets:
+        # Tag the response with the version of the prices actually served
+        timestamps = [asset.lastUpdated for asset in assets]
+        delisted = sum(asset.delistedAt is not None for asset in assets)
+        version = make_price_version(None if None in timestamps else max(timestamps), len(assets), delisted)
         # Serialize and return the list of assets as JSON
-        return assets_schema.dump(assets), 200
+        return assets_serializer.list_response(assets, 200, price_age_headers(*assets) | price_version_headers(version))
     # If no assets are found
     else:
         # Return an error message indicating no assets were found
@@ -142,6 +397,8 @@ def search_assets(asset_id):
     Output: 
     - Returns a JSON object containing the detailed information of the requested asset if found.
     - HTTP status code 200 (OK) is returned alongside the asset information upon successful retrieval.
+    - An 'X-Price-Age' header with the age in seconds of the price served.
+    - 'ETag' and 'Last-Modified' headers identifying the version of the prices, answered with an empty 304 Not Modified response by conditional requests while the prices have not been refreshed.
 
     Errors:
     - If no asset matching the provided `asset_id` exists within the database, the endpoint returns a JSON object with an error message and a 404 Not Found status code.
@@ -150,8 +407,11 @@ def search_assets(asset_id):
     - No authentication or specific permissions are required to access this endpoint, making it publicly accessible for querying asset details.
     """
 
-    # Call function to update asset prices and market cap positions
-    update_asset_prices()
+    # Answer from the cached price version if the client already has the current price
+    version = get_price_version()
+    not_modified = not_modified_response(version)
+    if not_modified:
+        return not_modified
 
     # Attempt to find the asset by 'asset_id' in the database
     stmt = db.select(Asset).filter_by(assetID = asset_id)
@@ -159,8 +419,60 @@ def search_assets(asset_id):
     # If the asset is found
     if asset:
         # Serialize and return the asset's details
-        return asset_schema.dump(asset), 200
+        return asset_schema.dump(asset), 200, price_age_headers(asset) | price_version_headers(version)
     # If the asset is not found
     else:
         # Return an error message indicating the asset was not found
-        return {"error": f"Asset with asset id '{asset_id}' not found"}, 404
\ No newline at end of file
+        return {"error": f"Asset with asset id '{asset_id}' not found"}, 404
+
+
+# Retrieve the price history of an asset
+@assets_bp.route("/history/<asset_id>")
+def retrieve_price_history(asset_id):
+    """
+    Endpoint: GET /assets/history/<asset_id>
+
+    Functionality: Retrieves the price history of an asset over a time range, downsampled to the requested resolution. Every price refresh appends the new prices to the history, the buckets are computed by the database so the response size depends only on the number of buckets, not on the number of prices recorded.
+
+    Input:
+    - `asset_id`: The unique identifier of the asset, passed as part of the URL path.
+    - Optional query parameters:
+        - 'from' / 'to': The time range as ISO 8601 dates or datetimes (UTC unless a timezone is given), 'from' included and 'to' excluded. Defaults to the last day.
+        - 'resolution': The bucket length, a number followed by s, m, h or d such as '5m'. Defaults to '1h'.
+        - 'mode': 'ohlc' (default) for the open, high, low and close price of every bucket, or 'last' for the last price of every bucket.
+
+    Output: A JSON object with the 'assetID', 'mode', 'resolution', 'from' and 'to' of the query, and 'data', a list of buckets ordered by time, each with its start 'timestamp' and its prices. Buckets without prices are left out. HTTP status code 200 (OK).
+
+    Errors:
+    - Returns a 400 Bad Request error if a query parameter is invalid, 'from' is not before 'to', or the range holds more than 5000 buckets at the requested resolution.
+    - Returns a 404 Not Found error if the asset does not exist.
+
+    Requires:
+    - No authentication or specific permissions are required, like the other public asset endpoints.
+    """
+
+    # Validate the query before touching the database
+    mode = request.args.get("mode", "ohlc")
+    if mode not in HISTORY_MODES:
+        abort(400, description=f"Invalid mode '{mode}', must be one of: {', '.join(HISTORY_MODES)}")
+    resolution = request.args.get("resolution", "1h")
+    step = parse_resolution(resolution)
+    end = parse_datetime_arg("to", datetime.now(timezone.utc))
+    start = parse_datetime_arg("from", end - timedelta(days=1))
+    if start >= end:
+        abort(400, description="'from' must be before 'to'")
+    if (end - start).total_seconds() / step > MAX_HISTORY_BUCKETS:
+        abort(400, description=f"The range holds more than {MAX_HISTORY_BUCKETS} buckets at resolution '{resolution}', use a coarser resolution or a shorter range")
+
+    # Ensure the asset exists
+    if db.session.get(Asset, asset_id) is None:
+        return {"error": f"Asset with asset id '{asset_id}' not found"}, 404
+
+    return {
+        "assetID": asset_id,
+        "mode": mode,
+        "resolution": resolution,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "data": price_history_buckets(asset_id, start, end, step, mode)
+    }, 200
@@ -1,20 +1,120 @@
 from datetime import timedelta
 import functools
+import threading
+import time
 
-from flask import Blueprint, request
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask import Blueprint, request, g, current_app
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity, get_jwt
 
-from init import db, bcrypt
+from init import db, password_hasher, jwt
 from models.users import User, user_schema
+from models.portfolios import Portfolio
 
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 
+# Cached token versions per user, {userID: (tokenVersion, expiry time)}
+_token_versions = {}
+_token_versions_lock = threading.Lock()
+
+
+def get_token_version(user_id):
+    """
+    Functionality: Returns the current token version of a user. Versions are cached in memory for JWT_VERSION_CACHE_TTL seconds, so checking whether a token has been revoked usually needs no database query.
+
+    Input: The user ID.
+    Output: The user's token version, or None if the user does not exist.
+    """
+    now = time.monotonic()
+    cached = _token_versions.get(user_id)
+    if cached and cached[1] > now:
+        return cached[0]
+
+    version = db.session.scalar(db.select(User.tokenVersion).filter_by(userID=user_id))
+    with _token_versions_lock:
+        _token_versions[user_id] = (version, now + current_app.config.get("JWT_VERSION_CACHE_TTL", 30))
+    return version
+
+
+def revoke_user_tokens(user_id):
+    """
+    Functionality: Revokes every token issued to a user so far by incrementing the user's token version. This must be called whenever the claims carried by a user's tokens (such as 'is_admin') should stop being trusted. Other app workers stop accepting the revoked tokens within JWT_VERSION_CACHE_TTL seconds.
+
+    Input: The user ID.
+    Output: None. The change is added to the session and is saved by the caller's commit.
+    """
+    db.session.execute(db.update(User).filter_by(userID=user_id).values(tokenVersion=User.tokenVersion + 1))
+    with _token_versions_lock:
+        _token_versions.pop(user_id, None)
+
+
+@jwt.token_in_blocklist_loader
+def check_token_revoked(jwt_header, jwt_payload):
+    # A token is revoked if its user no longer exists or its version is older than the user's token version
+    version = get_token_version(int(jwt_payload["sub"]))
+    return version is None or jwt_payload.get("ver", 0) != version
+
+
+def get_current_user():
+    """
+    Functionality: Returns the currently logged in user. The user is loaded at most once per request and memoized for the rest of it.
+
+    Input: None. The user ID is read from the JWT of the current request.
+    Output: The User instance of the currently logged in user, or None if the user does not exist.
+    """
+    if "current_user" not in g:
+        g.current_user = db.session.get(User, int(get_jwt_identity()))
+    return g.current_user
+
+
+def current_user_is_admin():
+    """
+    Functionality: Checks whether the currently logged in user is an admin, using the 'is_admin' claim minted into the JWT at login. Falls back to loading the user for tokens without the claim.
+
+    Input: None.
+    Output: True if the current user is an admin, False otherwise.
+    """
+    claims = get_jwt()
+    if "is_admin" in claims:
+        return bool(claims["is_admin"])
+    user = get_current_user()
+    return bool(user and user.is_admin)
+
+
+def get_current_portfolio_id(verify=False):
+    """
+    Functionality: Returns the portfolio ID of the currently logged in user, using the 'portfolioID' claim minted into the JWT at login when present. The portfolio is looked up at most once per request otherwise, and the result is memoized for the rest of it.
+
+    Input: verify - Set to True to ignore the claim and look the portfolio up in the database (once per request), for when the claim may be out of date because the portfolio was created or deleted after login.
+    Output: The portfolio ID of the current user, or None if the user has no portfolio.
+    """
+    if "current_portfolio_id" not in g:
+        g.current_portfolio_id = get_jwt().get("portfolioID")
+        g.current_portfolio_verified = False
+    if (verify or g.current_portfolio_id is None) and not g.current_portfolio_verified:
+        stmt = db.select(Portfolio.portfolioID).filter_by(userID=int(get_jwt_identity()))
+        g.current_portfolio_id = db.session.scalar(stmt)
+        g.current_portfolio_verified = True
+    return g.current_portfolio_id
+
+
+def current_user_owns_portfolio(portfolio_id):
+    """
+    Functionality: Checks whether the currently logged in user owns the given portfolio. Portfolio IDs are never reused, so a match with the 'portfolioID' claim needs no database query. A mismatch is confirmed against the database, as the claim may predate the user's current portfolio.
+
+    Input: The portfolio ID to check.
+    Output: True if the current user owns the portfolio, False otherwise.
+    """
+    if get_current_portfolio_id() == portfolio_id:
+        return True
+    return get_current_portfolio_id(verify=True) == portfolio_id
+
+
 def authorise_as_admin(custom_error_message=None):
     """
     Decorator: authorise_as_admin
 
-    Functionality: This decorator is used to restrict access to certain endpoints to only users with administrative privileges. It checks the role of the user making the request and allows the request to proceed if the user is an admin. Otherwise, it returns an error response.
+    Functionality: This decorator is used to restrict access to certain endpoints to only users with administrative privileges. It checks the role of the user making the request, using the 'is_admin' claim of the JWT so no database query is needed, and allows the request to proceed if the user is an admin. Otherwise, it returns an error response.
 
     Input: Optionally takes a custom error message to be returned if the user is not authorized.
     Output: The decorated function's output if the user is an admin, or a JSON error message and HTTP status code 403 (Forbidden) if not.
@@ -35,13 +135,8 @@ def authorise_as_admin(custom_error_message=None):
 
         @functools.wraps(fn)
         def wrapper(*args, **kwargs):
-            # Retrieve the currently logged-in user's ID from JWT token
-            current_user = get_jwt_identity()
-             # Query the database for the user with the retrieved ID
-            stmt = db.select(User).filter_by(userID=current_user)
-            user = db.session.scalar(stmt)
-            # Check if the user is marked as an admin
-            if user and user.is_admin:
+            # Check if the currently logged-in user is marked as an admin
+            if current_user_is_admin():
                 # Allow the request to proceed and execute the decorated function
                 return fn(*args, **kwargs)
             # else (if the user is NOT an admin)
@@ -62,17 +157,19 @@ def auth_register():
     Functionality: This endpoint handles user registration. It validates the input data,
     hashes the user's password for security, and creates a new user record in the database.
     Upon successful registration, it returns the newly created user data.
+    The password is hashed on the bounded password hashing pool (see 'services/password_hasher.py').
     
     Input: JSON object containing 'email' and 'password'.
     Output: JSON object of the registered user excluding the password, and HTTP status code 201 (Created).
 
     Errors: Returns appropriate error messages and HTTP status codes for invalid inputs or failed operations.
+    Returns 503 Service Unavailable if the password hashing pool is saturated.
     """
     # Validate and deserialize json input
     data = user_schema.load(request.get_json())
 
     # Hash the password
-    hashed_password = bcrypt.generate_password_hash(data.get('password')).decode('utf-8') if data.get('password') else None
+    hashed_password = password_hasher.generate_password_hash(data.get('password')) if data.get('password') else None
 
     # Create and save the user
     user = User(
@@ -95,12 +192,17 @@ def auth_login():
     checks for a user with the matching email, and verifies the password. Upon successful authentication,
     it generates a JWT access token with a specified expiration time and returns the user's email, access token,
     and admin status. If the email or password does not match, it returns an error.
+    The token carries the user's admin status ('is_admin'), portfolio ID ('portfolioID') and token version ('ver') as claims,
+    so most authorization checks need no database query. The token is rejected once the user's token version changes.
+    The password is verified on the bounded password hashing pool, and hashes created with a different
+    work factor than BCRYPT_LOG_ROUNDS are upgraded in the background after a successful login.
 
     Input: JSON object containing 'email' and 'password'.
     Output: On successful authentication, returns a JSON object with the user's email, a JWT access token, 
     and a boolean indicating whether the user is an admin, along with HTTP status code 200 (OK).
 
     Errors: Returns an error message and HTTP status code 401 (Unauthorized) for incorrect email or password.
+    Returns 503 Service Unavailable if the password hashing pool is saturated.
     """
     # Validate and deserialize json input
     data = user_schema.load(request.get_json())
@@ -110,9 +212,19 @@ def auth_login():
     user = db.session.scalar(stmt)
     
     # If email and password is correct
-    if user and data.get("password") and bcrypt.check_password_hash(user.password, data.get("password")):
+    if user and data.get("password") and password_hasher.check_password_hash(user.password, data.get("password")):
+        # Upgrade the password hash if it was created with a different work factor
+        if password_hasher.needs_rehash(user.password):
+            password_hasher.rehash_in_background(User, {"userID": user.userID}, data.get("password"), user.password)
+
+        # Mint the admin status, portfolio ID and token version into the token as claims
+        claims = {
+            "is_admin": bool(user.is_admin),
+            "portfolioID": user.portfolio.portfolioID if user.portfolio else None,
+            "ver": user.tokenVersion
+        }
         # Create JWT access token and return login information
-        token = create_access_token(identity=str(user.userID), expires_delta=timedelta(days=1))
+        token = create_access_token(identity=str(user.userID), expires_delta=timedelta(days=1), additional_claims=claims)
         return {"email": user.email, "token": token, "is_admin": user.is_admin}, 200
     # Else return error
     else:
@@ -142,9 +254,6 @@ def delete_user(user_id):
     # Get the current user's ID from the JWT token
     current_user_id = get_jwt_identity()
 
-    # Fetch the current user's record from the database
-    current_user = User.query.get(current_user_id)
-
     # Prepare a statement to find the user to delete by their user ID
     stmt = db.select(User).filter_by(userID=user_id)
     user_to_delete = db.session.scalar(stmt)
@@ -152,7 +261,7 @@ def delete_user(user_id):
     # If the user to delete is found in the database
     if user_to_delete:
         # Check if the current user is either the user to be deleted or an admin
-        if (str(user_to_delete.userID) == current_user_id) or (current_user.is_admin):
+        if (str(user_to_delete.userID) == current_user_id) or current_user_is_admin():
             # Delete the user record from the database and commit the changes
             db.session.delete(user_to_delete)
             db.session.commit()
@@ -163,4 +272,24 @@ def delete_user(user_id):
             return {"error": "Unauthorized. You do not have permission to perform this action."}, 401
     # Return an error if the user to be deleted was not found
     else:
-        return {"error": f"User with 'userID' '{user_id}' does not exist."}, 404
\ No newline at end of file
+        return {"error": f"User with 'userID' '{user_id}' does not exist."}, 404
+
+
+# Revoke all tokens of the current user
+@auth_bp.route("/revoke", methods=["POST"])
+@jwt_required()
+def revoke_tokens():
+    """
+    Endpoint: POST /auth/revoke
+
+    Functionality: Revokes every token issued to the currently logged in user, including the one used for this request, logging the user out everywhere. The user must log in again to receive a new token.
+
+    Input: None.
+    Output: JSON object with a message confirming the tokens were revoked, and HTTP status code 200 (OK).
+
+    Requires:
+    - JWT token in the Authorization header to authenticate the request.
+    """
+    revoke_user_tokens(int(get_jwt_identity()))
+    db.session.commit()
+    return {"message": "All tokens for this account have been revoked."}, 200
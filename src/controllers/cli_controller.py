@@ -1,14 +1,23 @@
-from datetime import date
+from datetime import date, datetime, timezone
 
+import click
 from flask import Blueprint, jsonify
 
-from init import db, bcrypt, cg
+from init import db, bcrypt, price_provider
 from models.users import User
 from models.portfolios import Portfolio
 from models.assets import Asset
 from models.ownedAssets import OwnedAsset
 from models.transactions import Transaction
+from models.lots import Lot
 from controllers.assets_controller import get_all_assets
+from controllers.portfolios_controller import reconcile_holdings, rebuild_holdings, REBUILD_CHUNK_SIZE
+from controllers.transactions_controller import export_transactions, EXPORT_FORMATS
+from services.asset_sync import SYNC_BATCH_SIZE, SYNC_LIMIT, sync_assets, upsert_assets
+from services.price_provider import PriceProviderError
+from services.synthetic_data import generate
+from utils.fixtures import load_markets_fixture
+from utils.migrations import MigrationError, get_current_revision, head_revision, stamp, upgrade, downgrade
 
 
 db_commands = Blueprint('db', __name__)
@@ -17,6 +26,8 @@ db_commands = Blueprint('db', __name__)
 @db_commands.cli.command("create")
 def create_tables():
     db.create_all()
+    # The tables match the models, so every migration is already applied
+    stamp(head_revision())
     print("Tables created successfully.")
 
 # Drops all tables from the database
@@ -25,6 +36,104 @@ def drop_tables():
     db.drop_all()
     print("Tables deleted successfully.")
 
+# Apply the migrations after the current revision of the database
+@db_commands.cli.command("upgrade")
+@click.option("--revision", help="Revision to upgrade to, defaults to the latest one.")
+def upgrade_database(revision):
+    try:
+        applied = upgrade(revision)
+    except MigrationError as err:
+        raise click.ClickException(str(err))
+    print(f"Database upgraded, {len(applied)} migration(s) applied." if applied else "Database is already up to date.")
+
+# Revert migrations, by default only the latest one
+@db_commands.cli.command("downgrade")
+@click.option("--revision", help="Revision to downgrade to, 'base' reverts every migration. Defaults to the previous revision.")
+def downgrade_database(revision):
+    try:
+        reverted = downgrade(revision)
+    except MigrationError as err:
+        raise click.ClickException(str(err))
+    print(f"Database downgraded, {len(reverted)} migration(s) reverted." if reverted else "No migration to revert.")
+
+# Show the revision the database is at
+@db_commands.cli.command("current")
+def current_revision():
+    current = get_current_revision()
+    latest = head_revision()
+    print(f"Current revision: {current or 'base'} (latest: {latest or 'base'})")
+
+# Reconcile portfolio holdings with the transactions ledger
+@db_commands.cli.command("reconcile-holdings")
+def reconcile_portfolio_holdings():
+    corrected = reconcile_holdings()
+    print(f"Reconciled portfolio holdings, {corrected} portfolio(s) corrected.")
+
+# Bulk load a synthetic data set for load testing, without calling CoinGecko
+@db_commands.cli.command("seed-synthetic")
+@click.option("--users", type=click.IntRange(min=0), default=1000, show_default=True, help="Users to create, each with a portfolio.")
+@click.option("--trades", type=click.IntRange(min=0), default=100000, show_default=True, help="Transactions to create, spread over the portfolios.")
+@click.option("--assets", type=click.IntRange(min=1), default=50, show_default=True, help="Assets traded, the offline snapshot coins first, then made up ones.")
+@click.option("--days", type=click.IntRange(min=1), default=365, show_default=True, help="Days of price history the trades are spread over.")
+@click.option("--password", default="123456", show_default=True, help="Password of every synthetic user.")
+@click.option("--batch-size", type=click.IntRange(min=1), default=10000, show_default=True, help="Users loaded and committed per batch.")
+@click.option("--seed", type=int, default=0, show_default=True, help="Seed of the random generator, the same seed gives the same data.")
+def seed_synthetic(users, trades, assets, days, password, batch_size, seed):
+    # Hash the shared password once, bcrypt is far too slow to run per user
+    password_hash = bcrypt.generate_password_hash(password).decode("utf-8")
+    with db.engine.connect() as conn:
+        counts = generate(conn, load_markets_fixture(), users, trades, assets, password_hash, days, batch_size, seed)
+    print("Seeded " + ", ".join(f"{count} {table}" for table, count in counts.items()) + ".")
+
+# Rebuild owned assets and portfolio holdings from the transactions ledger
+@db_commands.cli.command("rebuild-holdings")
+@click.option("--chunk-size", type=click.IntRange(min=1), default=REBUILD_CHUNK_SIZE, show_default=True, help="Portfolio IDs rebuilt per database transaction.")
+@click.option("--dry-run", is_flag=True, help="Only report the differences, without changing anything.")
+def rebuild_portfolio_holdings(chunk_size, dry_run):
+    totals = rebuild_holdings(chunk_size, dry_run)
+    action = "Found" if dry_run else "Rebuilt holdings, corrected"
+    print(
+        f"{action} {totals['updated']} owned asset(s) with a wrong quantity or cost, {totals['inserted']} missing, "
+        f"{totals['deleted']} not in the ledger, and {totals['holdings']} portfolio holding(s)."
+    )
+    if totals["oversold"]:
+        print(f"Warning: {totals['oversold']} position(s) sell more than they buy in the ledger and were left out of the owned assets.")
+    if totals["lotMismatch"]:
+        print(f"Warning: the cost basis lots of {totals['lotMismatch']} position(s) disagree with the ledger.")
+
+# Sync the assets table with the price provider's universe
+@db_commands.cli.command("sync-assets")
+@click.option("--limit", type=click.IntRange(min=1), default=SYNC_LIMIT, show_default=True, help="Coins synced, the largest by market cap.")
+@click.option("--batch-size", type=click.IntRange(min=1), default=SYNC_BATCH_SIZE, show_default=True, help="Assets upserted per statement.")
+@click.option("--mark-delisted", is_flag=True, help="Look up the other listed assets and mark the ones the provider no longer lists as delisted.")
+def sync_asset_universe(limit, batch_size, mark_delisted):
+    try:
+        with db.engine.begin() as conn:
+            counts = sync_assets(conn, price_provider, limit, batch_size, mark_delisted)
+    except PriceProviderError as err:
+        raise click.ClickException(f"Unable to fetch the assets from the price provider, no asset was changed: {err}")
+    print(
+        f"Synced assets: {counts['inserted']} inserted, {counts['updated']} updated, {counts['unchanged']} unchanged, "
+        f"{counts['skipped']} skipped without a price" + (f", {counts['delisted']} delisted." if mark_delisted else ".")
+    )
+
+# Stream the transactions ledger to a file (or stdout) as NDJSON or CSV
+@db_commands.cli.command("export-transactions")
+@click.option("--format", "export_format", type=click.Choice(list(EXPORT_FORMATS)), default="ndjson", help="Output format.")
+@click.option("--portfolio", "portfolio_id", type=int, help="Only export the transactions of this portfolio.")
+@click.option("--from", "date_from", type=click.DateTime(formats=["%Y-%m-%d"]), help="Only export transactions made on or after this date.")
+@click.option("--to", "date_to", type=click.DateTime(formats=["%Y-%m-%d"]), help="Only export transactions made on or before this date.")
+@click.option("--output", type=click.Path(allow_dash=True, dir_okay=False, writable=True), default="-", help="File to write to, defaults to stdout.")
+def export_transactions_command(export_format, portfolio_id, date_from, date_to, output):
+    with click.open_file(output, "w", encoding="utf-8") as file:
+        for chunk in export_transactions(
+            export_format,
+            portfolio_id,
+            date_from and date_from.date(),
+            date_to and date_to.date()
+        ):
+            file.write(chunk)
+
 # Populate the tables in the database
 @db_commands.cli.command("seed")
 def seed_tables():
@@ -45,7 +154,17 @@ def seed_tables():
 
 
     assets = get_all_assets()
-    db.session.add_all(assets)
+    # get_all_assets returns an error response when CoinGecko cannot be reached, seed the offline snapshot instead
+    if not isinstance(assets, list):
+        print("CoinGecko is unavailable, seeding assets from the offline market snapshot.")
+        assets = [
+            Asset(assetID=coin["id"], marketCapPos=coin["market_cap_rank"], symbol=coin["symbol"].upper(), name=coin["name"], price=coin["current_price"])
+            for coin in load_markets_fixture()
+        ]
+    # Upsert the assets, so seeding a database that already lists some of them does not fail
+    upsert_assets(db.session.connection(), [(asset.assetID, asset.marketCapPos, asset.symbol, asset.name, asset.price) for asset in assets], datetime.now(timezone.utc))
+    stored = {asset.assetID: asset for asset in db.session.scalars(db.select(Asset).where(Asset.assetID.in_([asset.assetID for asset in assets])))}
+    assets = [stored[asset.assetID] for asset in assets]
     print("Seeding assets table.")
 
     portfolios = [
@@ -149,5 +268,19 @@ def seed_tables():
 
     db.session.add_all(owned_asset)
     print("Seeding ownedAssets table.")
+
+    # Every seeded buy opens a cost basis lot
+    lots = [
+        Lot(
+            quantity=transaction.quantity,
+            price=transaction.price,
+            date=transaction.date,
+            portfolio=transaction.portfolio,
+            asset=transaction.asset
+        )
+        for transaction in transactions
+    ]
+    db.session.add_all(lots)
+    print("Seeding lots table.")
     db.session.commit()
     print("Successfully seeded all tables in the database.")
\ No newline at end of file
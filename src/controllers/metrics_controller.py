@@ -0,0 +1,54 @@
+from flask import Blueprint, Response
+from flask_jwt_extended import jwt_required
+
+from init import db, metrics, price_cache
+from services.db_pool import pool_stats
+from services.metrics import CONTENT_TYPE
+from controllers.auth_controller import authorise_as_admin
+
+metrics_bp = Blueprint("metrics", __name__)
+
+
+def scrape_samples():
+    # State read when scraped: this worker's connection pool and price cache, occupancy as gauges and running totals as counters
+    stats = pool_stats(db.engine)
+    samples = [
+        ("db_pool_checked_out", "gauge", "Connections checked out of this worker's pool.", stats.get("checked_out", 0)),
+        ("db_pool_idle", "gauge", "Connections idle in this worker's pool.", stats.get("idle", 0)),
+        ("db_pool_overflow", "gauge", "Connections opened beyond the pool size.", stats.get("overflow", 0))
+    ]
+    if "wait" in stats:
+        samples += [
+            ("db_pool_checkouts_total", "counter", "Connections checked out of the pool since the worker started.", stats["wait"]["checkouts"]),
+            ("db_pool_checkout_timeouts_total", "counter", "Checkouts that timed out waiting for a connection since the worker started.", stats["wait"]["timeouts"])
+        ]
+    cache = price_cache.stats()
+    samples += [
+        ("price_cache_size", "gauge", "Coins held in the price cache.", cache["size"]),
+        ("price_cache_hits_total", "counter", "Price cache lookups answered from a fresh entry.", cache["hits"]),
+        ("price_cache_misses_total", "counter", "Price cache lookups fetched from the price provider.", cache["misses"]),
+        ("price_cache_upstream_errors_total", "counter", "Failed price provider fetches made by the price cache.", cache["upstream_errors"])
+    ]
+    return samples
+
+
+# Retrieve the app's metrics for Prometheus
+@metrics_bp.route("/metrics")
+@jwt_required()
+@authorise_as_admin()
+def retrieve_metrics():
+    """
+    Endpoint: GET /metrics
+
+    Functionality: Retrieves this worker's metrics in the Prometheus text format: the number and duration of requests per endpoint, the SQL statements run per request and their duration, the duration of every statement and the number of slow ones, the duration of price provider calls, and the state of the connection pool and price cache (see services/metrics.py). Prometheus scrapes it with an administrator's token as a bearer token. This endpoint is restricted to administrators.
+
+    Input: None.
+    Output: The metrics as 'text/plain; version=0.0.4', and HTTP status code 200 (OK).
+
+    Errors:
+    - Returns a 403 Forbidden error message and status code if the requester is not an admin.
+
+    Requires:
+    - A valid JWT token in the Authorization header belonging to an administrative user.
+    """
+    return Response(metrics.render(scrape_samples()), status=200, content_type=CONTENT_TYPE)
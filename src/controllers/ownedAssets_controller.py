@@ -1,14 +1,16 @@
-from flask import Blueprint
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask import Blueprint, request
+from flask_jwt_extended import jwt_required
 
-from init import db
 from models.ownedAssets import OwnedAsset, ownedAssets_schema
-from models.portfolios import Portfolio
-from models.users import User
-from controllers.auth_controller import authorise_as_admin
+from controllers.auth_controller import authorise_as_admin, current_user_is_admin, current_user_owns_portfolio
+from utils.pagination import paginate_keyset
+from utils.serializers import RowSerializer
 
 ownedAssets_bp = Blueprint("ownedAssets", __name__, url_prefix="/assets/owned")
 
+# Serializes owned asset pages straight from the selected columns (see FAST_JSON_SERIALIZATION)
+ownedAssets_serializer = RowSerializer(OwnedAsset, ownedAssets_schema)
+
 
 @ownedAssets_bp.route("/")
 @jwt_required()
@@ -17,13 +19,14 @@ def retrieve_owned_assets():
     """
     Endpoint: GET /assets/owned
 
-    Functionality: Retrieves a comprehensive list of all owned assets across every portfolio in the database, exclusively accessible to administrators. This endpoint provides a detailed overview of assets, including symbol, name, quantity, and price, aiding in the administrative monitoring and analysis of asset distribution within the system.
+    Functionality: Retrieves a comprehensive list of all owned assets across every portfolio in the database, exclusively accessible to administrators. This endpoint provides a detailed overview of assets, including symbol, name, quantity, and price, aiding in the administrative monitoring and analysis of asset distribution within the system. Owned assets are returned one page at a time, ordered by 'ID', using keyset pagination.
 
-    Input: None required. The endpoint does not need any input parameters to function.
+    Input: Optional query parameters 'limit' (number of owned assets per page, default 100, maximum 1000) and 'cursor' (the 'next_cursor' value of the previous page).
 
-    Output: Provides a JSON array comprising detailed information on all owned assets within the system if available.
+    Output: Provides a JSON object with 'data', an array comprising detailed information on the owned assets in the page, and 'next_cursor', the cursor of the next page or null on the last page.
 
     Errors:
+    - Returns a 400 Bad Request status code if the 'limit' or 'cursor' query parameters are invalid.
     - Returns a 403 Forbidden status code if the requester lacks administrative privileges.
     - Returns a 404 Not Found status code if no assets are found within the database.
     - Encounters during database operations or data serialization are addressed by the application's global error handling mechanisms.
@@ -32,13 +35,13 @@ def retrieve_owned_assets():
     - A valid JWT token is necessary to validate the requester's administrative status, ensuring that the sensitive data remains secure and is only accessible to authorized personnel.
     """
 
-    # Execute query to retrieve all owned assets from the database
-    stmt = db.select(OwnedAsset)
-    assets = db.session.execute(stmt).scalars().all()
-    # If assets exist
-    if assets:
-        # Serialize and return the retrieved assets as JSON
-        return ownedAssets_schema.dump(assets), 200
+    # Execute query to retrieve a page of owned assets from the database
+    stmt = ownedAssets_serializer.select()
+    assets, next_cursor = paginate_keyset(stmt, OwnedAsset.ID, scalars=ownedAssets_serializer.selects_entities())
+    # If assets exist, or a later page is requested
+    if assets or request.args.get("cursor"):
+        # Serialize and return the retrieved page of assets as JSON
+        return ownedAssets_serializer.page_response(assets, next_cursor)
     # Else if assets do not exist
     else:
         # Return error response
@@ -68,13 +71,8 @@ def retrieve_portfolio_assets(portfolio_id):
 
     # If owned_assets exists
     if owned_assets:
-        # Attempt to retrieve the portfio of the currently logged in user
-        current_user = Portfolio.query.filter_by(userID=get_jwt_identity()).first()
-        # Attempt to retrieve the User profile of the currently logged in user
-        current_user_ID = User.query.filter_by(userID=get_jwt_identity()).first()
-
         # If current user is an admin or owns the portfolio containing the assets
-        if current_user_ID.is_admin or current_user and current_user.portfolioID == portfolio_id:
+        if current_user_is_admin() or current_user_owns_portfolio(portfolio_id):
             # Return owned assets list
             return ownedAssets_schema.dump(owned_assets), 200
         # Else if current user is not authorised
@@ -1,61 +1,312 @@
-from datetime import date
+from datetime import date, datetime, time, timedelta, timezone
 
-from flask import Blueprint, request
+from flask import Blueprint, request, abort
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from init import db
-from models.users import User
 from models.portfolios import Portfolio, portfolio_schema, portfolios_schema
 from models.transactions import Transaction
 from models.ownedAssets import OwnedAsset
-from controllers.auth_controller import authorise_as_admin
-from controllers.transactions_controller import update_owned_assets
+from models.assets import Asset
+from models.lots import Lot
+from models.priceHistory import PriceHistory
+from sqlalchemy.dialects.postgresql import aggregate_order_by, array_agg
+from controllers.assets_controller import price_age_headers
+from controllers.auth_controller import authorise_as_admin, current_user_is_admin, current_user_owns_portfolio
+from controllers.transactions_controller import parse_date_arg
+from services.performance import PerformanceCache, INTERVALS, daily_performance, concat_series, summarize
+from services.valuation import value_portfolios, empty_valuation
+from utils.pagination import paginate_keyset
+from utils.serializers import json_response
 
 
 portfolios_bp = Blueprint("portfolios", __name__, url_prefix="/portfolios")
 
-def refresh_portfolio():
+# Differences in holdings smaller than this are floating point noise and are not corrected
+HOLDINGS_TOLERANCE = 1e-6
+
+# Number of portfolios rebuilt per database transaction by 'flask db rebuild-holdings'
+REBUILD_CHUNK_SIZE = 10000
+
+# Number of days reported by the performance endpoint when no 'from' date is given
+DEFAULT_PERFORMANCE_DAYS = 30
+
+# Daily performance of the closed days of recently requested portfolios
+performance_cache = PerformanceCache(max_size=1024)
+
+# PortfolioSchema serializes every portfolio's owned assets (the nested user is not in its fields), load them
+# for all the selected portfolios in one extra query instead of one lazy query per portfolio
+PORTFOLIO_LOAD_OPTIONS = (db.selectinload(Portfolio.ownedAssets),)
+
+def reconcile_holdings():
     """
-    Functionality: This function updates the holdings information for all portfolios based on the latest transactions. It iterates through each portfolio in the database, calculates the total cost of all transactions associated with that portfolio, and updates the portfolio's holdings to reflect the current total cost. This ensures that the holdings information for each portfolio is up-to-date with the latest financial transactions.
+    Functionality: Reconciles the holdings of every portfolio with the transactions ledger. Holdings are kept up to date incrementally by each trade (see 'create_trade'), so this is only needed to repair portfolios whose holdings have drifted from their transactions, for example after editing the database by hand. It is run through the 'flask db reconcile-holdings' command and never by a read endpoint.
 
     Input: None. This function does not require any input parameters.
-    Output: None. This function does not return any value but updates the database records for portfolios.
-        
+    Output: The number of portfolios whose holdings were corrected.
+
     Errors: 
-    - This function does not explicitly return error messages or status codes since it is intended to run internally within the application. However, errors during database operations (such as committing changes) could raise exceptions that are to be handled by the application's global error handlers.
+    - Errors during database operations are not handled here and are raised to the caller.
 
     Requires:
     - Access to the database session to execute queries and commit changes.
 
-    The function starts by selecting all portfolios from the database. For each portfolio, it retrieves all transactions and owned assets associated with that portfolio ID. It then calculates the total cost of all transactions. If the calculated total cost differs from the portfolio's recorded holdings, the portfolio's holdings are updated to match the calculated total cost. This process ensures the holdings data reflects the actual value based on transactions.
+    The total cost of the transactions of all portfolios is calculated with a single GROUP BY over the transactions table, and only the portfolios whose holdings differ from their total are updated. Portfolios without any transactions are reset to 0. All of the work is done by the database, no portfolio or transaction rows are loaded into Python.
+    """
+
+    # The whole-table update may run longer than requests are allowed to
+    db.session.execute(db.text("SET LOCAL statement_timeout = 0"))
+
+    # Total cost of all transactions belonging to each portfolio
+    totals = (
+        db.select(Transaction.portfolioID, db.func.sum(Transaction.totalCost).label("total"))
+        .group_by(Transaction.portfolioID)
+        .subquery()
+    )
+
+    # Correct portfolios whose holdings differ from the total cost of their transactions
+    stmt = (
+        db.update(Portfolio)
+        .where(Portfolio.portfolioID == totals.c.portfolioID)
+        .where(db.func.abs(Portfolio.holdings - totals.c.total) > HOLDINGS_TOLERANCE)
+        .values(holdings=totals.c.total)
+    )
+    corrected = db.session.execute(stmt).rowcount
+
+    # Reset portfolios without any transactions
+    has_transactions = db.select(Transaction.transactionID).where(Transaction.portfolioID == Portfolio.portfolioID).exists()
+    stmt = db.update(Portfolio).where(~has_transactions).where(Portfolio.holdings != 0).values(holdings=0)
+    corrected += db.session.execute(stmt).rowcount
+
+    db.session.commit()
+    return corrected
+
+
+def rebuild_holdings_chunk(first_id, last_id, dry_run=False):
+    """
+    Functionality: Rebuilds the owned assets and holdings of the portfolios with an ID from 'first_id' to 'last_id' from the transactions ledger, see 'rebuild_holdings'. Every correction is a single set-based statement over the chunk, and a dry run counts the rows each statement would change with the same conditions instead of running it.
+
+    Input: The first and last portfolio ID of the chunk, and whether to only count the differences.
+    Output: A dictionary of the number of differences found, see 'rebuild_holdings'.
+    """
+    in_chunk = lambda column: column.between(first_id, last_id)
+    sign = db.case((Transaction.transactionType == "sell", -1), else_=1)
+    is_buy = Transaction.transactionType == "buy"
+
+    # Net quantity of every asset in the ledger, and the average price paid for it
+    ledger = (
+        db.select(
+            Transaction.portfolioID,
+            Transaction.assetID,
+            db.func.sum(Transaction.quantity * sign).label("quantity"),
+            (db.func.sum(db.case((is_buy, Transaction.totalCost), else_=0)) / db.func.nullif(db.func.sum(db.case((is_buy, Transaction.quantity), else_=0)), 0)).label("buyPrice")
+        )
+        .where(in_chunk(Transaction.portfolioID), Transaction.assetID.is_not(None))
+        .group_by(Transaction.portfolioID, Transaction.assetID)
+        .subquery()
+    )
+    # Quantity and cost of the open lots of every asset
+    lots = (
+        db.select(Lot.portfolioID, Lot.assetID, db.func.sum(Lot.quantity).label("quantity"), db.func.sum(Lot.quantity * Lot.price).label("cost"))
+        .where(in_chunk(Lot.portfolioID))
+        .group_by(Lot.portfolioID, Lot.assetID)
+        .subquery()
+    )
+    # Positions held according to the ledger, priced at the average cost of their lots when the lots agree with the ledger
+    held = (
+        db.select(
+            ledger.c.portfolioID,
+            ledger.c.assetID,
+            ledger.c.quantity,
+            db.case((lots.c.quantity == ledger.c.quantity, lots.c.cost / lots.c.quantity)).label("lotPrice"),
+            ledger.c.buyPrice
+        )
+        .join(lots, db.and_(lots.c.portfolioID == ledger.c.portfolioID, lots.c.assetID == ledger.c.assetID), isouter=True)
+        .where(ledger.c.quantity > 0)
+        .subquery()
+    )
+    matches_held = db.and_(OwnedAsset.portfolioID == held.c.portfolioID, OwnedAsset.assetID == held.c.assetID)
+
+    # Owned assets with a wrong quantity, or a price different from the average cost of their lots
+    wrong = db.and_(
+        matches_held,
+        db.or_(
+            OwnedAsset.quantity != held.c.quantity,
+            db.func.abs(OwnedAsset.price - held.c.lotPrice) > HOLDINGS_TOLERANCE
+        )
+    )
+    # Positions of the ledger without an owned asset
+    missing = ~db.select(OwnedAsset.ID).where(matches_held).exists()
+    # Owned assets the ledger does not hold
+    extra = db.and_(in_chunk(OwnedAsset.portfolioID), ~db.select(held.c.assetID).where(matches_held).exists())
+    # Total cost of the transactions of the portfolio, as kept by the trades
+    total = db.func.coalesce(db.select(db.func.sum(Transaction.totalCost)).where(Transaction.portfolioID == Portfolio.portfolioID).scalar_subquery(), 0)
+    drifted = db.and_(in_chunk(Portfolio.portfolioID), db.func.abs(Portfolio.holdings - total) > HOLDINGS_TOLERANCE)
+
+    report = {
+        "oversold": db.session.scalar(db.select(db.func.count()).select_from(ledger).where(ledger.c.quantity < 0)),
+        "lotMismatch": db.session.scalar(db.select(db.func.count()).select_from(held).where(held.c.lotPrice.is_(None)))
+    }
+    if dry_run:
+        report["updated"] = db.session.scalar(db.select(db.func.count()).select_from(OwnedAsset).where(wrong))
+        report["inserted"] = db.session.scalar(db.select(db.func.count()).select_from(held).where(missing))
+        report["deleted"] = db.session.scalar(db.select(db.func.count()).select_from(OwnedAsset).where(extra))
+        report["holdings"] = db.session.scalar(db.select(db.func.count()).select_from(Portfolio).where(drifted))
+        return report
+
+    stmt = db.update(OwnedAsset).where(wrong).values(quantity=held.c.quantity, price=db.func.coalesce(held.c.lotPrice, OwnedAsset.price))
+    report["updated"] = db.session.execute(stmt, execution_options={"synchronize_session": False}).rowcount
+    stmt = db.insert(OwnedAsset).from_select(
+        ["symbol", "name", "quantity", "price", "assetID", "portfolioID"],
+        db.select(Asset.symbol, Asset.name, held.c.quantity, db.func.coalesce(held.c.lotPrice, held.c.buyPrice, Asset.price), held.c.assetID, held.c.portfolioID)
+        .join(Asset, Asset.assetID == held.c.assetID)
+        .where(missing)
+    )
+    report["inserted"] = db.session.execute(stmt).rowcount
+    stmt = db.delete(OwnedAsset).where(extra)
+    report["deleted"] = db.session.execute(stmt, execution_options={"synchronize_session": False}).rowcount
+    stmt = db.update(Portfolio).where(drifted).values(holdings=total)
+    report["holdings"] = db.session.execute(stmt, execution_options={"synchronize_session": False}).rowcount
+    return report
+
+
+def rebuild_holdings(chunk_size=REBUILD_CHUNK_SIZE, dry_run=False, echo=print):
+    """
+    Functionality: Rebuilds the owned assets and the holdings of every portfolio from the transactions ledger, repairing both after they drifted (unlike 'reconcile_holdings', which only repairs the holdings). Owned assets get the net quantity of the ledger, priced at the average cost of their lots (or the average buy price when the lots disagree with the ledger), owned assets the ledger does not hold are removed, and holdings are set to the total cost of the transactions. All of the work is done by the database with set-based statements, no row is loaded into Python, and the portfolios are processed in chunks of consecutive IDs, each committed on its own, so the locks and the work of every database transaction stay bounded on any size of ledger.
+
+    Input:
+    - chunk_size: The number of portfolio IDs per chunk.
+    - dry_run: Only count the differences, without changing anything.
+    - echo: A function called with a progress line after every chunk.
+
+    Output: A dictionary of the number of owned assets 'updated' (wrong quantity or cost), 'inserted' (missing) and 'deleted' (not held), of portfolios whose 'holdings' were corrected, of positions 'oversold' in the ledger (more sold than bought, left out of the owned assets), and of positions whose lots disagree with the ledger ('lotMismatch', their cost is kept or taken from the buys, the lots are rebuilt by replaying the ledger with services.lot_ledger.rebuild_lots), summed over all chunks.
+
+    Errors:
+    - Errors during database operations are raised to the caller, the chunks committed before the error stay committed.
+    """
+    totals = dict.fromkeys(("updated", "inserted", "deleted", "holdings", "oversold", "lotMismatch"), 0)
+    first, last = db.session.execute(db.select(db.func.min(Portfolio.portfolioID), db.func.max(Portfolio.portfolioID))).one()
+    if first is None:
+        return totals
+    for chunk_start in range(first, last + 1, chunk_size):
+        chunk_end = min(chunk_start + chunk_size - 1, last)
+        # Maintenance statements may run longer than requests are allowed to
+        db.session.execute(db.text("SET LOCAL statement_timeout = 0"))
+        report = rebuild_holdings_chunk(chunk_start, chunk_end, dry_run)
+        if dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+        for key, count in report.items():
+            totals[key] += count
+        echo(f"Portfolios {chunk_start}-{chunk_end}: " + ", ".join(f"{key} {count}" for key, count in report.items()))
+    return totals
+
 
-    This function is typically called before performing operations that require up-to-date portfolio information, such as displaying portfolio data to the user or calculating performance metrics. It does not directly interact with users or return data to them but plays a critical role in maintaining data integrity within the application.
+def value_positions(portfolio_id=None):
     """
+    Functionality: Values portfolios at the current asset prices. The owned assets are joined with their assets in a single query returning plain column tuples, which are valued together with NumPy (see services/valuation.py).
 
-    # Attempts to retrieve all portfolios from the database
-    stmt = db.select(Portfolio)
-    portfolios = db.session.scalars(stmt).all()
+    Input: The ID of the portfolio to value, or None to value every portfolio holding assets.
+    Output: A tuple of the list of portfolio valuations ordered by portfolioID, and the response headers reporting the age of the prices used.
+    """
+    stmt = (
+        db.select(OwnedAsset.portfolioID, OwnedAsset.assetID, OwnedAsset.quantity, OwnedAsset.price, Asset.price, Asset.lastUpdated)
+        .join(Asset, OwnedAsset.assetID == Asset.assetID)
+        .order_by(OwnedAsset.portfolioID, OwnedAsset.assetID)
+    )
+    if portfolio_id is not None:
+        stmt = stmt.where(OwnedAsset.portfolioID == portfolio_id)
+    rows = db.session.execute(stmt).all()
+    if not rows:
+        return [], {}
+
+    portfolio_ids, asset_ids, quantities, cost_prices, market_prices, _ = zip(*rows)
+    valuations = value_portfolios(portfolio_ids, asset_ids, quantities, cost_prices, market_prices)
+    return valuations, price_age_headers(*rows)
+
+
+def load_trades(portfolio_id, start, end):
+    # The portfolio's trades from 'start' (or the first one if None) to 'end', with sells as negative quantities and costs
+    sign = db.case((Transaction.transactionType == "sell", -1), else_=1)
+    stmt = (
+        db.select(Transaction.date, Transaction.assetID, Transaction.quantity * sign, Transaction.price, Transaction.totalCost * sign)
+        .where(Transaction.portfolioID == portfolio_id, Transaction.date <= end)
+        .order_by(Transaction.date, Transaction.transactionID)
+    )
+    if start is not None:
+        stmt = stmt.where(Transaction.date >= start)
+    return db.session.execute(stmt).all()
+
+
+def load_closes(asset_ids, start, end):
+    # The last stored price of every asset on every (UTC) day from 'start' to 'end'
+    if not asset_ids:
+        return []
+    day = db.func.date(db.func.timezone("UTC", PriceHistory.timestamp))
+    stmt = (
+        db.select(day, PriceHistory.assetID, array_agg(aggregate_order_by(PriceHistory.price, PriceHistory.timestamp.desc()))[1])
+        .where(
+            PriceHistory.assetID.in_(asset_ids),
+            PriceHistory.timestamp >= datetime.combine(start, time(), timezone.utc),
+            PriceHistory.timestamp < datetime.combine(end + timedelta(days=1), time(), timezone.utc)
+        )
+        .group_by(day, PriceHistory.assetID)
+    )
+    return db.session.execute(stmt).all()
+
+
+def count_transactions(portfolio_id, end):
+    # Number of transactions of the portfolio dated up to 'end', used to check the cached performance is still valid
+    stmt = db.select(db.func.count()).select_from(Transaction).where(Transaction.portfolioID == portfolio_id, Transaction.date <= end)
+    return db.session.scalar(stmt)
 
-    # If portfolios exist
-    if portfolios:
-        # For each portfolio in portfolios
-        for portfolio in portfolios:
-            # stmt2 retrieves all transactions that belond to the current portfolio and assigns it to transactions variable
-            stmt2 = db.select(Transaction).filter_by(portfolioID=portfolio.portfolioID)
-            transactions = db.session.scalars(stmt2).all()
 
-            # stmt 3 retrieves all owned assets that belond to the current portfolio and assigns it to ownedAssets variable
-            stmt3 = db.select(OwnedAsset).filter_by(portfolioID=portfolio.portfolioID)
-            ownedAssets = db.session.scalars(stmt3).all()
+def extend_performance(portfolio_id, series, start, end):
+    # Compute the days from 'start' to 'end', continuing from 'series' (or from no positions if None)
+    trades = load_trades(portfolio_id, start, end)
+    asset_ids = set(series.assets if series else []) | {trade[1] for trade in trades}
+    part = daily_performance(start, end, trades, load_closes(asset_ids, start, end), series)
+    return concat_series(series, part) if series else part
+
+
+def portfolio_performance(portfolio, end):
+    """
+    Functionality: Returns the daily performance of a portfolio from its first day up to 'end'. Closed days (before today) are cached in 'performance_cache', so only the days after the cached ones are computed, from the trades and stored prices of those days alone. The cached days are dropped if the number of transactions dated on them has changed.
+
+    Input: The Portfolio, and the last day to compute (no later than today).
+    Output: A DailySeries (see services/performance.py).
+    """
+    today = date.today()
+    closed_end = min(end, today - timedelta(days=1))
+
+    # Reuse the cached closed days if the ledger of those days is unchanged
+    series = None
+    cached = performance_cache.get(portfolio.portfolioID)
+    if cached:
+        cached_series, transaction_count = cached
+        if count_transactions(portfolio.portfolioID, cached_series.days[-1].item()) == transaction_count:
+            series = cached_series
+        else:
+            performance_cache.discard(portfolio.portfolioID)
+
+    # The first day of the portfolio, its creation or its first trade
+    if series is None:
+        first_trade = db.session.scalar(db.select(db.func.min(Transaction.date)).where(Transaction.portfolioID == portfolio.portfolioID))
+        next_day = min(portfolio.date, first_trade or portfolio.date, end)
+    else:
+        next_day = series.days[-1].item() + timedelta(days=1)
 
-            # Total_cost variable is to the sum of the total cost all transactions belonging to that portfolio
-            total_cost = sum(transaction.totalCost for transaction in transactions)
+    # Compute and cache the closed days that are not cached yet
+    if next_day <= closed_end:
+        series = extend_performance(portfolio.portfolioID, series, next_day, closed_end)
+        performance_cache.put(portfolio.portfolioID, series, count_transactions(portfolio.portfolioID, closed_end))
+        next_day = closed_end + timedelta(days=1)
 
-            # If total_cost variable differs from portfolio holdings
-            if portfolio.holdings != total_cost:
-                # Update portfolio holdings to correct value of total_cost
-                portfolio.holdings=total_cost
-                db.session.commit()
+    # Compute the open day (today) on every request
+    if next_day <= end:
+        series = extend_performance(portfolio.portfolioID, series, next_day, end)
+    return series
 
 
 # Retrieve all portfolios from portfolios table in database
@@ -66,12 +317,13 @@ def get_all_portfolios():
     """
     Endpoint: GET /portfolios
 
-    Functionality: Retrieves a list of all portfolios from the portfolios table in the database, after updating the portfolios based on the latest transactions and asset ownership. This endpoint is protected by JWT authentication and further restricted to users with administrative privileges through the @authorise_as_admin() decorator. It ensures that sensitive portfolio data is only accessible by authorized personnel.
+    Functionality: Retrieves a list of all portfolios from the portfolios table in the database. Portfolio holdings are kept up to date by each trade, so no recalculation is needed before reading them. This endpoint is protected by JWT authentication and further restricted to users with administrative privileges through the @authorise_as_admin() decorator. It ensures that sensitive portfolio data is only accessible by authorized personnel.
 
-    Input: None. The request does not require any input data, but it does require an authenticated user with administrative rights.
-    Output: A JSON array containing details of all portfolios in the system, ordered by 'portfolioID', or a message indicating no portfolios were found.
+    Input: Optional query parameters 'limit' (number of portfolios per page, default 100, maximum 1000) and 'cursor' (the 'next_cursor' value of the previous page). The request requires an authenticated user with administrative rights.
+    Output: A JSON object with 'data', an array containing details of the portfolios in the page ordered by 'portfolioID', and 'next_cursor', the cursor of the next page or null on the last page. A message is returned instead if no portfolios were found.
         
     Errors: 
+    - Returns a 400 Bad Request error message and status code if the 'limit' or 'cursor' query parameters are invalid.
     - Returns a 403 Forbidden error message and status code if the JWT token is missing, invalid, or does not belong to an administrative user, preventing access to portfolio data.
     - Returns a 404 Not Found error message and status code if no portfolios are found in the database.
 
@@ -79,19 +331,16 @@ def get_all_portfolios():
     - A valid JWT token in the Authorization header, indicating that the requester is logged in.
     - Administrative privileges verified by the @authorise_as_admin() decorator to ensure that only users with the appropriate level of access can retrieve the list of all portfolios.
 
-    The function first invokes the refresh_portfolio() method to update portfolios based on the latest transactions and asset ownership. It then initiates a database query to select all entries from the 'portfolios' table, ordering them by 'portfolioID' for organized retrieval. The results are serialized into JSON format and returned to the requester, providing a comprehensive view of all investment portfolios managed within the system. If no portfolios are found, a message is returned to indicate this.
+    The function initiates a database query to select a page of entries from the 'portfolios' table, ordering them by 'portfolioID' and starting directly after the portfolio in the cursor, so every page is fetched in constant time. The results are serialized into JSON format and returned to the requester, providing a comprehensive view of all investment portfolios managed within the system. If no portfolios are found, a message is returned to indicate this.
     """
 
-    # Check for changes in owned assets and transactions and update the portfolio
-    refresh_portfolio()
-
-    # Retrieve all portfolios in the db and order by portfolioID
-    stmt = db.select(Portfolio).order_by(Portfolio.portfolioID)
-    portfolios = db.session.execute(stmt).scalars().all() 
+    # Retrieve a page of portfolios in the db ordered by portfolioID
+    stmt = db.select(Portfolio).options(*PORTFOLIO_LOAD_OPTIONS)
+    portfolios, next_cursor = paginate_keyset(stmt, Portfolio.portfolioID, scalars=True)
 
-    if portfolios:
-        # Return the portfolios
-        return portfolios_schema.dump(portfolios), 200
+    if portfolios or request.args.get("cursor"):
+        # Return the page of portfolios
+        return {"data": portfolios_schema.dump(portfolios), "next_cursor": next_cursor}, 200
     else:
         # Return error no portfolios found
         return {"error": "No portfolios found"}, 404
@@ -118,20 +367,14 @@ def search_for_portfolio(portfolio_id):
     - `portfolio_id` parameter in the URL path specifying which portfolio's details are being requested.
     """
 
-    # Check for changes in owned assets and transactions and update the portfolio
-    refresh_portfolio()
-
     # Attempt to retrieve the portfolio ID in db by ID given
-    stmt = db.select(Portfolio).filter_by(portfolioID=portfolio_id)
+    stmt = db.select(Portfolio).filter_by(portfolioID=portfolio_id).options(*PORTFOLIO_LOAD_OPTIONS)
     portfolio = db.session.scalar(stmt)
 
-    # find the currently logged in User
-    current_user = User.query.filter_by(userID=get_jwt_identity()).first()
-
     # If portfolio exists
     if portfolio:
         # Verify if the current user is authorized to retrieve the portfolio (either owns it or is an admin)
-        if portfolio.userID != current_user.userID and not current_user.is_admin:
+        if str(portfolio.userID) != get_jwt_identity() and not current_user_is_admin():
             # Unauthorized action - return error response
             return {"error": "Not authorised to perform this action"}, 403
         # Else if user owns portfolio or is an admin
@@ -144,6 +387,129 @@ def search_for_portfolio(portfolio_id):
         return {"error" : f"Portfolio with id '{portfolio_id}' not found"}, 404
 
 
+# Value a portfolio at the current asset prices
+@portfolios_bp.route("/<int:portfolio_id>/valuation") # /portfolios/<portfolio_id>/valuation
+@jwt_required()
+def retrieve_portfolio_valuation(portfolio_id):
+    """
+    Endpoint: GET /portfolios/<int:portfolio_id>/valuation
+
+    Functionality: Marks a portfolio to market. Every owned asset is valued at the current asset price and compared with the average price paid for it, unlike 'holdings' which only sums the cost of the portfolio's transactions. Only the portfolio's owner or an administrative user can access the valuation.
+
+    Input: Portfolio ID as part of the URL path.
+    Output: A JSON object with the 'portfolioID', its 'marketValue', 'costBasis' and 'unrealizedPnL', and 'assets', one entry per owned asset with its 'assetID', 'quantity', 'averagePrice', current 'price', 'marketValue', 'costBasis', 'unrealizedPnL' and 'weight' (share of the portfolio's market value). HTTP status code 200 (OK), and an 'X-Price-Age' header with the age in seconds of the oldest price used.
+
+    Errors:
+    - Returns a 403 Forbidden error message and status code if the requester is neither the owner of the portfolio nor an admin.
+    - Returns a 404 Not Found error message and status code if the portfolio does not exist.
+
+    Requires:
+    - A valid JWT token in the Authorization header.
+    """
+
+    # Ensure the portfolio exists
+    if db.session.get(Portfolio, portfolio_id) is None:
+        return {"error": f"Portfolio with id '{portfolio_id}' not found"}, 404
+    # Only the owner or an admin may see the valuation
+    if not current_user_is_admin() and not current_user_owns_portfolio(portfolio_id):
+        return {"error": "Not authorised to perform this action"}, 403
+
+    valuations, headers = value_positions(portfolio_id)
+    return (valuations[0] if valuations else empty_valuation(portfolio_id)), 200, headers
+
+
+# Report the performance of a portfolio over time
+@portfolios_bp.route("/<int:portfolio_id>/performance") # /portfolios/<portfolio_id>/performance
+@jwt_required()
+def retrieve_portfolio_performance(portfolio_id):
+    """
+    Endpoint: GET /portfolios/<int:portfolio_id>/performance
+
+    Functionality: Reports the performance of a portfolio over time for charts, built from its transactions and the stored price history. For every day, week or month it gives the portfolio's market value, the net amount invested (buys minus sells), the return, and the time-weighted return and P&L accumulated since the start of the requested range. Days without a stored price use the last known price, or the trade price. Positions and returns are computed on arrays rather than by replaying the trades, and the days before today are cached, so a repeat request only computes today. Only the portfolio's owner or an administrative user can access the performance.
+
+    Input:
+    - Portfolio ID as part of the URL path.
+    - Optional query parameters:
+        - 'from' / 'to': The range of days (YYYY-MM-DD), both included. 'to' defaults to today, 'from' to 30 days before 'to'.
+        - 'interval': 'day' (default), 'week' or 'month'.
+
+    Output: A JSON object with the 'portfolioID', 'from', 'to' and 'interval' of the report, 'data', one entry per interval with its first 'date', closing 'value', 'netFlow', 'return', and cumulative 'twr' and 'pnl', and the 'twr' and 'pnl' of the whole range. HTTP status code 200 (OK).
+
+    Errors:
+    - Returns a 400 Bad Request error if the dates or interval are invalid, or 'from' is after 'to'.
+    - Returns a 403 Forbidden error message and status code if the requester is neither the owner of the portfolio nor an admin.
+    - Returns a 404 Not Found error message and status code if the portfolio does not exist.
+
+    Requires:
+    - A valid JWT token in the Authorization header.
+    """
+
+    # Validate the query
+    interval = request.args.get("interval", "day")
+    if interval not in INTERVALS:
+        abort(400, description=f"Invalid interval '{interval}', must be one of: {', '.join(INTERVALS)}")
+    end = min(parse_date_arg("to") or date.today(), date.today())
+    start = parse_date_arg("from") or end - timedelta(days=DEFAULT_PERFORMANCE_DAYS)
+    if start > end:
+        abort(400, description="'from' must not be after 'to'")
+
+    # Ensure the portfolio exists and the requester may see it
+    portfolio = db.session.get(Portfolio, portfolio_id)
+    if portfolio is None:
+        return {"error": f"Portfolio with id '{portfolio_id}' not found"}, 404
+    if not current_user_is_admin() and not current_user_owns_portfolio(portfolio_id):
+        return {"error": "Not authorised to perform this action"}, 403
+
+    data = summarize(portfolio_performance(portfolio, end), start, end, interval)
+    return {
+        "portfolioID": portfolio_id,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "interval": interval,
+        "data": data,
+        "twr": data[-1]["twr"] if data else 0.0,
+        "pnl": data[-1]["pnl"] if data else 0.0
+    }, 200
+
+
+# Value every portfolio at the current asset prices
+@portfolios_bp.route("/valuation") # /portfolios/valuation
+@jwt_required()
+@authorise_as_admin()
+def retrieve_all_portfolio_valuations():
+    """
+    Endpoint: GET /portfolios/valuation
+
+    Functionality: Marks every portfolio to market in one pass: the owned assets of all portfolios are loaded with a single query and valued together with NumPy arrays rather than object by object, so valuing a large number of portfolios takes seconds. This endpoint is restricted to administrators.
+
+    Input: None.
+    Output: A JSON object with 'data', one valuation per portfolio ordered by 'portfolioID' (in the format of GET /portfolios/<id>/valuation, portfolios without owned assets are valued at 0), and the combined 'marketValue', 'costBasis' and 'unrealizedPnL' of all portfolios. HTTP status code 200 (OK), and an 'X-Price-Age' header with the age in seconds of the oldest price used.
+
+    Errors:
+    - Returns a 403 Forbidden error message and status code if the requester is not an admin.
+
+    Requires:
+    - A valid JWT token in the Authorization header belonging to an administrative user.
+    """
+
+    valuations, headers = value_positions()
+
+    # Add the portfolios without owned assets
+    valued = {valuation["portfolioID"] for valuation in valuations}
+    portfolio_ids = db.session.scalars(db.select(Portfolio.portfolioID)).all()
+    if len(portfolio_ids) > len(valued):
+        valuations.extend(empty_valuation(portfolio_id) for portfolio_id in portfolio_ids if portfolio_id not in valued)
+        valuations.sort(key=lambda valuation: valuation["portfolioID"])
+
+    # The response can be large, encode it with orjson when available
+    return json_response({
+        "data": valuations,
+        "marketValue": sum(valuation["marketValue"] for valuation in valuations),
+        "costBasis": sum(valuation["costBasis"] for valuation in valuations),
+        "unrealizedPnL": sum(valuation["unrealizedPnL"] for valuation in valuations)
+    }, 200, headers, exact=False)
+
+
 # Create new portfolio in portfolios table
 @portfolios_bp.route("/create", methods=["POST"]) # /portfolios/create
 @jwt_required()
@@ -153,7 +519,7 @@ def create_portfolio():
 
     Functionality: This endpoint facilitates the creation of a new portfolio in the portfolios table. It first checks if the currently logged-in user already has a portfolio and restricts users to having only one portfolio. If no existing portfolio is found for the user, it proceeds to create a new portfolio using the provided details and associates it with the user's account.
 
-    Input: JSON object containing 'name' and 'description' for the new portfolio. The 'date' is automatically set to the current date, and 'userID' is derived from the JWT token of the authenticated request.
+    Input: JSON object containing 'name' and 'description' for the new portfolio, and optionally its 'costMethod', the accounting of the cost basis of its assets: 'fifo' (default, sells close the oldest lots first) or 'average' (average cost). The 'date' is automatically set to the current date, and 'userID' is derived from the JWT token of the authenticated request.
     Output: JSON object of the newly created portfolio, including the portfolio's ID, name, description, creation date, and the user ID, and HTTP status code 201 (Created).
 
     Errors: 
@@ -178,6 +544,7 @@ def create_portfolio():
     portfolio = Portfolio(
         name=data.get("name"),
         description=data.get("description"),
+        costMethod=data.get("costMethod", "fifo"),
         date=date.today(),
         userID=get_jwt_identity()
     )
@@ -197,17 +564,18 @@ def update_portfolio(portfolio_id):
 
     Functionality: This endpoint handles the updating of specific fields within a portfolio in the database. It ensures that the request comes from an authorized user (either the owner of the portfolio or an administrator) before proceeding with the update. Upon successful update, it returns the updated portfolio data.
 
-    Input: Portfolio ID as part of the URL path and JSON object containing the fields to be updated ('name', 'description').
+    Input: Portfolio ID as part of the URL path and JSON object containing the fields to be updated ('name', 'description', 'costMethod').
     Output: JSON object of the updated portfolio data, reflecting the changes made.
     
     Errors: 
+    - Returns a 400 Bad Request error message and status code if 'costMethod' is changed while the portfolio holds assets, as the lots of a method cannot be converted to the other.
     - Returns a 403 Forbidden error message and status code if the user attempting the update is neither the portfolio owner nor an administrator.
     - Returns a 404 Not Found error message and status code if the specified portfolio does not exist.
 
     Requires:
     - JWT token in the Authorization header to authenticate the request.
     - `portfolio_id` parameter in the URL path specifying the portfolio to be updated.
-    - Optional JSON fields in the request body for 'name' and 'description', where provided values will overwrite existing ones.
+    - Optional JSON fields in the request body for 'name', 'description' and 'costMethod', where provided values will overwrite existing ones.
 
     Notes:
     - This endpoint uses both PUT and PATCH methods to support full and partial updates respectively.
@@ -220,18 +588,19 @@ def update_portfolio(portfolio_id):
     stmt = db.select(Portfolio).filter_by(portfolioID=portfolio_id)
     portfolio = db.session.scalar(stmt)
 
-    # Retrieve the currently logged in user
-    current_user = User.query.filter_by(userID=get_jwt_identity()).first()
-
     # Ensure the portfolio exists
     if portfolio:
         # Verify if the current user is authorized to delete the portfolio (either owns it or is an admin)
-        if portfolio.userID != current_user.userID and not current_user.is_admin:
+        if str(portfolio.userID) != get_jwt_identity() and not current_user_is_admin():
             # Unauthorized action - return error response
             return {"error": "Only the portfolio owner or an admin can edit the requested portfolio"}, 403
+        # The cost method can only change while the portfolio has no open lots
+        elif data.get("costMethod", portfolio.costMethod) != portfolio.costMethod and portfolio.ownedAssets:
+            return {"error": "The cost method of a portfolio can only be changed while it holds no assets"}, 400
         # Else if current user owns the portfolio or is an admin
         else:
             # Update the fields
+            portfolio.costMethod = data.get("costMethod", portfolio.costMethod)
             portfolio.name=data.get("name") or portfolio.name,
             portfolio.description=data.get("description") or portfolio.description
             # commit the changes
@@ -269,13 +638,10 @@ def delete_portfolio(portfolio_id):
     stmt = db.select(Portfolio).filter_by(portfolioID=portfolio_id)
     portfolio = db.session.scalar(stmt)
 
-    # Retrieve the currently logged in user
-    current_user = User.query.filter_by(userID=get_jwt_identity()).first()
-
     # Ensure the portfolio exists
     if portfolio:
         # Verify if the current user is authorized to delete the portfolio (either owns it or is an admin)
-        if (portfolio.userID != current_user.userID and not current_user.is_admin):
+        if (str(portfolio.userID) != get_jwt_identity() and not current_user_is_admin()):
             # Unauthorized action - return error response
             return {"error": "Only the portfolio owner or an admin can delete the requested portfolio"}, 403
         # Else if current user owns the portfolio or is an admin
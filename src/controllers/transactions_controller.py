@@ -1,107 +1,214 @@
+import csv
+import io
+import json
 from datetime import date
 
-from flask import Blueprint, request, abort
+from flask import Blueprint, request, abort, Response, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from marshmallow.exceptions import ValidationError
 
 from init import db
 from models.transactions import Transaction, transactions_schema, transaction_schema
 from models.assets import Asset
 from models.ownedAssets import OwnedAsset
 from models.portfolios import Portfolio
-from models.users import User
-from controllers.assets_controller import update_asset_prices
-from controllers.auth_controller import authorise_as_admin
+from models.lots import Lot
+from controllers.assets_controller import price_age_headers
+from controllers.auth_controller import authorise_as_admin, current_user_is_admin, current_user_owns_portfolio
+from utils.pagination import paginate_keyset
+from utils.serializers import RowSerializer
+from services.lot_ledger import Position
 
 
 transactions_bp = Blueprint("transactions", __name__, url_prefix="/transactions")
 
+# Output formats supported by the transaction export
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+# Columns written by the transaction export, in output order
+EXPORT_COLUMNS = ("transactionID", "transactionType", "quantity", "price", "totalCost", "date", "realizedPnL", "portfolioID", "assetID")
+# Number of rows fetched from the server side cursor, and written, at a time
+EXPORT_BATCH_SIZE = 5000
+# Maximum number of trades accepted by a single batch trade request
+MAX_BATCH_TRADES = 1000
+# Serializes transaction pages straight from the selected columns (see FAST_JSON_SERIALIZATION)
+transactions_serializer = RowSerializer(Transaction, transactions_schema)
 
-def update_owned_assets(transaction):
+
+def load_positions(portfolio, sold, owned):
     """
-    Functionality: Updates or adds an owned asset in a portfolio following a transaction. This function checks if the asset involved in the transaction already exists in the user's portfolio. If it does, it updates the quantity and recalculates the average price. If not, it creates a new OwnedAsset record.
+    Functionality: Loads the cost basis positions of assets in a portfolio, with only the lots the trades can touch. For the 'fifo' method these are the oldest open lots of each asset covering the quantity sold (a window function sums the quantity of the lots before each one, so the lots after them are never returned), for the 'average' method the single lot of each asset. Lots opened by the trades are not loaded at all.
 
-    Input: A Transaction object that contains the details of the recent transaction, including the assetID, portfolioID, quantity, and price.
-    Output: None. This function updates or creates entries in the OwnedAsset table of the database but does not return any direct output.
+    Input:
+    - portfolio: The Portfolio traded, whose 'costMethod' is used.
+    - sold: A dictionary of the total quantity sold of every asset traded, {assetID: quantity} (0 for assets only bought).
+    - owned: A dictionary of the portfolio's owned assets of the assets traded, {assetID: OwnedAsset}, locked by the caller so no concurrent trade changes the lots.
+
+    Output: A dictionary of a Position (see services/lot_ledger.py) for every asset in 'sold'.
+    """
+    positions = {
+        asset_id: Position(portfolio.costMethod, owned_asset.quantity, owned_asset.quantity * owned_asset.price) if (owned_asset := owned.get(asset_id)) else Position(portfolio.costMethod)
+        for asset_id in sold
+    }
+    needed = {asset_id: quantity for asset_id, quantity in sold.items() if asset_id in owned and (quantity or portfolio.costMethod == "average")}
+    if not needed:
+        return positions
+
+    # Quantity of the open lots before each lot of the same asset
+    preceding = db.func.sum(Lot.quantity).over(partition_by=Lot.assetID, order_by=Lot.lotID) - Lot.quantity
+    lots = (
+        db.select(Lot.lotID, Lot.assetID, Lot.quantity, Lot.price, Lot.date, preceding.label("preceding"))
+        .where(Lot.portfolioID == portfolio.portfolioID, Lot.assetID.in_(needed))
+        .subquery()
+    )
+    stmt = db.select(lots.c.assetID, lots.c.lotID, lots.c.quantity, lots.c.price, lots.c.date).order_by(lots.c.lotID)
+    if portfolio.costMethod == "fifo":
+        stmt = stmt.where(lots.c.preceding < db.case(needed, value=lots.c.assetID, else_=0))
+    for asset_id, *lot in db.session.execute(stmt):
+        position = positions[asset_id]
+        position.lots.append(lot)
+        position.loaded[lot[0]] = (lot[1], lot[2])
+    return positions
+
+
+def write_lots(portfolio_id, positions):
+    """
+    Functionality: Writes the lots opened, changed and closed by trades with one statement each, without committing: the caller commits the lots together with the transactions.
+
+    Input: The portfolio ID and a dictionary of the traded Positions, {assetID: Position}.
+    Output: None.
+    """
+    inserts, updates, deletes = [], [], []
+    for asset_id, position in positions.items():
+        opened, changed, closed = position.changes()
+        inserts.extend({"quantity": quantity, "price": price, "date": day, "assetID": asset_id, "portfolioID": portfolio_id} for quantity, price, day in opened)
+        updates.extend({"lotID": lot_id, "quantity": quantity, "price": price} for lot_id, quantity, price in changed)
+        deletes.extend(closed)
+    if inserts:
+        db.session.execute(db.insert(Lot), inserts)
+    if updates:
+        db.session.execute(db.update(Lot), updates)
+    if deletes:
+        db.session.execute(db.delete(Lot).where(Lot.lotID.in_(deletes)))
+
+
+def update_owned_assets(transaction, portfolio):
+    """
+    Functionality: Updates or adds an owned asset in a portfolio following a transaction. This function checks if the asset involved in the transaction already exists in the user's portfolio. If it does, it updates the quantity and its average cost. If not, it creates a new OwnedAsset record. The cost basis lots of the asset are updated with the portfolio's cost method (see services/lot_ledger.py), touching only the lots the trade opens or closes, and a sell records its realized P&L on the transaction. The owned asset row is locked (SELECT ... FOR UPDATE) so a concurrent trade of the same asset waits until this trade is committed, and nothing is committed here: the caller commits the owned asset and lots together with the transaction.
+
+    Input: A Transaction object that contains the details of the recent transaction, including the assetID, portfolioID, quantity, and price, and the Portfolio it belongs to.
+    Output: None. This function updates or creates entries in the OwnedAsset and lots tables of the database but does not return any direct output.
 
     Errors:
     - This function does not directly return error messages or status codes since it operates within the context of a larger operation (creating or updating a transaction). However, database operation failures (such as integrity constraints violations) would raise exceptions that would be caught and handled by the global error handlers.
     """
 
-    # Retrieve ownedAsset instance that matches asset in transaction and portfolioID
-    stmt = db.select(OwnedAsset).filter_by(portfolioID=transaction.portfolioID).filter_by(assetID=transaction.assetID)
+    # Retrieve and lock the ownedAsset instance that matches asset in transaction and portfolioID
+    stmt = db.select(OwnedAsset).filter_by(portfolioID=transaction.portfolioID).filter_by(assetID=transaction.assetID).with_for_update()
     ownedAsset = db.session.scalar(stmt)
 
-    # If ownedAsset exists, update the new quantity and AvgPrice
-    if ownedAsset and transaction.transactionType == "buy":
-        # update quantity of owned assets
-        new_quantity = ownedAsset.quantity + transaction.quantity
-        ownedAsset.price=(ownedAsset.price + transaction.price / new_quantity),
-        ownedAsset.quantity=new_quantity
-        
-        # Save changes to db and return
-        db.session.commit()
-        return
-    
-    # Else if owned asset exists and transaction type is 'sell'
-    elif ownedAsset and transaction.transactionType == "sell": 
-
-        # If portfolio contains transaction quantity
-        if ownedAsset.quantity >= transaction.quantity:
-        
-            # If selling all remaining assets
-            if (ownedAsset.quantity - transaction.quantity) == 0:
-                # Remove asset from owned assets
-                db.session.delete(ownedAsset)
-                # Commit changes to db and return
-                db.session.commit()
-                return
-        
-            # Update quantity of owned assets
-            new_quantity = ownedAsset.quantity - transaction.quantity
-            ownedAsset.price=ownedAsset.price / transaction.quantity,
-            ownedAsset.quantity=new_quantity
-            
-            # Save changes to db and return
-            db.session.commit()
-            return
-
-        # Else portfolio doesnt contain that many of the asset
-        else:
-            # Return abort message
+    # A sell needs the asset in the portfolio, in at least the quantity sold
+    if transaction.transactionType == "sell":
+        if not ownedAsset:
+            abort(400, description=f"Portfolio does not contain asset '{transaction.assetID}'")
+        if ownedAsset.quantity < transaction.quantity:
             abort(400, description=f"Invalid quantity, cannot sell '{transaction.quantity}'. Portfolio only contains '{ownedAsset.quantity}'")
-    
-    # If transaction type is 'buy' and asset not owned add new asset to ownedAssets belonging to portfolioID
-    if not ownedAsset and transaction.transactionType == "buy":
 
-        # Retrieve Asset instance that matches assetID in transaction
-        stmt = db.select(Asset).filter_by(assetID=transaction.assetID)
-        asset = db.session.scalar(stmt)
-
-        # Retrieve Portfolio instance that matches portfolioID in transaction
-        stmt = db.select(Portfolio).filter_by(portfolioID=transaction.portfolioID)
-        portfolio = db.session.scalar(stmt)
+    # Update the lots of the asset
+    sold = transaction.quantity if transaction.transactionType == "sell" else 0
+    positions = load_positions(portfolio, {transaction.assetID: sold}, {transaction.assetID: ownedAsset} if ownedAsset else {})
+    position = positions[transaction.assetID]
+    if transaction.transactionType == "buy":
+        position.buy(transaction.quantity, transaction.price, transaction.date)
+    else:
+        transaction.realizedPnL = position.sell(transaction.quantity, transaction.price)
+    write_lots(transaction.portfolioID, positions)
+
+    # If selling all remaining assets, remove asset from owned assets
+    if ownedAsset and position.quantity == 0:
+        db.session.delete(ownedAsset)
+    # Else if ownedAsset exists, update the new quantity and average cost
+    elif ownedAsset:
+        ownedAsset.quantity = position.quantity
+        ownedAsset.price = position.average_price
+    # If asset not owned add new asset to ownedAssets belonging to portfolioID
+    else:
+        # Retrieve Asset instance of the transaction (already loaded in the session by the caller)
+        asset = db.session.get(Asset, transaction.assetID)
 
-        # Create new instance of OwnedAsset with transaction, Asset and Portfolio details 
-        new_owned_asset = OwnedAsset(
+        # Create new instance of OwnedAsset with transaction, Asset and Portfolio details and add it to database
+        db.session.add(OwnedAsset(
             symbol=asset.symbol,
             name=asset.name,
-            quantity=transaction.quantity,
-            price=transaction.price,
+            quantity=position.quantity,
+            price=position.average_price,
             asset=asset,
             portfolio=portfolio
-        )
+        ))
 
-        # Add new instance to database
-        db.session.add(new_owned_asset)
 
-        # Commit changes to database and return
-        db.session.commit()
-        return
-    
-    # Else if portfolio does not contain asset and transaction type is 'sell'
-    else :
-        # Return abort 400 message
-        abort(400, description=f"Portfolio does not contain asset '{transaction.assetID}'")
+def parse_date_arg(name):
+    """
+    Functionality: Reads an optional ISO 8601 date (YYYY-MM-DD) from the query parameters of the current request.
+
+    Input: The name of the query parameter.
+    Output: A date object, or None if the query parameter was not given.
+
+    Errors:
+    - Aborts with a 400 Bad Request error if the value is not a valid date.
+    """
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        abort(400, description=f"Invalid '{name}' date '{value}', dates must use the format YYYY-MM-DD")
+
+
+def export_transactions(export_format, portfolio_id=None, date_from=None, date_to=None):
+    """
+    Functionality: Streams the transactions ledger as NDJSON or CSV. Rows are read through a server side cursor in batches of EXPORT_BATCH_SIZE plain column tuples (no ORM objects are built), and each batch is written out before the next one is fetched, so memory use stays flat no matter how many transactions are exported.
+
+    Input:
+    - export_format: 'ndjson' (one JSON object per line) or 'csv' (with a header row).
+    - portfolio_id: Optional portfolio ID, only exports the transactions of that portfolio.
+    - date_from: Optional date, only exports transactions made on or after it.
+    - date_to: Optional date, only exports transactions made on or before it.
+
+    Output: A generator of text chunks, each holding one batch of formatted rows, ordered by 'transactionID'.
+
+    Requires:
+    - An active app context for the whole time the generator is consumed, as the database cursor stays open while streaming.
+    """
+
+    # Select plain columns in export order, filtered by the optional portfolio and date range
+    stmt = db.select(*(getattr(Transaction, column) for column in EXPORT_COLUMNS)).order_by(Transaction.transactionID)
+    if portfolio_id is not None:
+        stmt = stmt.where(Transaction.portfolioID == portfolio_id)
+    if date_from is not None:
+        stmt = stmt.where(Transaction.date >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(Transaction.date <= date_to)
+
+    # yield_per streams the rows from a server side cursor in fixed size batches
+    result = db.session.execute(stmt, execution_options={"yield_per": EXPORT_BATCH_SIZE})
+
+    if export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(EXPORT_COLUMNS)
+        for rows in result.partitions():
+            writer.writerows(rows)
+            # Hand over the batch and reuse the buffer for the next one
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        # The header is still pending when there were no rows to export
+        if buffer.tell():
+            yield buffer.getvalue()
+    else:
+        for rows in result.partitions():
+            yield "".join(json.dumps(dict(zip(EXPORT_COLUMNS, row)), default=str) + "\n" for row in rows)
 
 
 @transactions_bp.route("/")
@@ -111,12 +218,13 @@ def retrieve_all_transactions():
     """
     Endpoint: GET /transactions
 
-    Functionality: Retrieves a comprehensive list of all transactions across all portfolios, accessible exclusively to users with administrative privileges. This endpoint offers a detailed overview of transaction activities, including transaction types, quantities, prices, and associations with specific assets and portfolios.
+    Functionality: Retrieves a comprehensive list of all transactions across all portfolios, accessible exclusively to users with administrative privileges. This endpoint offers a detailed overview of transaction activities, including transaction types, quantities, prices, and associations with specific assets and portfolios. Transactions are returned one page at a time, ordered by 'transactionID', using keyset pagination so every page is fetched in constant time no matter how deep the client pages.
 
-    Input: None. No input parameters are required for this request.
-    Output: A JSON array containing the details of all transactions, provided transactions exist within the database.
+    Input: Optional query parameters 'limit' (number of transactions per page, default 100, maximum 1000) and 'cursor' (the 'next_cursor' value of the previous page).
+    Output: A JSON object with 'data', an array containing the details of the transactions in the page, and 'next_cursor', the cursor of the next page or null on the last page.
 
     Errors:
+    - Returns a 400 Bad Request error if the 'limit' or 'cursor' query parameters are invalid.
     - Returns a 403 Forbidden error if the requester does not have administrative privileges, ensuring sensitive transaction data is safeguarded.
     - Returns a 404 Not Found error if no transactions are present within the database.
 
@@ -124,20 +232,63 @@ def retrieve_all_transactions():
     - A valid JWT token in the Authorization header to authenticate the request, ensuring that the requester possesses administrative privileges. The @authorise_as_admin() decorator enforces this requirement, restricting access to this sensitive endpoint to authorized administrative users only.
     """
 
-    # Execute query to retrieve all transactions from the database
-    stmt = db.select(Transaction)
-    transactions = db.session.execute(stmt).scalars().all()
+    # Execute query to retrieve a page of transactions from the database
+    stmt = transactions_serializer.select()
+    transactions, next_cursor = paginate_keyset(stmt, Transaction.transactionID, scalars=transactions_serializer.selects_entities())
 
-    # If transactions are found in the database
-    if transactions:
-        # Serialize and return the list of transactions as JSON
-        return transactions_schema.dump(transactions), 200
+    # If transactions are found in the database, or a later page is requested
+    if transactions or request.args.get("cursor"):
+        # Serialize and return the page of transactions as JSON
+        return transactions_serializer.page_response(transactions, next_cursor)
     # If no transactions are found
     else:
         # Return an error message indicating no transactions were found
         return  {"error": "No transactions found"}, 404
 
 
+@transactions_bp.route("/export")
+@jwt_required()
+@authorise_as_admin()
+def export_all_transactions():
+    """
+    Endpoint: GET /transactions/export
+
+    Functionality: Streams a full dump of the transactions ledger for accounting, as NDJSON or CSV. The response is streamed from a server side cursor while it is being sent, so the export never has to fit in memory. This endpoint is accessible exclusively to users with administrative privileges.
+
+    Input: Optional query parameters:
+    - 'format': 'ndjson' (default) or 'csv'.
+    - 'portfolio_id': Only export the transactions of this portfolio.
+    - 'from' / 'to': Only export transactions made on or after / on or before these dates (YYYY-MM-DD).
+
+    Output: A streamed NDJSON or CSV attachment containing the selected transactions ordered by 'transactionID', and HTTP status code 200 (OK).
+
+    Errors:
+    - Returns a 400 Bad Request error if the format, portfolio ID or dates are invalid.
+    - Returns a 403 Forbidden error if the requester does not have administrative privileges.
+
+    Requires:
+    - A valid JWT token in the Authorization header belonging to an administrative user.
+    """
+
+    # Validate the export options before starting the stream
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in EXPORT_FORMATS:
+        abort(400, description=f"Invalid format '{export_format}', must be one of: {', '.join(EXPORT_FORMATS)}")
+    portfolio_id = request.args.get("portfolio_id")
+    if portfolio_id is not None and not portfolio_id.isdigit():
+        abort(400, description=f"Invalid portfolio_id '{portfolio_id}'")
+    date_from = parse_date_arg("from")
+    date_to = parse_date_arg("to")
+
+    # Stream the export, keeping the app context (and database cursor) alive until the response is sent
+    rows = export_transactions(export_format, portfolio_id and int(portfolio_id), date_from, date_to)
+    return Response(
+        stream_with_context(rows),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f"attachment; filename=transactions.{export_format}"}
+    )
+
+
 @transactions_bp.route("/search/<int:transaction_id>")
 @jwt_required()
 def search_transactions_by_id(transaction_id):
@@ -163,14 +314,8 @@ def search_transactions_by_id(transaction_id):
 
     # If transaction exists
     if transaction:
-        # Currently logged in user
-        current_user = User.query.filter_by(userID=get_jwt_identity()).first()
-
-        # attempt to find the currently logged in user's portfolio
-        current_user_portfolioID = Portfolio.query.filter_by(userID=get_jwt_identity()).first()
-
         # If current user is an admin or the current user is the owner of the transaction
-        if current_user.is_admin or current_user_portfolioID and transaction.portfolioID == current_user_portfolioID.portfolioID:
+        if current_user_is_admin() or current_user_owns_portfolio(transaction.portfolioID):
             # Return the transaction
             return transaction_schema.dump(transaction), 200
         # Else if the user is not authorised to view the transaction
@@ -190,11 +335,11 @@ def create_trade():
     """
     Endpoint: POST /transactions/trade
 
-    Functionality: This endpoint facilitates the creation of a new transaction for the current user's portfolio. It verifies the user's portfolio existence, checks the specified asset's existence, and records the transaction with details such as type, quantity, price, and total cost.
+    Functionality: This endpoint facilitates the creation of a new transaction for the current user's portfolio. It verifies the user's portfolio existence, checks the specified asset's existence, and records the transaction with details such as type, quantity, price, and total cost. The trade runs as one atomic database transaction: the portfolio and owned asset rows are locked for the duration of the trade, so concurrent trades of the same portfolio are applied one after the other and can never oversell, and the transaction, owned asset and portfolio holdings are committed together. The trade is priced at the asset price stored by the background price refresher.
 
     Input: JSON object containing 'transactionType', 'quantity', 'assetID'. The 'transactionType' should be a string (e.g., "buy" or "sell"), 'quantity' an integer representing the number of assets transacted, and 'assetID' a string identifier for the asset involved in the transaction.
 
-    Output: JSON object of the created transaction, including transaction details, and HTTP status code 201 (Created) for successful transactions.
+    Output: JSON object of the created transaction, including transaction details, and HTTP status code 201 (Created) for successful transactions. An 'X-Price-Age' header reports the age in seconds of the price the trade was executed at.
 
     Errors: 
     - Returns a 404 Not Found error message and status code if the specified asset ID does not exist.
@@ -207,8 +352,8 @@ def create_trade():
     # sets current user variable to currently logged in user
     current_user = get_jwt_identity()
 
-    # Attempts to find a portfolio for the current user
-    stmt = db.select(Portfolio).filter_by(userID=current_user)
+    # Attempts to find and lock the portfolio of the current user until the trade is committed
+    stmt = db.select(Portfolio).filter_by(userID=current_user).with_for_update()
     portfolio = db.session.scalar(stmt)
 
     # If the current user has a portfolio
@@ -222,9 +367,6 @@ def create_trade():
 
         # If asset exists
         if asset:
-            # Update asset prices
-            update_asset_prices()
-
             # Create a new transaction
             new_transaction = Transaction(
                 transactionType=data.get("transactionType"),
@@ -237,18 +379,177 @@ def create_trade():
             )
 
             # Update owned assets to reflect new changes
-            update_owned_assets(new_transaction)
+            update_owned_assets(new_transaction, portfolio)
             
-            # Add the new transaction to the database and commit
+            # Add the new transaction to the database
             db.session.add(new_transaction)
+
+            # Add the transaction to the portfolio holdings in the same database transaction
+            portfolio.holdings = Portfolio.holdings + new_transaction.totalCost
+
+            # Commit the transaction, owned asset and holdings together
             db.session.commit()
 
             # Return the new transaction details
-            return transaction_schema.dump(new_transaction), 201
+            return transaction_schema.dump(new_transaction), 201, price_age_headers(asset)
 
         # Else if asset does not exist
         else:
             # Return error response for asset not found
             return {"error": "Asset id not found."}, 404
     else:
-        return {"error": "You must create a portfolio first"}, 403
\ No newline at end of file
+        return {"error": "You must create a portfolio first"}, 403
+
+
+@transactions_bp.route("/trade/batch", methods=["POST"])
+@jwt_required()
+def create_trade_batch():
+    """
+    Endpoint: POST /transactions/trade/batch
+
+    Functionality: Creates many transactions for the current user's portfolio in one request, for clients such as rebalancing bots that submit hundreds of trades at a time. The trades are validated together and applied in order within a single database transaction: every trade is priced from one snapshot of the stored asset prices, the affected owned assets are locked once, only the cost basis lots the batch's sells can close are loaded, and transactions, lots, owned assets and the portfolio holdings are written with a handful of set-based statements instead of a round trip per trade. Either all trades are applied or none are.
+
+    Input: A JSON array of trades, each containing 'transactionType', 'quantity' and 'assetID' as for POST /transactions/trade. Trades are applied in the order given, so a sell may follow a buy of the same asset in the same batch. At most 1000 trades are accepted per batch.
+
+    Output: JSON object with 'results', one entry per trade in input order containing its 'index', a 'status' of 'created' and the created 'transaction', and HTTP status code 201 (Created). An 'X-Price-Age' header reports the age in seconds of the oldest price used.
+
+    Errors:
+    - Returns a 400 Bad Request error message and status code if the body is not a non-empty array of at most 1000 trades.
+    - Returns a 400 Bad Request error message and status code, with per-trade 'results', if any trade is invalid (bad fields, unknown asset, or selling more than the portfolio holds at that point in the batch). Invalid trades have a 'status' of 'invalid' and an 'error', valid trades a 'status' of 'not_applied', and no trade is applied.
+    - Returns a 403 Forbidden error message and status code if the current user does not have a portfolio.
+
+    Requires:
+    - A valid JWT token in the Authorization header, indicating that the requester is logged in and authorized to create transactions.
+    """
+
+    # Attempts to find a portfolio for the current user
+    stmt = db.select(Portfolio).filter_by(userID=get_jwt_identity())
+    portfolio = db.session.scalar(stmt)
+    if not portfolio:
+        return {"error": "You must create a portfolio first"}, 403
+
+    # The body must be a list of trades within the batch size limit
+    trades = request.get_json()
+    if not isinstance(trades, list) or not trades:
+        return {"error": "Request body must be a non-empty list of trades"}, 400
+    if len(trades) > MAX_BATCH_TRADES:
+        return {"error": f"A batch may contain at most {MAX_BATCH_TRADES} trades, received {len(trades)}"}, 400
+
+    # Validate the fields of every trade, collecting the errors per trade
+    results = []
+    loaded = []
+    for index, trade in enumerate(trades):
+        try:
+            loaded.append(transaction_schema.load(trade))
+            results.append({"index": index, "status": "not_applied"})
+        except ValidationError as err:
+            loaded.append(None)
+            results.append({"index": index, "status": "invalid", "error": str(err)})
+
+    # Lock the portfolio until the batch is committed, in the same lock order as create_trade
+    stmt = db.select(Portfolio.portfolioID).filter_by(portfolioID=portfolio.portfolioID).with_for_update()
+    db.session.execute(stmt)
+
+    # Take one snapshot of the prices of every asset in the batch
+    asset_ids = {data["assetID"] for data in loaded if data}
+    stmt = db.select(Asset).where(Asset.assetID.in_(asset_ids))
+    assets = {asset.assetID: asset for asset in db.session.scalars(stmt)}
+
+    # Lock the owned assets touched by the batch until the batch is committed
+    stmt = (
+        db.select(OwnedAsset)
+        .where(OwnedAsset.portfolioID == portfolio.portfolioID)
+        .where(OwnedAsset.assetID.in_(asset_ids))
+        .with_for_update()
+    )
+    owned = {owned_asset.assetID: owned_asset for owned_asset in db.session.scalars(stmt)}
+
+    # Load the positions of the assets in the batch, with the lots the sells of the batch can close
+    sold = dict.fromkeys(asset_ids & assets.keys(), 0)
+    for data in loaded:
+        if data and data["transactionType"] == "sell" and data["assetID"] in sold:
+            sold[data["assetID"]] += data["quantity"]
+    positions = load_positions(portfolio, sold, owned)
+
+    # Replay the batch against the running positions
+    new_transactions = []
+    for result, data in zip(results, loaded):
+        if data is None:
+            continue
+        asset = assets.get(data["assetID"])
+        if asset is None:
+            result.update(status="invalid", error=f"Asset id '{data['assetID']}' not found.")
+            continue
+
+        transaction_type, quantity = data["transactionType"], data["quantity"]
+        position = positions[asset.assetID]
+
+        # A sell may not exceed what the portfolio holds at this point in the batch
+        if transaction_type == "sell" and position.quantity < quantity:
+            if position.quantity == 0:
+                result.update(status="invalid", error=f"Portfolio does not contain asset '{asset.assetID}'")
+            else:
+                result.update(status="invalid", error=f"Invalid quantity, cannot sell '{quantity}'. Portfolio only contains '{position.quantity}'")
+            continue
+
+        # Update the running position of the asset
+        realized = None
+        if transaction_type == "buy":
+            position.buy(quantity, asset.price, date.today())
+        else:
+            realized = position.sell(quantity, asset.price)
+
+        new_transactions.append({
+            "transactionType": transaction_type,
+            "quantity": quantity,
+            "price": asset.price,
+            "totalCost": asset.price * quantity,
+            "date": date.today(),
+            "realizedPnL": realized,
+            "assetID": asset.assetID,
+            "portfolioID": portfolio.portfolioID
+        })
+
+    # Apply nothing if any trade is invalid
+    if any(result["status"] == "invalid" for result in results):
+        db.session.rollback()
+        return {"error": "One or more trades are invalid, no trades were applied.", "results": results}, 400
+
+    # Insert all transactions with one multi-row INSERT, returned in input order
+    stmt = db.insert(Transaction).returning(Transaction, sort_by_parameter_order=True)
+    created = db.session.scalars(stmt, new_transactions).all()
+
+    # Write the lots opened, changed and closed by the batch
+    write_lots(portfolio.portfolioID, positions)
+
+    # Write the final positions: insert new owned assets, update changed ones and delete sold out ones
+    inserts, updates, deletes = [], [], []
+    for asset_id, position in positions.items():
+        quantity, price = position.quantity, position.average_price
+        owned_asset = owned.get(asset_id)
+        if owned_asset is None and quantity > 0:
+            asset = assets[asset_id]
+            inserts.append({"symbol": asset.symbol, "name": asset.name, "quantity": quantity, "price": price, "assetID": asset_id, "portfolioID": portfolio.portfolioID})
+        elif owned_asset is not None and quantity == 0:
+            deletes.append(owned_asset.ID)
+        elif owned_asset is not None and (quantity, price) != (owned_asset.quantity, owned_asset.price):
+            updates.append({"ID": owned_asset.ID, "quantity": quantity, "price": price})
+    if inserts:
+        db.session.execute(db.insert(OwnedAsset), inserts)
+    if updates:
+        db.session.execute(db.update(OwnedAsset), updates)
+    if deletes:
+        db.session.execute(db.delete(OwnedAsset).where(OwnedAsset.ID.in_(deletes)))
+
+    # Add the batch total to the portfolio holdings
+    total_cost = sum(transaction["totalCost"] for transaction in new_transactions)
+    stmt = db.update(Portfolio).where(Portfolio.portfolioID == portfolio.portfolioID).values(holdings=Portfolio.holdings + total_cost)
+    db.session.execute(stmt)
+
+    # Serialize before committing, as the commit expires the created transactions
+    for result, transaction in zip(results, transactions_schema.dump(created)):
+        result.update(status="created", transaction=transaction)
+
+    # Commit the whole batch at once
+    db.session.commit()
+    return {"results": results}, 201, price_age_headers(*assets.values())
@@ -2,10 +2,20 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_marshmallow import Marshmallow
 from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager
-from pycoingecko import CoinGeckoAPI
+
+from services.metrics import Metrics
+from services.password_hasher import PasswordHasher
+from services.price_cache import PriceCache
+from services.price_provider import ConfiguredPriceProvider
+from services.price_refresher import PriceRefresher
 
 db = SQLAlchemy()
 ma = Marshmallow()
 bcrypt = Bcrypt()
+password_hasher = PasswordHasher(bcrypt)
 jwt = JWTManager()
-cg = CoinGeckoAPI()
\ No newline at end of file
+metrics = Metrics()
+# Price provider selected by PRICE_PROVIDER, its calls are timed by the metrics
+price_provider = ConfiguredPriceProvider(metrics)
+price_cache = PriceCache(price_provider)
+price_refresher = PriceRefresher()
\ No newline at end of file
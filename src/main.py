@@ -5,7 +5,9 @@ from marshmallow.exceptions import ValidationError
 from sqlalchemy.exc import IntegrityError
 from psycopg2 import errorcodes
 
-from init import db, ma, bcrypt, jwt
+from init import db, ma, bcrypt, password_hasher, jwt, metrics, price_provider, price_cache, price_refresher
+from services.password_hasher import HasherBusy
+from services.db_pool import engine_options
 
 
 def create_app():
@@ -13,13 +15,61 @@ def create_app():
     
     # configs
     app.config["SQLALCHEMY_DATABASE_URI"]=os.environ.get("DATABASE_URI")
+    # Connection pool sizing, recycling, pre-ping and statement timeout (see engine_options for the DB_* variables)
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"]=engine_options(os.environ)
     app.config["JWT_SECRET_KEY"]=os.environ.get("JWT_SECRET_KEY")
+    # Seconds a user's token version is cached before revoked tokens are checked against the database again
+    app.config["JWT_VERSION_CACHE_TTL"]=float(os.environ.get("JWT_VERSION_CACHE_TTL", 30))
+    # bcrypt work factor, and the size and queue of the pool hashing passwords off the request thread
+    app.config["BCRYPT_LOG_ROUNDS"]=int(os.environ.get("BCRYPT_LOG_ROUNDS", 12))
+    app.config["BCRYPT_WORKERS"]=int(os.environ.get("BCRYPT_WORKERS") or os.cpu_count() or 2)
+    app.config["BCRYPT_MAX_QUEUE"]=int(os.environ.get("BCRYPT_MAX_QUEUE", 64))
+    app.config["BCRYPT_QUEUE_TIMEOUT"]=float(os.environ.get("BCRYPT_QUEUE_TIMEOUT", 5))
+    # Price provider, 'coingecko' or the offline 'fake' one (see services/price_provider.py for the PRICE_PROVIDER_* settings)
+    app.config["PRICE_PROVIDER"]=os.environ.get("PRICE_PROVIDER", "coingecko")
+    app.config["COINGECKO_API_KEY"]=os.environ.get("COINGECKO_API_KEY")
+    # Timeouts (in seconds), retries with backoff, pooled connections and circuit breaker of the CoinGecko client
+    app.config["PRICE_PROVIDER_CONNECT_TIMEOUT"]=float(os.environ.get("PRICE_PROVIDER_CONNECT_TIMEOUT", 3.05))
+    app.config["PRICE_PROVIDER_READ_TIMEOUT"]=float(os.environ.get("PRICE_PROVIDER_READ_TIMEOUT", 10))
+    app.config["PRICE_PROVIDER_RETRIES"]=int(os.environ.get("PRICE_PROVIDER_RETRIES", 2))
+    app.config["PRICE_PROVIDER_BACKOFF"]=float(os.environ.get("PRICE_PROVIDER_BACKOFF", 0.5))
+    app.config["PRICE_PROVIDER_POOL_SIZE"]=int(os.environ.get("PRICE_PROVIDER_POOL_SIZE", 10))
+    app.config["PRICE_PROVIDER_FAILURE_THRESHOLD"]=int(os.environ.get("PRICE_PROVIDER_FAILURE_THRESHOLD", 5))
+    app.config["PRICE_PROVIDER_RESET_TIMEOUT"]=float(os.environ.get("PRICE_PROVIDER_RESET_TIMEOUT", 30))
+    # CoinGecko calls allowed per minute (0 for no limit) and in a burst, and the most seconds a call waits for them
+    app.config["PRICE_PROVIDER_RATE_LIMIT"]=float(os.environ.get("PRICE_PROVIDER_RATE_LIMIT", 30))
+    app.config["PRICE_PROVIDER_BURST"]=int(os.environ.get("PRICE_PROVIDER_BURST", 10))
+    app.config["PRICE_PROVIDER_MAX_WAIT"]=float(os.environ.get("PRICE_PROVIDER_MAX_WAIT", 30))
+    # Coin IDs fetched per call, and the threads fetching the chunks of large requests in parallel
+    app.config["PRICE_PROVIDER_CHUNK_SIZE"]=int(os.environ.get("PRICE_PROVIDER_CHUNK_SIZE", 250))
+    app.config["PRICE_PROVIDER_WORKERS"]=int(os.environ.get("PRICE_PROVIDER_WORKERS", 20))
+    # Made up coins served by the fake provider, and the round trip it simulates (in milliseconds)
+    app.config["PRICE_PROVIDER_FAKE_ASSETS"]=int(os.environ.get("PRICE_PROVIDER_FAKE_ASSETS", 0))
+    app.config["PRICE_PROVIDER_FAKE_LATENCY_MS"]=float(os.environ.get("PRICE_PROVIDER_FAKE_LATENCY_MS", 0))
+    # Seconds between background price refreshes, 0 disables the refresher
+    app.config["PRICE_REFRESH_INTERVAL"]=int(os.environ.get("PRICE_REFRESH_INTERVAL", 60))
+    # Price cache in front of CoinGecko: freshness, stale window (both in seconds) and maximum number of coins
+    app.config["PRICE_CACHE_TTL"]=float(os.environ.get("PRICE_CACHE_TTL", 30))
+    app.config["PRICE_CACHE_STALE_TTL"]=float(os.environ.get("PRICE_CACHE_STALE_TTL", 300))
+    app.config["PRICE_CACHE_MAX_SIZE"]=int(os.environ.get("PRICE_CACHE_MAX_SIZE", 10000))
+    # Seconds each worker caches the price version answering conditional GETs on the assets
+    app.config["PRICE_VERSION_TTL"]=float(os.environ.get("PRICE_VERSION_TTL", 2))
+    # Serialize the asset, transaction and owned asset lists straight from column tuples, encoded with orjson when installed
+    app.config["FAST_JSON_SERIALIZATION"]=os.environ.get("FAST_JSON_SERIALIZATION", "true").lower() in ("1", "true", "yes", "on")
+    # Request, SQL and price provider metrics served at /metrics, and the duration (in milliseconds) from which statements are logged as slow
+    app.config["METRICS_ENABLED"]=os.environ.get("METRICS_ENABLED", "true").lower() in ("1", "true", "yes", "on")
+    app.config["SLOW_QUERY_MS"]=float(os.environ.get("SLOW_QUERY_MS", 500))
 
     # Connect libraries with flask app
     db.init_app(app)
     ma.init_app(app)
     bcrypt.init_app(app)
+    password_hasher.init_app(app)
     jwt.init_app(app)
+    metrics.init_app(app)
+    price_provider.init_app(app)
+    price_cache.init_app(app)
+    price_refresher.init_app(app)
 
     # global error handling
     @app.errorhandler(ValidationError)
@@ -33,6 +83,10 @@ def create_app():
     @app.errorhandler(400)
     def bad_request(err):
         return {"error": str(err)}, 400
+
+    @app.errorhandler(HasherBusy)
+    def hasher_busy(err):
+        return {"error": str(err)}, 503
     
 
     @app.errorhandler(IntegrityError)
@@ -66,4 +120,10 @@ def create_app():
     from controllers.transactions_controller import transactions_bp
     app.register_blueprint(transactions_bp)
 
+    from controllers.admin_controller import admin_bp
+    app.register_blueprint(admin_bp)
+
+    from controllers.metrics_controller import metrics_bp
+    app.register_blueprint(metrics_bp)
+
     return app
\ No newline at end of file
@@ -0,0 +1,12 @@
+"""Add users.tokenVersion and assets.lastUpdated"""
+from sqlalchemy import text
+
+
+def upgrade(conn):
+    conn.execute(text('ALTER TABLE assets ADD COLUMN IF NOT EXISTS "lastUpdated" TIMESTAMP WITH TIME ZONE'))
+    conn.execute(text('ALTER TABLE users ADD COLUMN IF NOT EXISTS "tokenVersion" INTEGER NOT NULL DEFAULT 0'))
+
+
+def downgrade(conn):
+    conn.execute(text('ALTER TABLE users DROP COLUMN IF EXISTS "tokenVersion"'))
+    conn.execute(text('ALTER TABLE assets DROP COLUMN IF EXISTS "lastUpdated"'))
@@ -0,0 +1,50 @@
+"""Index transactions and owned assets by portfolio, asset and date"""
+from sqlalchemy import text
+
+from utils.migrations import create_index_concurrently, drop_index_concurrently
+
+# Indexes are built concurrently so the migration does not block trading on a live database
+transactional = False
+
+INDEXES = [
+    ("ix_transactions_portfolioID_date", "transactions", ["portfolioID", "date"], False),
+    ("ix_transactions_assetID", "transactions", ["assetID"], False),
+    ("ix_transactions_date", "transactions", ["date"], False),
+    ("uq_ownedAssets_portfolioID_assetID", "ownedAssets", ["portfolioID", "assetID"], True),
+    ("ix_ownedAssets_assetID", "ownedAssets", ["assetID"], False),
+]
+
+
+def merge_duplicate_owned_assets(conn):
+    # Concurrent trades could insert two rows for the same asset in a portfolio before trades were locked,
+    # fold them into the oldest row (summing the quantity, weighting the price) so the unique index can be built.
+    # The migration connection is in autocommit mode, so the merge runs on its own transaction to stay atomic
+    with conn.engine.begin() as tx:
+        tx.execute(text("SET LOCAL statement_timeout = 0"))
+        tx.execute(text('''
+            UPDATE "ownedAssets" AS o
+            SET quantity = d.quantity, price = d.price
+            FROM (
+                SELECT MIN("ID") AS "ID", SUM(quantity) AS quantity, COALESCE(SUM(quantity * price) / NULLIF(SUM(quantity), 0), MIN(price)) AS price
+                FROM "ownedAssets"
+                GROUP BY "portfolioID", "assetID"
+                HAVING COUNT(*) > 1
+            ) AS d
+            WHERE o."ID" = d."ID"
+        '''))
+        tx.execute(text('''
+            DELETE FROM "ownedAssets" AS o
+            USING "ownedAssets" AS keep
+            WHERE o."portfolioID" = keep."portfolioID" AND o."assetID" = keep."assetID" AND o."ID" > keep."ID"
+        '''))
+
+
+def upgrade(conn):
+    merge_duplicate_owned_assets(conn)
+    for name, table, columns, unique in INDEXES:
+        create_index_concurrently(conn, name, table, columns, unique)
+
+
+def downgrade(conn):
+    for name, _, _, _ in reversed(INDEXES):
+        drop_index_concurrently(conn, name)
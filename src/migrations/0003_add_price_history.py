@@ -0,0 +1,17 @@
+"""Add the priceHistory table"""
+from sqlalchemy import text
+
+
+def upgrade(conn):
+    conn.execute(text('''
+        CREATE TABLE IF NOT EXISTS "priceHistory" (
+            "assetID" VARCHAR NOT NULL REFERENCES assets ("assetID") ON DELETE CASCADE,
+            timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+            price FLOAT NOT NULL,
+            PRIMARY KEY ("assetID", timestamp)
+        )
+    '''))
+
+
+def downgrade(conn):
+    conn.execute(text('DROP TABLE IF EXISTS "priceHistory"'))
@@ -0,0 +1,28 @@
+"""Add the lots table, portfolios.costMethod and transactions.realizedPnL, and build the lots of existing transactions"""
+from sqlalchemy import text
+
+from services.lot_ledger import rebuild_lots
+
+
+def upgrade(conn):
+    conn.execute(text('''ALTER TABLE portfolios ADD COLUMN IF NOT EXISTS "costMethod" VARCHAR(10) NOT NULL DEFAULT 'fifo\''''))
+    conn.execute(text('ALTER TABLE transactions ADD COLUMN IF NOT EXISTS "realizedPnL" FLOAT'))
+    conn.execute(text('''
+        CREATE TABLE IF NOT EXISTS lots (
+            "lotID" SERIAL PRIMARY KEY,
+            quantity INTEGER NOT NULL,
+            price FLOAT NOT NULL,
+            date DATE NOT NULL,
+            "portfolioID" INTEGER NOT NULL REFERENCES portfolios ("portfolioID") ON DELETE CASCADE,
+            "assetID" VARCHAR NOT NULL REFERENCES assets ("assetID") ON DELETE CASCADE
+        )
+    '''))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS "ix_lots_portfolioID_assetID_lotID" ON lots ("portfolioID", "assetID", "lotID")'))
+    # Replay the existing transactions, which also replaces the drifting owned asset prices with their average cost
+    rebuild_lots(conn)
+
+
+def downgrade(conn):
+    conn.execute(text("DROP TABLE IF EXISTS lots"))
+    conn.execute(text('ALTER TABLE transactions DROP COLUMN IF EXISTS "realizedPnL"'))
+    conn.execute(text('ALTER TABLE portfolios DROP COLUMN IF EXISTS "costMethod"'))
@@ -0,0 +1,10 @@
+"""Add assets.delistedAt, set on the assets the price provider no longer lists"""
+from sqlalchemy import text
+
+
+def upgrade(conn):
+    conn.execute(text('ALTER TABLE assets ADD COLUMN IF NOT EXISTS "delistedAt" TIMESTAMP WITH TIME ZONE'))
+
+
+def downgrade(conn):
+    conn.execute(text('ALTER TABLE assets DROP COLUMN IF EXISTS "delistedAt"'))
@@ -10,6 +10,8 @@ class Asset(db.Model):
     symbol = db.Column(db.String, nullable=False)
     name = db.Column(db.String, nullable=False)
     price = db.Column(db.Float, nullable=False)
+    lastUpdated = db.Column(db.DateTime(timezone=True)) # Time the price was last refreshed from the price provider.
+    delistedAt = db.Column(db.DateTime(timezone=True)) # Time the price provider was found to no longer list the asset, None while it is listed.
 
     transaction = db.relationship("Transaction", back_populates="asset", cascade="all, delete")
     ownedAssets = db.relationship("OwnedAsset", back_populates="asset", cascade="all,delete")
@@ -18,7 +20,7 @@ class Asset(db.Model):
 class Asset_Schema(ma.Schema):
 
     class Meta:
-        fields = ('assetID', 'marketCapPos', 'symbol', 'name', 'price')
+        fields = ('assetID', 'marketCapPos', 'symbol', 'name', 'price', 'lastUpdated', 'delistedAt')
         ordered=True
 
 asset_schema = Asset_Schema()
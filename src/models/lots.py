@@ -0,0 +1,20 @@
+from init import db
+
+
+class Lot(db.Model):
+    __tablename__ = "lots"
+    __table_args__ = (
+        # Open lots of an asset in a portfolio, oldest first
+        db.Index("ix_lots_portfolioID_assetID_lotID", "portfolioID", "assetID", "lotID"),
+    )
+
+    lotID = db.Column(db.Integer, primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False) # Quantity of the lot still held.
+    price = db.Column(db.Float, nullable=False) # Cost of one unit of the lot.
+    date = db.Column(db.Date, nullable=False) # Date the lot was opened.
+
+    portfolioID = db.Column(db.Integer, db.ForeignKey("portfolios.portfolioID", ondelete="CASCADE"), nullable=False)
+    assetID = db.Column(db.String, db.ForeignKey("assets.assetID", ondelete="CASCADE"), nullable=False)
+
+    portfolio = db.relationship("Portfolio")
+    asset = db.relationship("Asset")
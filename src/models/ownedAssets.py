@@ -4,6 +4,11 @@ from marshmallow.validate import Range
 
 class OwnedAsset(db.Model):
     __tablename__ = "ownedAssets"
+    __table_args__ = (
+        # A portfolio holds at most one row per asset
+        db.Index("uq_ownedAssets_portfolioID_assetID", "portfolioID", "assetID", unique=True),
+        db.Index("ix_ownedAssets_assetID", "assetID"),
+    )
 
     # Attributes
     ID = db.Column(db.Integer, primary_key=True)
@@ -1,8 +1,11 @@
 from marshmallow import fields
-from marshmallow.validate import Length
+from marshmallow.validate import Length, OneOf
 
 from init import db, ma 
 
+# Accounting methods of the cost basis lots (see services/lot_ledger.py)
+COST_METHODS = ("fifo", "average")
+
 class Portfolio(db.Model):
     __tablename__ = "portfolios"
 
@@ -11,6 +14,7 @@ class Portfolio(db.Model):
     description = db.Column(db.Text)
     holdings = db.Column(db.Float, default=0, nullable=False)
     date = db.Column(db.Date, nullable=False) # Date the portfolio was created.
+    costMethod = db.Column(db.String(10), default="fifo", nullable=False) # Cost basis accounting of the portfolio's lots, 'fifo' or 'average'.
 
     userID = db.Column(db.Integer, db.ForeignKey("users.userID"), unique=True, nullable=False) # Foreign key 'user.UserID' tablename = 'user', key = 'UserID'
 
@@ -27,11 +31,12 @@ class PortfolioSchema(ma.Schema):
     ownedAssets = fields.List(fields.Nested("OwnedAssetSchema"))
 
     class Meta:
-        fields = ("portfolioID", "name", "description", "holdings", "date", "ownedAssets", "userID")
+        fields = ("portfolioID", "name", "description", "holdings", "date", "costMethod", "ownedAssets", "userID")
         ordered=True
 
     name = fields.String(validate=Length(min=1))
     description = fields.String(validate=Length(min=1))
+    costMethod = fields.String(validate=OneOf(COST_METHODS))
 
 portfolio_schema = PortfolioSchema()
 portfolios_schema = PortfolioSchema(many=True)
\ No newline at end of file
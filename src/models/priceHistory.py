@@ -0,0 +1,10 @@
+from init import db
+
+
+class PriceHistory(db.Model):
+    __tablename__ = "priceHistory"
+
+    # The primary key (assetID, timestamp) also serves range queries over an asset's history
+    assetID = db.Column(db.String, db.ForeignKey("assets.assetID", ondelete="CASCADE"), primary_key=True)
+    timestamp = db.Column(db.DateTime(timezone=True), primary_key=True) # Time the price was fetched from the price provider.
+    price = db.Column(db.Float, nullable=False)
@@ -6,6 +6,12 @@ VALID_TRANSACTIONS = ("buy", "sell")
 
 class Transaction(db.Model):
     __tablename__ = "transactions"
+    __table_args__ = (
+        # Transactions of a portfolio, optionally within a date range
+        db.Index("ix_transactions_portfolioID_date", "portfolioID", "date"),
+        db.Index("ix_transactions_assetID", "assetID"),
+        db.Index("ix_transactions_date", "date"),
+    )
 
     transactionID = db.Column(db.Integer, primary_key=True)
     transactionType = db.Column(db.String(100), nullable=False)
@@ -15,6 +21,7 @@ class Transaction(db.Model):
     totalCost = db.Column(db.Float, nullable=False)
     # cost = db.Column(Numeric(precision=12, scale=2), nullable=False)
     date = db.Column(db.Date, nullable=False)
+    realizedPnL = db.Column(db.Float) # Profit or loss realized by a sell against the cost of the lots it closed, null for buys.
 
     portfolioID = db.Column(db.Integer, db.ForeignKey("portfolios.portfolioID"))
     assetID = db.Column(db.String, db.ForeignKey("assets.assetID"))
@@ -28,7 +35,7 @@ class Transaction_Schema(ma.Schema):
 
     class Meta:
 
-        fields = ("transactionID", "transactionType", "quantity", "price", "totalCost", "date", "portfolioID", "assetID")
+        fields = ("transactionID", "transactionType", "quantity", "price", "totalCost", "date", "realizedPnL", "portfolioID", "assetID")
 
     transactionType = fields.String(validate=OneOf(VALID_TRANSACTIONS), required=True)
     quantity = fields.Integer(validate=Range(min=1), required=True)
@@ -8,6 +8,7 @@ class User(db.Model):
     email = db.Column(db.String, nullable=False, unique=True)
     password = db.Column(db.String, nullable=False)
     is_admin = db.Column(db.Boolean, default=False)
+    tokenVersion = db.Column(db.Integer, default=0, server_default="0", nullable=False) # Incremented to revoke every token issued to the user.
 
     portfolio = db.relationship("Portfolio", back_populates="user", uselist=False, cascade="all, delete")
 
@@ -0,0 +1,117 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+
+# Assets upserted per statement
+SYNC_BATCH_SIZE = 5000
+# Coins synced by default, the largest by market cap
+SYNC_LIMIT = 250
+
+# Upserts a batch of assets passed as arrays, only writing the rows that changed, and appends the new prices to the
+# price history. Unchanged rows are not returned by RETURNING, (xmax = 0) tells the inserted rows from the updated ones
+UPSERT_ASSETS = text('''
+    WITH upserted AS (
+        INSERT INTO assets ("assetID", "marketCapPos", symbol, name, price, "lastUpdated", "delistedAt")
+        SELECT "assetID", "marketCapPos", symbol, name, price, :fetchedAt, NULL
+        FROM unnest(CAST(:assetIDs AS VARCHAR[]), CAST(:marketCapPos AS INTEGER[]), CAST(:symbols AS VARCHAR[]), CAST(:names AS VARCHAR[]), CAST(:prices AS FLOAT[]))
+            AS batch ("assetID", "marketCapPos", symbol, name, price)
+        ON CONFLICT ("assetID") DO UPDATE SET
+            "marketCapPos" = EXCLUDED."marketCapPos",
+            symbol = EXCLUDED.symbol,
+            name = EXCLUDED.name,
+            price = EXCLUDED.price,
+            "lastUpdated" = EXCLUDED."lastUpdated",
+            "delistedAt" = NULL
+        WHERE (assets."marketCapPos", assets.symbol, assets.name, assets.price, assets."delistedAt")
+            IS DISTINCT FROM (EXCLUDED."marketCapPos", EXCLUDED.symbol, EXCLUDED.name, EXCLUDED.price, NULL)
+        RETURNING "assetID", price, "lastUpdated", (xmax = 0) AS inserted
+    ), history AS (
+        INSERT INTO "priceHistory" ("assetID", timestamp, price)
+        SELECT "assetID", "lastUpdated", price FROM upserted
+        ON CONFLICT DO NOTHING
+    )
+    SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM upserted
+''')
+
+
+def asset_rows(coins):
+    """
+    Functionality: Turns market data into asset rows. Coins are deduplicated by ID (the first one is kept, a coin can show up on two pages when ranks move while paging), coins without a price are skipped and coins without a market cap rank are ranked after the ranked ones, in the provider's order.
+
+    Input: A list of market data dictionaries, ordered by market cap.
+    Output: A tuple of the list of (assetID, marketCapPos, symbol, name, price) tuples and the number of coins skipped.
+    """
+    rows, seen, skipped = [], set(), 0
+    for position, coin in enumerate(coins, start=1):
+        if coin["id"] in seen:
+            continue
+        seen.add(coin["id"])
+        if coin.get("current_price") is None:
+            skipped += 1
+            continue
+        rows.append((coin["id"], coin.get("market_cap_rank") or len(coins) + position, coin["symbol"].upper(), coin["name"], coin["current_price"]))
+    return rows, skipped
+
+
+def upsert_assets(conn, rows, fetched_at, batch_size=SYNC_BATCH_SIZE):
+    """
+    Functionality: Inserts new assets and updates the changed ones with INSERT ... ON CONFLICT ("assetID") DO UPDATE, one statement per batch of 'batch_size' rows. Rows that did not change are not written at all, so upserting the same data again changes nothing. The new and changed prices are appended to the price history, and listing an asset again clears its 'delistedAt'.
+
+    Input: A SQLAlchemy connection inside a transaction (the caller commits), the rows as returned by asset_rows, the time the market data was fetched and the batch size.
+    Output: A dictionary with the number of assets 'inserted', 'updated' and 'unchanged'.
+    """
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+    for start in range(0, len(rows), batch_size):
+        asset_ids, ranks, symbols, names, prices = zip(*rows[start:start + batch_size])
+        inserted, updated = conn.execute(UPSERT_ASSETS, {
+            "fetchedAt": fetched_at,
+            "assetIDs": list(asset_ids),
+            "marketCapPos": list(ranks),
+            "symbols": list(symbols),
+            "names": list(names),
+            "prices": list(prices)
+        }).one()
+        counts["inserted"] += inserted
+        counts["updated"] += updated
+        counts["unchanged"] += len(asset_ids) - inserted - updated
+    return counts
+
+
+def sync_assets(conn, provider, limit=SYNC_LIMIT, batch_size=SYNC_BATCH_SIZE, mark_delisted=False):
+    """
+    Functionality: Syncs the assets table with the price provider's universe: the 'limit' coins with the largest market cap are fetched in pages (in parallel, see PriceProvider.get_top_coins) and upserted in batches (see upsert_assets).
+
+    With 'mark_delisted', the listed assets outside of the fetched coins are looked up by ID (see PriceProvider.get_markets): the ones the provider still returns are upserted too, the ones it does not know anymore get their 'delistedAt' set. An asset falling out of the top 'limit' coins is therefore never taken for a delisted one.
+
+    Everything is fetched before anything is written, so a provider failure leaves the assets untouched.
+
+    Input:
+    - conn: A SQLAlchemy connection inside a transaction, the caller commits.
+    - provider: The price provider (see services/price_provider.py).
+    - limit: The number of coins fetched by market cap.
+    - batch_size: The number of assets upserted per statement.
+    - mark_delisted: Look up the other listed assets and mark the ones the provider no longer lists.
+
+    Output: A dictionary with the number of assets 'inserted', 'updated', 'unchanged', 'skipped' (coins without a price) and 'delisted'.
+
+    Errors:
+    - Raises PriceProviderError (including PartialFetch) if the coins cannot all be fetched.
+    """
+    coins = provider.get_top_coins(limit)
+    fetched_at = datetime.now(timezone.utc)
+    delisted = []
+    if mark_delisted:
+        fetched_ids = {coin["id"] for coin in coins}
+        listed = [asset_id for asset_id in conn.execute(text('SELECT "assetID" FROM assets WHERE "delistedAt" IS NULL')).scalars() if asset_id not in fetched_ids]
+        markets = provider.get_markets(listed)
+        coins += markets.values()
+        delisted = [asset_id for asset_id in listed if asset_id not in markets]
+
+    rows, skipped = asset_rows(coins)
+    counts = upsert_assets(conn, rows, fetched_at, batch_size)
+    counts["skipped"] = skipped
+    counts["delisted"] = 0
+    if delisted:
+        stmt = text('UPDATE assets SET "delistedAt" = :now WHERE "assetID" = ANY(:assetIDs) AND "delistedAt" IS NULL')
+        counts["delisted"] = conn.execute(stmt, {"now": fetched_at, "assetIDs": delisted}).rowcount
+    return counts
@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+
+class PoolWaitStats:
+    """
+    Functionality: Thread safe counters of how long requests waited to check a connection out of the pool. The most recent waits are kept to report percentiles, older ones only count towards the totals.
+    """
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=window)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self._recent.append(wait)
+
+    def snapshot(self):
+        """
+        Functionality: Returns the wait time counters, in milliseconds.
+
+        Input: None.
+        Output: A dictionary with the number of checkouts and timeouts, and the mean, maximum, p50, p95 and p99 wait times.
+        """
+        with self._lock:
+            recent = sorted(self._recent)
+            checkouts, timeouts, total_wait, max_wait = self.checkouts, self.timeouts, self.total_wait, self.max_wait
+
+        def percentile(fraction):
+            return round(recent[min(int(len(recent) * fraction), len(recent) - 1)] * 1000, 3) if recent else None
+
+        return {
+            "checkouts": checkouts,
+            "timeouts": timeouts,
+            "mean_wait_ms": round(total_wait / checkouts * 1000, 3) if checkouts else None,
+            "max_wait_ms": round(max_wait * 1000, 3),
+            "p50_wait_ms": percentile(0.50),
+            "p95_wait_ms": percentile(0.95),
+            "p99_wait_ms": percentile(0.99)
+        }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    Functionality: The default QueuePool, timing how long every checkout waits for a connection (including opening a new one). Passed to the engine through SQLALCHEMY_ENGINE_OPTIONS['poolclass'].
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = PoolWaitStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.wait_stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.wait_stats.record(time.perf_counter() - start)
+        return connection
+
+    def recreate(self):
+        # Keep the counters when the pool is recreated, for example after engine.dispose()
+        pool = super().recreate()
+        pool.wait_stats = self.wait_stats
+        return pool
+
+
+def engine_options(environ):
+    """
+    Functionality: Builds SQLALCHEMY_ENGINE_OPTIONS from environment variables.
+
+    - DB_POOL_SIZE: Connections kept open in the pool (default 5).
+    - DB_MAX_OVERFLOW: Extra connections opened when the pool is exhausted, closed again once returned (default 10).
+    - DB_POOL_TIMEOUT: Seconds a request waits for a connection before failing (default 30).
+    - DB_POOL_RECYCLE: Seconds after which a connection is replaced, -1 to keep connections forever (default 1800).
+    - DB_POOL_PRE_PING: Test connections before using them, so connections killed by a database failover or restart are replaced instead of failing the request (default true).
+    - DB_STATEMENT_TIMEOUT: Milliseconds a single statement may run before PostgreSQL cancels it, 0 disables the timeout (default 30000).
+
+    Input: A mapping of environment variables, such as os.environ.
+    Output: A dictionary of keyword arguments for create_engine().
+    """
+    options = {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": int(environ.get("DB_POOL_SIZE", 5)),
+        "max_overflow": int(environ.get("DB_MAX_OVERFLOW", 10)),
+        "pool_timeout": int(environ.get("DB_POOL_TIMEOUT", 30)),
+        "pool_recycle": int(environ.get("DB_POOL_RECYCLE", 1800)),
+        "pool_pre_ping": environ.get("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes", "on")
+    }
+    statement_timeout = int(environ.get("DB_STATEMENT_TIMEOUT", 30000))
+    if statement_timeout > 0:
+        options["connect_args"] = {"options": f"-c statement_timeout={statement_timeout}"}
+    return options
+
+
+def pool_stats(engine):
+    """
+    Functionality: Reports the state of an engine's connection pool.
+
+    Input: The SQLAlchemy engine.
+    Output: A dictionary with the pool size and overflow limits, the number of connections checked out, idle in the pool and opened as overflow, and the checkout wait times if the pool is an InstrumentedQueuePool.
+    """
+    pool = engine.pool
+    stats = {"pool_class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            pool_size=pool.size(),
+            max_overflow=pool._max_overflow,
+            timeout=pool.timeout(),
+            checked_out=pool.checkedout(),
+            idle=pool.checkedin(),
+            # overflow() is negative while fewer than pool_size connections have been opened
+            overflow=max(pool.overflow(), 0),
+            recycle=pool._recycle,
+            pre_ping=pool._pre_ping
+        )
+    if isinstance(pool, InstrumentedQueuePool):
+        stats["wait"] = pool.wait_stats.snapshot()
+    return stats
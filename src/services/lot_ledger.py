@@ -0,0 +1,135 @@
+from collections import deque
+
+from sqlalchemy import text
+
+# Rows read and written at a time when rebuilding the lots from the transactions
+REBUILD_BATCH_SIZE = 5000
+
+
+class Position:
+    """
+    Functionality: The cost basis of one asset held in a portfolio, updated trade by trade. The position is made of lots, each a quantity bought at a price, held oldest first as [lotID, quantity, price, date] lists:
+    - 'fifo': every buy opens a lot and sells close the oldest lots first.
+    - 'average': the position is a single lot whose price is the average cost of every unit held, buys merge into it and sells close it at that price.
+
+    A trade only touches the lots it opens or closes, so only those lots need to be loaded: the position's total quantity and cost are passed in, and 'lots' may be just the oldest lots, enough to cover the quantity sold. Lots opened by the position have a lotID of None until they are written.
+
+    Input:
+    - method: 'fifo' or 'average' (see COST_METHODS in models/portfolios.py).
+    - quantity, cost: The quantity held and its total cost before the first trade.
+    - lots: The oldest open lots, as (lotID, quantity, price, date) tuples.
+    """
+
+    def __init__(self, method, quantity=0, cost=0.0, lots=()):
+        self.method = method
+        self.quantity = quantity
+        self.cost = cost
+        self.lots = deque([list(lot) for lot in lots])
+        # Loaded lots as they were, to write only the ones that changed
+        self.loaded = {lot[0]: (lot[1], lot[2]) for lot in self.lots}
+        self.closed = []
+
+    @property
+    def average_price(self):
+        return self.cost / self.quantity if self.quantity else 0.0
+
+    def buy(self, quantity, price, day):
+        self.quantity += quantity
+        self.cost += quantity * price
+        if self.method == "average" and self.lots:
+            lot = self.lots[-1]
+            lot[2] = (lot[1] * lot[2] + quantity * price) / (lot[1] + quantity)
+            lot[1] += quantity
+        else:
+            self.lots.append([None, quantity, price, day])
+
+    def sell(self, quantity, price):
+        """
+        Functionality: Closes 'quantity' units of the position, oldest lots first.
+
+        Input: The quantity sold, at most the quantity held, and the price it was sold at.
+        Output: The realized profit or loss, the proceeds less the cost of the units closed.
+        """
+        remaining, cost = quantity, 0.0
+        while remaining and self.lots:
+            lot = self.lots[0]
+            closed = min(lot[1], remaining)
+            cost += closed * lot[2]
+            lot[1] -= closed
+            remaining -= closed
+            if lot[1] == 0:
+                self.lots.popleft()
+                if lot[0] is not None:
+                    self.closed.append(lot[0])
+        # Units without a lot (a ledger that drifted from the owned assets) are closed at the average cost
+        cost += remaining * self.average_price
+        self.quantity -= quantity
+        self.cost = self.cost - cost if self.quantity else 0.0
+        return quantity * price - cost
+
+    def changes(self):
+        """
+        Functionality: Lists the lot rows to write after the trades.
+
+        Input: None.
+        Output: A tuple of the lots to insert as (quantity, price, date) tuples, the lots to update as (lotID, quantity, price) tuples, and the lotIDs of the lots closed.
+        """
+        inserts = [(lot[1], lot[2], lot[3]) for lot in self.lots if lot[0] is None]
+        updates = [(lot[0], lot[1], lot[2]) for lot in self.lots if lot[0] is not None and self.loaded[lot[0]] != (lot[1], lot[2])]
+        return inserts, updates, list(self.closed)
+
+
+def rebuild_lots(conn):
+    """
+    Functionality: Rebuilds the lots of every portfolio by replaying its transactions in order with the portfolio's cost method, and records the realized P&L of every sell and the average cost on the owned assets. Trades keep the lots up to date incrementally, so this is only needed to build the ledger of existing transactions or to repair it. The transactions are streamed from a server side cursor, one (portfolio, asset) position at a time, and the results written in batches of REBUILD_BATCH_SIZE rows. Sells of more than the replayed position holds are capped at the quantity held.
+
+    Input: A SQLAlchemy connection inside a transaction, the caller commits.
+    Output: A dictionary with the number of 'lots' written and 'sells' priced.
+    """
+    conn.execute(text("DELETE FROM lots"))
+    stmt = text('''
+        SELECT t."portfolioID", t."assetID", t."transactionID", t."transactionType", t.quantity, t.price, t.date, p."costMethod"
+        FROM transactions AS t JOIN portfolios AS p ON p."portfolioID" = t."portfolioID"
+        WHERE t."assetID" IS NOT NULL
+        ORDER BY t."portfolioID", t."assetID", t.date, t."transactionID"
+    ''').execution_options(stream_results=True, yield_per=REBUILD_BATCH_SIZE)
+
+    lots, sells, owned = [], [], []
+    counts = {"lots": 0, "sells": 0}
+
+    def flush(final=False):
+        # Write the pending rows once a batch is full
+        if lots and (final or len(lots) >= REBUILD_BATCH_SIZE):
+            conn.execute(text('INSERT INTO lots ("portfolioID", "assetID", quantity, price, date) VALUES (:portfolioID, :assetID, :quantity, :price, :date)'), lots)
+            counts["lots"] += len(lots)
+            lots.clear()
+        if sells and (final or len(sells) >= REBUILD_BATCH_SIZE):
+            conn.execute(text('UPDATE transactions SET "realizedPnL" = :realizedPnL WHERE "transactionID" = :transactionID'), sells)
+            counts["sells"] += len(sells)
+            sells.clear()
+        if owned and (final or len(owned) >= REBUILD_BATCH_SIZE):
+            conn.execute(text('UPDATE "ownedAssets" SET price = :price WHERE "portfolioID" = :portfolioID AND "assetID" = :assetID'), owned)
+            owned.clear()
+
+    def close(key, position):
+        # Queue the open lots and average cost of a fully replayed position
+        if position is None or not position.quantity:
+            return
+        portfolio_id, asset_id = key
+        lots.extend({"portfolioID": portfolio_id, "assetID": asset_id, "quantity": quantity, "price": price, "date": day} for quantity, price, day in position.changes()[0])
+        owned.append({"portfolioID": portfolio_id, "assetID": asset_id, "price": position.average_price})
+        flush()
+
+    key, position = None, None
+    for portfolio_id, asset_id, transaction_id, transaction_type, quantity, price, day, method in conn.execute(stmt):
+        if (portfolio_id, asset_id) != key:
+            close(key, position)
+            key, position = (portfolio_id, asset_id), Position(method)
+        if transaction_type == "buy":
+            position.buy(quantity, price, day)
+        else:
+            realized = position.sell(min(quantity, position.quantity), price)
+            sells.append({"transactionID": transaction_id, "realizedPnL": realized})
+    close(key, position)
+    flush(final=True)
+    return counts
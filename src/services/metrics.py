@@ -0,0 +1,244 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds (in seconds) of the duration histogram buckets
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Upper bounds of the histogram of SQL statements run per request
+STATEMENT_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+# Longest part of a slow statement written to the log
+SLOW_QUERY_LOG_LENGTH = 2000
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_value(value):
+    # Prometheus sample values, integers without a trailing '.0'
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def format_labels(names, values):
+    # {name="value",...} with backslashes, quotes and newlines escaped
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+class Counter:
+    """
+    Functionality: A thread safe Prometheus counter, one value per combination of label values.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [(self.name + format_labels(self.labels, label_values), value) for label_values, value in values]
+
+
+class Histogram:
+    """
+    Functionality: A thread safe Prometheus histogram, one set of buckets per combination of label values. Observations are counted in the first bucket they fit in and made cumulative when rendered, so an observation is a binary search and three additions under the lock.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # Label values -> [count per bucket..., count above the last bucket, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            series = sorted((label_values, list(counts)) for label_values, counts in self._series.items())
+        samples = []
+        bounds = self.buckets + (float("inf"),)
+        for label_values, counts in series:
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                labels = format_labels(self.labels + ("le",), label_values + (format_value(bound),))
+                samples.append((f"{self.name}_bucket{labels}", cumulative))
+            labels = format_labels(self.labels, label_values)
+            samples.append((f"{self.name}_sum{labels}", counts[-1]))
+            samples.append((f"{self.name}_count{labels}", cumulative))
+        return samples
+
+
+class InstrumentedProvider:
+    """
+    Functionality: Wraps a price provider (see services/price_provider.py), timing every public method called on it into the 'price_provider_request_duration_seconds' histogram, labelled with the provider, the method and whether it succeeded. Every other attribute is passed through unchanged.
+
+    Input: The price provider, the Metrics instance recording the calls and the name used as the provider label, defaults to the provider's 'name' attribute when called.
+    """
+
+    def __init__(self, provider, metrics, name=None):
+        self._provider = provider
+        self._metrics = metrics
+        self._name = name
+
+    def __getattr__(self, attribute):
+        value = getattr(self._provider, attribute)
+        if attribute.startswith("_") or not callable(value):
+            return value
+
+        def timed(*args, **kwargs):
+            if not self._metrics.enabled:
+                return value(*args, **kwargs)
+            start = time.perf_counter()
+            outcome = "error"
+            try:
+                result = value(*args, **kwargs)
+                outcome = "success"
+                return result
+            finally:
+                name = self._name or getattr(self._provider, "name", "unknown")
+                self._metrics.provider_duration.observe(time.perf_counter() - start, name, attribute, outcome)
+        return timed
+
+
+class Metrics:
+    """
+    Functionality: Collects the app's performance metrics in memory and renders them in the Prometheus text format (see GET /metrics):
+    - The number and duration of requests per endpoint (the blueprint's view function), method and status code.
+    - The number of SQL statements each request runs and the time they take, to spot N+1 queries per endpoint.
+    - The duration of every SQL statement, and a warning logged for statements slower than SLOW_QUERY_MS.
+    - The duration of the calls made to the price provider (see InstrumentedProvider).
+
+    Recording a request costs a few timer reads and dictionary updates, and a statement two timer reads and one histogram observation, so the metrics are cheap enough to stay enabled in production. Every gunicorn worker keeps its own metrics, Prometheus scrapes and aggregates them per worker.
+
+    The metrics follow the same 'init_app' pattern as the other Flask extensions in 'init.py'.
+
+    Config:
+    - METRICS_ENABLED: Record the metrics (default true). When disabled no hook is registered and provider calls are not timed.
+    - SLOW_QUERY_MS: Statements running for at least this many milliseconds are logged as slow, 0 disables the log (default 500).
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.slow_query_seconds = 0.5
+        self.logger = logging.getLogger(__name__)
+        self._listening = False
+        self.requests = Counter("http_requests_total", "Requests handled, per endpoint, method and status code.", ("endpoint", "method", "status"))
+        self.request_duration = Histogram("http_request_duration_seconds", "Time taken to handle a request, per endpoint and method.", ("endpoint", "method"))
+        self.request_statements = Histogram(
+            "http_request_sql_statements", "SQL statements run per request, per endpoint.", ("endpoint",), buckets=STATEMENT_COUNT_BUCKETS
+        )
+        self.request_sql_duration = Histogram("http_request_sql_duration_seconds", "Time spent running SQL statements per request, per endpoint.", ("endpoint",))
+        self.statement_duration = Histogram("db_statement_duration_seconds", "Time taken to run a SQL statement.")
+        self.slow_statements = Counter("db_slow_statements_total", "SQL statements slower than SLOW_QUERY_MS.")
+        self.provider_duration = Histogram(
+            "price_provider_request_duration_seconds", "Time taken by calls to the price provider, per provider, call and outcome.", ("provider", "call", "outcome")
+        )
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Read metrics settings from the app config
+        self.enabled = bool(app.config.get("METRICS_ENABLED", True))
+        self.slow_query_seconds = float(app.config.get("SLOW_QUERY_MS", 500)) / 1000
+        self.logger = app.logger
+        app.extensions["metrics"] = self
+        if not self.enabled:
+            return
+
+        app.before_request(self._start_request)
+        app.after_request(self._end_request)
+        # Statements are timed on every engine, once however many apps are created
+        if not self._listening:
+            event.listen(Engine, "before_cursor_execute", self._before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", self._after_cursor_execute)
+            self._listening = True
+
+    def instrument(self, provider, name=None):
+        # Time the calls made to a price provider client
+        return InstrumentedProvider(provider, self, name)
+
+    def render(self, samples=()):
+        """
+        Functionality: Renders the metrics in the Prometheus text exposition format.
+
+        Input: Extra values read when scraped, such as the connection pool state, as (name, type, help, value) tuples. The type is 'gauge' for values that go up and down, or 'counter' for totals that only go up (named '..._total').
+        Output: The metrics as a string.
+        """
+        lines = []
+        for name, kind, documentation, value in samples:
+            lines += [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}", f"{name} {format_value(value)}"]
+        for metric in (
+            self.requests, self.request_duration, self.request_statements, self.request_sql_duration,
+            self.statement_duration, self.slow_statements, self.provider_duration
+        ):
+            lines += [f"# HELP {metric.name} {metric.documentation}", f"# TYPE {metric.name} {metric.kind}"]
+            lines += [f"{sample} {format_value(value)}" for sample, value in metric.samples()]
+        return "\n".join(lines) + "\n"
+
+    def _start_request(self):
+        g.metrics_start = time.perf_counter()
+        g.sql_statements = 0
+        g.sql_seconds = 0.0
+
+    def _end_request(self, response):
+        start = g.get("metrics_start")
+        if start is None:
+            return response
+        # Requests that matched no route share one label, so unknown URLs cannot grow the metrics
+        endpoint = request.endpoint or "unmatched"
+        self.requests.inc(endpoint, request.method, str(response.status_code))
+        self.request_duration.observe(time.perf_counter() - start, endpoint, request.method)
+        self.request_statements.observe(g.sql_statements, endpoint)
+        self.request_sql_duration.observe(g.sql_seconds, endpoint)
+        return response
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.metrics_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "metrics_start", None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        self.statement_duration.observe(elapsed)
+        # Statements run outside a request, by the price refresher or CLI commands, only count towards the totals
+        if has_request_context() and "sql_statements" in g:
+            g.sql_statements += 1
+            g.sql_seconds += elapsed
+        if self.slow_query_seconds and elapsed >= self.slow_query_seconds:
+            self.slow_statements.inc()
+            self.logger.warning(
+                "Slow SQL statement (%.1f ms) in %s: %s",
+                elapsed * 1000, request.endpoint if has_request_context() else "no request", statement[:SLOW_QUERY_LOG_LENGTH]
+            )
@@ -0,0 +1,119 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class HasherBusy(Exception):
+    """Raised when no password hashing worker became available within BCRYPT_QUEUE_TIMEOUT seconds."""
+
+
+class PasswordHasher:
+    """
+    Functionality: Runs bcrypt password hashing and verification on a bounded pool of worker threads instead of directly on the request thread. bcrypt releases the GIL while hashing, so the pool spreads the work over the available cores, while its bound caps how much CPU a burst of logins can take from the rest of the API. Requests waiting for a free worker are themselves bounded: once the queue is full, further requests wait at most BCRYPT_QUEUE_TIMEOUT seconds before HasherBusy is raised (served as 503 by the app).
+
+    Password hashes created with a different cost than BCRYPT_LOG_ROUNDS are upgraded in the background after a successful login.
+
+    Config:
+    - BCRYPT_LOG_ROUNDS: The bcrypt work factor used for new hashes (read by Flask-Bcrypt).
+    - BCRYPT_WORKERS: Number of threads hashing passwords at the same time.
+    - BCRYPT_MAX_QUEUE: Number of hashing requests allowed to wait for a worker.
+    - BCRYPT_QUEUE_TIMEOUT: Seconds a request waits for room in the queue before giving up.
+    """
+
+    def __init__(self, bcrypt, app=None):
+        self.bcrypt = bcrypt
+        self.app = None
+        self.log_rounds = 12
+        self.queue_timeout = 5
+        self._executor = None
+        self._slots = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.log_rounds = int(app.config.get("BCRYPT_LOG_ROUNDS", 12))
+        workers = int(app.config.get("BCRYPT_WORKERS", 4))
+        max_queue = int(app.config.get("BCRYPT_MAX_QUEUE", 64))
+        self.queue_timeout = float(app.config.get("BCRYPT_QUEUE_TIMEOUT", 5))
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        # Every running or queued hash holds a slot
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        app.extensions["password_hasher"] = self
+
+    def generate_password_hash(self, password):
+        """
+        Functionality: Hashes a password with the configured work factor on the hashing pool.
+
+        Input: The plain text password.
+        Output: The bcrypt hash as a string.
+
+        Errors:
+        - Raises HasherBusy if the hashing pool stays full for longer than BCRYPT_QUEUE_TIMEOUT seconds.
+        """
+        return self._run(self.bcrypt.generate_password_hash, password).decode("utf-8")
+
+    def check_password_hash(self, pw_hash, password):
+        """
+        Functionality: Verifies a password against a bcrypt hash on the hashing pool.
+
+        Input: The stored bcrypt hash and the plain text password.
+        Output: True if the password matches the hash, False otherwise.
+
+        Errors:
+        - Raises HasherBusy if the hashing pool stays full for longer than BCRYPT_QUEUE_TIMEOUT seconds.
+        """
+        return self._run(self.bcrypt.check_password_hash, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """
+        Functionality: Checks whether a bcrypt hash was created with a different work factor than BCRYPT_LOG_ROUNDS.
+
+        Input: The stored bcrypt hash, formatted as '$2b$<cost>$<salt and hash>'.
+        Output: True if the hash should be upgraded, False otherwise.
+        """
+        try:
+            return int(pw_hash.split("$")[2]) != self.log_rounds
+        except (IndexError, ValueError):
+            return False
+
+    def rehash_in_background(self, model, key, password, old_hash):
+        """
+        Functionality: Upgrades a stored password hash to the configured work factor without delaying the current request. The new hash is only written if the stored hash is still the one the password was verified against, so a password changed in the meantime is never overwritten. The upgrade is skipped if the hashing pool is full, it will be retried on a later login.
+
+        Input:
+        - model: The model class holding the password, with a 'password' column.
+        - key: A dictionary identifying the row, such as {'userID': 1}.
+        - password: The plain text password that was just verified.
+        - old_hash: The hash the password was verified against.
+
+        Output: None.
+        """
+        if not self._slots.acquire(blocking=False):
+            return
+        try:
+            self._executor.submit(self._rehash, model, key, password, old_hash).add_done_callback(lambda _: self._slots.release())
+        except RuntimeError:
+            self._slots.release()
+
+    def _run(self, fn, *args):
+        # Wait for room in the queue, then block on the result of the worker
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise HasherBusy("Too many password hashing requests, please try again shortly.")
+        try:
+            return self._executor.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def _rehash(self, model, key, password, old_hash):
+        # Import here to avoid a circular import with init.py
+        from init import db
+
+        with self.app.app_context():
+            try:
+                new_hash = self.bcrypt.generate_password_hash(password).decode("utf-8")
+                stmt = db.update(model).filter_by(**key).where(model.password == old_hash).values(password=new_hash)
+                db.session.execute(stmt)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                self.app.logger.exception("Background password rehash failed")
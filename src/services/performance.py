@@ -0,0 +1,186 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+# Daily performance of a portfolio over consecutive days:
+# - days: numpy datetime64[D] array of the days covered.
+# - values: market value of the portfolio at the close of every day.
+# - flows: net amount invested on every day (buys minus sells, at their total cost).
+# - returns: return of every day, with the day's flows invested at the start of the day.
+# - assets, quantities, prices: the assets held and their quantity and price at the close of the last day,
+#   from which the series is extended.
+DailySeries = namedtuple("DailySeries", ["days", "values", "flows", "returns", "assets", "quantities", "prices"])
+
+INTERVALS = ("day", "week", "month")
+
+
+def daily_performance(start, end, trades, closes, previous=None):
+    """
+    Functionality: Computes the daily value, net flows and returns of a portfolio from its trades and the daily closing prices of its assets. Positions are the cumulative sum of a (day x asset) matrix of traded quantities, prices a (day x asset) matrix forward filled from the closing prices (or the trade prices on days without a stored price), so no trade is replayed one by one.
+
+    Input:
+    - start, end: The first and last day to compute (datetime.date).
+    - trades: A list of (date, assetID, signed quantity, price, signed total cost) tuples of the trades made from 'start' to 'end', sells having a negative quantity and total cost. When 'previous' is None, trades made before 'start' are included in the opening positions.
+    - closes: A list of (date, assetID, price) tuples of the last stored price of every asset on each day.
+    - previous: The DailySeries computed up to the day before 'start', whose closing positions and prices open this one, or None to start with no positions.
+
+    Output: A DailySeries of the days from 'start' to 'end'.
+    """
+    days = np.arange(np.datetime64(start, "D"), np.datetime64(end, "D") + 1)
+    assets = list(previous.assets) if previous else []
+    asset_index = {asset_id: index for index, asset_id in enumerate(assets)}
+    for _, asset_id, *_ in trades:
+        asset_index.setdefault(asset_id, len(asset_index))
+    assets = list(asset_index)
+    n_days, n_assets = len(days), len(assets)
+
+    opening_quantities = np.zeros(n_assets)
+    opening_prices = np.full(n_assets, np.nan)
+    if previous:
+        opening_quantities[:len(previous.assets)] = previous.quantities
+        opening_prices[:len(previous.assets)] = previous.prices
+
+    opening_value = float(previous.values[-1]) if previous else 0.0
+    # Quantity traded and flows per day, trades before 'start' open the positions without being flows
+    quantity_deltas = np.zeros((n_days, n_assets))
+    flows = np.zeros(n_days)
+    prices = np.full((n_days, n_assets), np.nan)
+    if trades:
+        trade_days = np.array([trade[0] for trade in trades], dtype="datetime64[D]")
+        day_idx = (trade_days - days[0]).astype(np.int64)
+        asset_idx = np.array([asset_index[trade[1]] for trade in trades], dtype=np.int64)
+        quantities = np.array([trade[2] for trade in trades], dtype=np.float64)
+        trade_prices = np.array([trade[3] for trade in trades], dtype=np.float64)
+        costs = np.array([trade[4] for trade in trades], dtype=np.float64)
+
+        before = day_idx < 0
+        np.add.at(opening_quantities, asset_idx[before], quantities[before])
+        opening_prices[asset_idx[before]] = trade_prices[before]
+
+        # Value of the opening positions, on the day before 'start'
+        if previous is None:
+            opening_value = float(np.nansum(opening_quantities * opening_prices))
+
+        within = ~before
+        np.add.at(quantity_deltas, (day_idx[within], asset_idx[within]), quantities[within])
+        flows = np.bincount(day_idx[within], weights=costs[within], minlength=n_days)
+        # Trade prices stand in for days without a stored price
+        prices[day_idx[within], asset_idx[within]] = trade_prices[within]
+
+    # Stored closing prices take precedence over trade prices
+    closes = [close for close in closes if close[1] in asset_index]
+    if closes:
+        close_days = np.array([close[0] for close in closes], dtype="datetime64[D]")
+        close_idx = (close_days - days[0]).astype(np.int64)
+        inside = (close_idx >= 0) & (close_idx < n_days)
+        close_assets = np.array([asset_index[close[1]] for close in closes], dtype=np.int64)
+        close_prices = np.array([close[2] for close in closes], dtype=np.float64)
+        prices[close_idx[inside], close_assets[inside]] = close_prices[inside]
+
+    # Forward fill the prices from the opening prices, day by day for every asset at once
+    prices = np.vstack([opening_prices, prices])
+    filled_rows = np.where(np.isnan(prices), 0, np.arange(n_days + 1)[:, None])
+    np.maximum.accumulate(filled_rows, axis=0, out=filled_rows)
+    prices = prices[filled_rows, np.arange(n_assets)][1:]
+
+    quantities = opening_quantities + np.cumsum(quantity_deltas, axis=0)
+    values = np.nansum(quantities * prices, axis=1)
+
+    # Flows are invested at the start of the day they are made
+    invested = np.r_[opening_value, values[:-1]] + flows
+    returns = np.divide(values, invested, out=np.ones(n_days), where=invested > 0) - 1
+
+    return DailySeries(days, values, flows, returns, assets, quantities[-1].copy(), prices[-1].copy())
+
+
+def concat_series(first, second):
+    # Join two consecutive daily series, the second continuing from the first
+    return DailySeries(
+        np.concatenate([first.days, second.days]),
+        np.concatenate([first.values, second.values]),
+        np.concatenate([first.flows, second.flows]),
+        np.concatenate([first.returns, second.returns]),
+        second.assets,
+        second.quantities,
+        second.prices
+    )
+
+
+def summarize(series, start, end, interval="day"):
+    """
+    Functionality: Reports the performance of a portfolio over a window of its daily series, per day, week or month. Time-weighted returns compound the daily returns, so they are not distorted by money moving in or out, and the cumulative P&L is the change in value less the net flows since the start of the window.
+
+    Input:
+    - series: The DailySeries, covering the window.
+    - start, end: The first and last day of the window (datetime.date).
+    - interval: 'day', 'week' (starting on Monday) or 'month'.
+
+    Output: A list of dictionaries, one per interval in the window, with the interval's first 'date', the 'value' at its close, its 'netFlow', its 'return', and the 'twr' (time-weighted return) and 'pnl' (profit and loss) accumulated since the start of the window.
+    """
+    days = series.days
+    first = int(np.searchsorted(days, np.datetime64(start, "D"), side="left"))
+    last = int(np.searchsorted(days, np.datetime64(end, "D"), side="right"))
+    if first >= last:
+        return []
+    opening_value = series.values[first - 1] if first > 0 else 0.0
+    window_days = days[first:last]
+    values = series.values[first:last]
+    flows = series.flows[first:last]
+    growth = 1 + series.returns[first:last]
+
+    twr = np.cumprod(growth) - 1
+    pnl = values - opening_value - np.cumsum(flows)
+
+    # Start of the interval every day belongs to, and the index of the first day of every interval
+    if interval == "week":
+        # datetime64 days count from Thursday 1970-01-01
+        periods = window_days - ((window_days.astype(np.int64) + 3) % 7)
+    elif interval == "month":
+        periods = window_days.astype("datetime64[M]").astype("datetime64[D]")
+    else:
+        periods = window_days
+    starts = np.flatnonzero(np.r_[True, periods[1:] != periods[:-1]])
+    ends = np.r_[starts[1:], len(window_days)] - 1
+
+    return [
+        {"date": str(date), "value": value, "netFlow": flow, "return": period_return, "twr": cumulative, "pnl": profit}
+        for date, value, flow, period_return, cumulative, profit in zip(
+            np.maximum(periods[starts], window_days[0]).tolist(),
+            values[ends].tolist(),
+            np.add.reduceat(flows, starts).tolist(),
+            (np.multiply.reduceat(growth, starts) - 1).tolist(),
+            twr[ends].tolist(),
+            pnl[ends].tolist()
+        )
+    ]
+
+
+class PerformanceCache:
+    """
+    Functionality: A bounded LRU cache of the daily performance series of portfolios, holding only closed days (before today). Trades are always dated on the day they are made and the price history is append only, so the performance of a closed day never changes: a repeat request only computes the days after the cached ones, continuing from the cached closing positions and prices. Each entry also records the number of transactions dated up to its last day, so it is dropped if the ledger of those days ever changes.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, portfolio_id):
+        # Returns (DailySeries, transaction count) or None
+        with self._lock:
+            entry = self._entries.get(portfolio_id)
+            if entry is not None:
+                self._entries.move_to_end(portfolio_id)
+            return entry
+
+    def put(self, portfolio_id, series, transaction_count):
+        with self._lock:
+            self._entries[portfolio_id] = (series, transaction_count)
+            self._entries.move_to_end(portfolio_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, portfolio_id):
+        with self._lock:
+            self._entries.pop(portfolio_id, None)
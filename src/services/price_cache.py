@@ -0,0 +1,226 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from services.price_provider import PartialFetch
+
+
+# A cached market data entry. 'data' is the market data returned by the provider for one coin,
+# 'fetchedAt' is the (UTC) time it was fetched and 'stale' marks entries served past their TTL.
+CachedPrice = namedtuple("CachedPrice", ["data", "fetchedAt", "stale"])
+
+
+class PriceUnavailable(Exception):
+    """Raised when prices can be neither fetched from the provider nor served from the cache."""
+
+
+class _Entry:
+    __slots__ = ("data", "fetched_at", "fetched_monotonic")
+
+    def __init__(self, data):
+        self.data = data
+        self.fetched_at = datetime.now(timezone.utc)
+        self.fetched_monotonic = time.monotonic()
+
+
+class _Flight:
+    """An upstream fetch in progress, other callers that need the same coins wait on it."""
+
+    __slots__ = ("done", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+
+class PriceCache:
+    """
+    Functionality: A TTL cache of market data sitting in front of the price provider. Market data is cached per coin ID in a bounded LRU map.
+
+    - Fresh entries (younger than PRICE_CACHE_TTL) are served without calling the provider.
+    - Concurrent misses for the same coins are merged into a single upstream fetch (single-flight), the other callers wait for its result.
+    - Expired entries younger than PRICE_CACHE_TTL + PRICE_CACHE_STALE_TTL are served immediately marked as stale while a background fetch revalidates them (stale-while-revalidate). Callers asking for fresh prices fetch them instead.
+    - When the provider fails, the last known prices are served marked as stale instead of failing the caller.
+
+    Hit, miss and coalesced request counters are exposed through stats() so the TTL can be tuned.
+
+    Config:
+    - PRICE_CACHE_TTL: Seconds an entry is considered fresh.
+    - PRICE_CACHE_STALE_TTL: Seconds past the TTL an entry may be served while it is revalidated in the background.
+    - PRICE_CACHE_MAX_SIZE: Maximum number of coins kept in the cache.
+    - PRICE_CACHE_WAIT_TIMEOUT: Maximum seconds a caller waits on another caller's upstream fetch.
+    """
+
+    def __init__(self, provider, ttl=30, stale_ttl=300, max_size=10000, wait_timeout=30):
+        self.provider = provider
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_size = max_size
+        self.wait_timeout = wait_timeout
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._revalidator = ThreadPoolExecutor(max_workers=1, thread_name_prefix="price-cache")
+        self._counters = dict.fromkeys(
+            ("hits", "misses", "coalesced", "stale_served", "revalidations", "upstream_fetches", "upstream_errors", "evictions"), 0
+        )
+
+    def init_app(self, app):
+        # Read cache settings from the app config, keeping the defaults for anything not configured
+        self.ttl = float(app.config.get("PRICE_CACHE_TTL", self.ttl))
+        self.stale_ttl = float(app.config.get("PRICE_CACHE_STALE_TTL", self.stale_ttl))
+        self.max_size = int(app.config.get("PRICE_CACHE_MAX_SIZE", self.max_size))
+        self.wait_timeout = float(app.config.get("PRICE_CACHE_WAIT_TIMEOUT", self.wait_timeout))
+        app.extensions["price_cache"] = self
+
+    def get_many(self, ids, fresh=False):
+        """
+        Functionality: Returns the market data for the given coin IDs, fetching only the coins that are missing or expired from the provider.
+
+        Input:
+        - ids: An iterable of coin IDs.
+        - fresh: Fetch the expired coins before returning instead of serving them stale and revalidating them in the background, for callers that store what they get (see update_asset_prices). The stale entries are still served, marked as stale, if the provider fails.
+
+        Output: A dictionary mapping each coin ID that could be served to a CachedPrice. Coins unknown to the provider are left out.
+
+        Errors:
+        - Raises PriceUnavailable if the provider fails and none of the requested coins have a cached price to fall back on.
+        """
+        ids = list(dict.fromkeys(ids))
+        now = time.monotonic()
+        result = {}
+        to_fetch, to_revalidate, waiting = [], [], {}
+
+        with self._lock:
+            for coin_id in ids:
+                entry = self._entries.get(coin_id)
+                age = now - entry.fetched_monotonic if entry else None
+
+                # Fresh entry, serve it from the cache
+                if entry and age < self.ttl:
+                    self._entries.move_to_end(coin_id)
+                    self._counters["hits"] += 1
+                    result[coin_id] = CachedPrice(entry.data, entry.fetched_at, False)
+                # Expired but within the stale window, serve it and revalidate in the background
+                elif entry and age < self.ttl + self.stale_ttl and not fresh:
+                    self._counters["stale_served"] += 1
+                    result[coin_id] = CachedPrice(entry.data, entry.fetched_at, True)
+                    if coin_id not in self._inflight:
+                        to_revalidate.append(coin_id)
+                # Another caller is already fetching this coin, wait for its result
+                elif coin_id in self._inflight:
+                    self._counters["coalesced"] += 1
+                    waiting[coin_id] = self._inflight[coin_id]
+                # Missing, too old or expired for a caller asking for fresh prices, fetch it from the provider
+                else:
+                    self._counters["misses"] += 1
+                    to_fetch.append(coin_id)
+
+            fetch_flight = self._register_flight(to_fetch)
+            revalidate_flight = self._register_flight(to_revalidate)
+            if fetch_flight:
+                self._counters["upstream_fetches"] += 1
+            if revalidate_flight:
+                self._counters["upstream_fetches"] += 1
+                self._counters["revalidations"] += 1
+
+        if revalidate_flight:
+            self._revalidator.submit(self._fetch, to_revalidate, revalidate_flight)
+
+        if fetch_flight:
+            self._fetch(to_fetch, fetch_flight)
+
+        for flight in set(waiting.values()):
+            flight.done.wait(self.wait_timeout)
+
+        # Collect the coins fetched by this caller or by the flights it waited on
+        errors = [flight.error for flight in [fetch_flight, *waiting.values()] if flight and flight.error]
+        with self._lock:
+            for coin_id in to_fetch + list(waiting):
+                entry = self._entries.get(coin_id)
+                if entry is None:
+                    continue
+                # Still expired when the fetch failed, fall back to the last known price
+                expired = time.monotonic() - entry.fetched_monotonic >= self.ttl
+                if expired:
+                    self._counters["stale_served"] += 1
+                result[coin_id] = CachedPrice(entry.data, entry.fetched_at, expired)
+
+        if errors and not result:
+            raise PriceUnavailable("Unable to retrieve prices from the price provider and no cached prices are available.") from errors[0]
+        return result
+
+    def put_many(self, market_data):
+        """
+        Functionality: Stores market data fetched outside of the cache (for example a full market listing), so later lookups for those coins are served from the cache.
+
+        Input: A list of market data dictionaries as returned by the provider, each containing an 'id' key.
+        Output: None.
+        """
+        with self._lock:
+            for data in market_data:
+                self._store(data)
+
+    def stats(self):
+        """
+        Functionality: Returns the cache counters and settings.
+
+        Input: None.
+        Output: A dictionary of counters (hits, misses, coalesced, stale_served, revalidations, upstream_fetches, upstream_errors, evictions), the hit ratio, the current size and the configured limits.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats["size"] = len(self._entries)
+            stats["inflight"] = len(self._inflight)
+        lookups = stats["hits"] + stats["misses"] + stats["coalesced"] + stats["stale_served"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else None
+        stats.update(ttl=self.ttl, stale_ttl=self.stale_ttl, max_size=self.max_size)
+        return stats
+
+    def clear(self):
+        # Drop every cached entry, counters are kept
+        with self._lock:
+            self._entries.clear()
+
+    def _register_flight(self, ids):
+        # Must be called with the lock held
+        if not ids:
+            return None
+        flight = _Flight()
+        for coin_id in ids:
+            self._inflight[coin_id] = flight
+        return flight
+
+    def _fetch(self, ids, flight):
+        try:
+            # Fetched in chunks, in parallel for the configured provider (see PriceProvider.get_markets)
+            try:
+                market_data = self.provider.get_markets(ids)
+            except PartialFetch as e:
+                # Keep the chunks that were fetched, the other coins fall back on their cached prices
+                flight.error = e
+                market_data = e.markets
+            with self._lock:
+                for data in market_data.values():
+                    self._store(data)
+        except Exception as e:
+            flight.error = e
+        finally:
+            # Release the waiters, even when the fetch failed
+            with self._lock:
+                if flight.error is not None:
+                    self._counters["upstream_errors"] += 1
+                for coin_id in ids:
+                    if self._inflight.get(coin_id) is flight:
+                        del self._inflight[coin_id]
+            flight.done.set()
+
+    def _store(self, data):
+        # Must be called with the lock held, evicts the least recently used entries once full
+        self._entries[data["id"]] = _Entry(data)
+        self._entries.move_to_end(data["id"])
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
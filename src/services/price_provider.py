@@ -0,0 +1,435 @@
+from abc import ABC, abstractmethod
+import hashlib
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.fixtures import load_markets_fixture
+
+PROVIDERS = ("coingecko", "fake")
+
+COINGECKO_API_URL = "https://api.coingecko.com/api/v3"
+COINGECKO_PRO_API_URL = "https://pro-api.coingecko.com/api/v3"
+
+
+class PriceProviderError(Exception):
+    """Raised when the price provider cannot be reached or returns an error."""
+
+
+class CircuitOpen(PriceProviderError):
+    """Raised instead of calling the price provider while its circuit breaker is open."""
+
+
+class RateLimited(PriceProviderError):
+    """Raised when a call would have to wait longer than allowed for the provider's rate limit."""
+
+
+class PartialFetch(PriceProviderError):
+    """Raised when some chunks of a fetch failed, 'markets' holds the market data of the chunks that succeeded."""
+
+    def __init__(self, message, markets, errors):
+        super().__init__(message)
+        self.markets = markets
+        self.errors = errors
+
+
+class PriceProvider(ABC):
+    """
+    Functionality: The interface of the price providers serving market data in the format of CoinGecko's /coins/markets endpoint: one dictionary per coin with at least the 'id', 'symbol', 'name', 'market_cap_rank' and 'current_price' keys. Providers implement get_coins_markets, a provider missing it cannot be created.
+    """
+
+    name = "base"
+    # Most coins returned by one call, CoinGecko's largest page
+    chunk_size = 250
+
+    @abstractmethod
+    def get_coins_markets(self, vs_currency="usd", ids=None, per_page=100, page=1):
+        """
+        Functionality: Returns one page of the market data of coins, ordered by market cap.
+
+        Input:
+        - vs_currency: The currency prices are quoted in.
+        - ids: The coin IDs to return, as a comma separated string or a list, or None for every coin.
+        - per_page, page: The page of coins to return.
+
+        Output: A list of coin dictionaries. Unknown coin IDs are left out.
+
+        Errors:
+        - Raises PriceProviderError if the provider fails.
+        """
+
+    def get_markets(self, ids, vs_currency="usd"):
+        """
+        Functionality: Returns the market data of any number of coins, fetched in chunks of at most 'chunk_size' coin IDs per call, which keeps every call within the provider's page size and URL length limits.
+
+        Input: An iterable of coin IDs and the currency prices are quoted in.
+        Output: A dictionary mapping coin IDs to their market data. Unknown coin IDs are left out.
+
+        Errors:
+        - Raises PartialFetch if some chunks failed, holding the market data of the others.
+        - Raises the PriceProviderError of the provider if every chunk failed.
+        """
+        ids = list(dict.fromkeys(ids))
+        calls = [{"ids": ids[start:start + self.chunk_size], "per_page": self.chunk_size} for start in range(0, len(ids), self.chunk_size)]
+        return self.fetch_chunks(calls, vs_currency)
+
+    def get_top_coins(self, count, vs_currency="usd"):
+        """
+        Functionality: Returns the market data of the 'count' coins with the largest market cap, fetched in pages of 'chunk_size' coins.
+
+        Input: The number of coins and the currency prices are quoted in.
+        Output: A list of market data dictionaries, ordered by market cap.
+
+        Errors:
+        - Raises PartialFetch if some pages failed, holding the market data of the others.
+        - Raises the PriceProviderError of the provider if every page failed.
+        """
+        calls = [{"per_page": self.chunk_size, "page": page} for page in range(1, math.ceil(count / self.chunk_size) + 1)]
+        return list(self.fetch_chunks(calls, vs_currency).values())[:count]
+
+    def fetch_chunks(self, calls, vs_currency):
+        # Run the calls (see map_calls) and merge their results into one map, in call order
+        def fetch(params):
+            try:
+                return self.get_coins_markets(vs_currency=vs_currency, **params), None
+            except Exception as e:
+                return None, e
+
+        markets, errors = {}, []
+        for market_data, error in self.map_calls(fetch, calls):
+            if error is not None:
+                errors.append(error)
+                continue
+            for data in market_data:
+                markets.setdefault(data["id"], data)
+        if errors and not markets:
+            raise errors[0]
+        if errors:
+            raise PartialFetch(f"{len(errors)} of {len(calls)} price provider calls failed: {errors[0]}", markets, errors) from errors[0]
+        return markets
+
+    def map_calls(self, fetch, calls):
+        # Calls are made one after the other, see ConfiguredPriceProvider for the parallel version
+        return [fetch(params) for params in calls]
+
+
+class CircuitBreaker:
+    """
+    Functionality: Stops calling a failing upstream for a while, so a provider outage fails fast instead of tying up every worker thread in timeouts and retries. After 'failure_threshold' consecutive failures the circuit opens and calls are refused with CircuitOpen. Once 'reset_timeout' seconds have passed a single trial call is let through: the circuit closes if it succeeds and opens again if it fails.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def before_call(self):
+        # Raises CircuitOpen unless the call may go through
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if self._trial or time.monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitOpen("The price provider is unavailable, calls are paused after repeated failures.")
+            self._trial = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+
+def retry_after(response, default=60):
+    # Seconds to wait given by a 429 response's Retry-After header, HTTP dates are not used by CoinGecko
+    try:
+        return max(float(response.headers.get("Retry-After", default)), 0)
+    except ValueError:
+        return default
+
+
+class RateLimiter:
+    """
+    Functionality: Spaces out calls to stay within a provider's rate limit of 'rate' calls per minute, allowing bursts of up to 'burst' calls (a token bucket, kept as the time the next call is due). A 429 response pauses every call for the time the provider asked for.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.interval = 60 / rate
+        self.burst = max(burst, 1)
+        self._due = 0.0
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, max_wait):
+        """
+        Functionality: Waits until a call may be made and reserves it.
+
+        Input: The most seconds to wait.
+        Output: None.
+
+        Errors:
+        - Raises RateLimited, without waiting, if the call could not be made within 'max_wait' seconds.
+        """
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._paused_until, self._due - (self.burst - 1) * self.interval)
+            if start - now > max_wait:
+                raise RateLimited(f"The price provider's rate limit allows the next call in {start - now:.1f} seconds.")
+            self._due = max(self._due, start) + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class CoinGeckoProvider(PriceProvider):
+    """
+    Functionality: Fetches market data from the CoinGecko API over a pooled keep-alive HTTP session.
+    - Every request has a connect and a read timeout, so a hung upstream cannot block a worker.
+    - Connection errors and 5xx responses are retried a bounded number of times with exponential backoff. The backoff ignores Retry-After headers and sleeps at most 'max_wait' seconds in total, so a call never blocks for longer than its timeouts plus 'max_wait'.
+    - A circuit breaker (see CircuitBreaker) stops calling CoinGecko while it keeps failing.
+    - Calls are spaced out to stay within the API's rate limit (see RateLimiter). A 429 (Too Many Requests) response pauses the calls for its Retry-After time and the call is retried once, if that is within 'max_wait'.
+
+    Input:
+    - api_key: A CoinGecko Pro API key, or None for the public API.
+    - connect_timeout, read_timeout: Seconds to wait to connect and between bytes of the response.
+    - retries, backoff: Number of retries and the backoff factor, retries wait backoff * 2^(retry - 1) seconds.
+    - pool_size: Connections kept open to CoinGecko.
+    - failure_threshold, reset_timeout: Settings of the circuit breaker.
+    - rate_limit, burst: Calls allowed per minute (0 for no limit) and in a burst.
+    - max_wait: Most seconds a call waits for the rate limit before RateLimited is raised.
+    """
+
+    name = "coingecko"
+
+    def __init__(
+        self, api_key=None, connect_timeout=3.05, read_timeout=10, retries=2, backoff=0.5, pool_size=10,
+        failure_threshold=5, reset_timeout=30, rate_limit=30, burst=10, max_wait=30
+    ):
+        self.base_url = COINGECKO_PRO_API_URL if api_key else COINGECKO_API_URL
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.limiter = RateLimiter(rate_limit, burst) if rate_limit > 0 else None
+        self.max_wait = max_wait
+        self.session = requests.Session()
+        self.session.headers["Accept"] = "application/json"
+        if api_key:
+            self.session.headers["x-cg-pro-api-key"] = api_key
+        # Retry-After is left to get(), a 429 or 503 asking for a minute must not hold the thread inside the session.
+        # Every backoff sleep is capped so the retries of one call sleep at most 'max_wait' seconds in total
+        retry = Retry(
+            total=retries, backoff_factor=backoff, backoff_max=max_wait / retries if retries else 0,
+            status_forcelist=(500, 502, 503, 504), allowed_methods=frozenset(["GET"]), raise_on_status=False,
+            respect_retry_after_header=False
+        )
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry))
+
+    def get(self, path, params=None):
+        """
+        Functionality: Sends a GET request to the CoinGecko API through the circuit breaker.
+
+        Input: The path of the endpoint and its query parameters.
+        Output: The decoded JSON response.
+
+        Errors:
+        - Raises CircuitOpen while the circuit breaker is open.
+        - Raises RateLimited if the rate limit does not allow the call within 'max_wait' seconds.
+        - Raises PriceProviderError if the request fails, times out or returns an error status once the retries are used up.
+        """
+        for attempt in range(2):
+            if self.limiter is not None:
+                self.limiter.acquire(self.max_wait)
+            self.breaker.before_call()
+            try:
+                response = self.session.get(self.base_url + path, params=params, timeout=self.timeout)
+                # Throttled calls are answered, they do not count as failures of the provider
+                if response.status_code == 429:
+                    self.breaker.record_success()
+                    if self.limiter is not None:
+                        self.limiter.pause(retry_after(response))
+                        if attempt == 0:
+                            continue
+                    raise RateLimited(f"CoinGecko rate limited the request to {path}.")
+                response.raise_for_status()
+                content = response.json()
+            except (requests.RequestException, ValueError) as e:
+                self.breaker.record_failure()
+                raise PriceProviderError(f"CoinGecko request to {path} failed: {e}") from e
+            self.breaker.record_success()
+            return content
+
+    def get_coins_markets(self, vs_currency="usd", ids=None, per_page=100, page=1):
+        params = {"vs_currency": vs_currency, "per_page": per_page, "page": page}
+        if ids:
+            params["ids"] = ids if isinstance(ids, str) else ",".join(ids)
+        return self.get("/coins/markets", params)
+
+
+class FakePriceProvider(PriceProvider):
+    """
+    Functionality: An in-process price provider for benchmarks, tests and offline development. It serves a fixed universe of coins: the bundled market snapshot (see utils/fixtures.py) followed by 'extra_assets' made up coins named 'synthetic-asset-<index>' as created by 'flask db seed-synthetic'. Their prices are derived from the coin IDs, so every run sees the same prices.
+
+    Input:
+    - coins: The coins served before the made up ones, defaults to the bundled snapshot.
+    - extra_assets: The number of made up coins.
+    - latency: Seconds every call waits, to simulate the round trip to a real provider.
+    """
+
+    name = "fake"
+
+    def __init__(self, coins=None, extra_assets=0, latency=0):
+        self.coins = list(load_markets_fixture() if coins is None else coins)
+        self.extra_assets = extra_assets
+        self.latency = latency
+        self._index = {coin["id"]: position for position, coin in enumerate(self.coins)}
+
+    def coin(self, position):
+        # The coin at a position of the universe, made up past the end of 'coins'
+        if position < len(self.coins):
+            return dict(self.coins[position])
+        index = position - len(self.coins)
+        digest = hashlib.sha256(f"synthetic-asset-{index}".encode()).digest()
+        price = float(f"{int.from_bytes(digest[:8], 'big') / 2 ** 64 * 100:.8g}") or 1.0
+        return {
+            "id": f"synthetic-asset-{index}",
+            "symbol": f"syn{index}",
+            "name": f"Synthetic Asset {index}",
+            "market_cap_rank": position + 1,
+            "current_price": price
+        }
+
+    def position(self, coin_id):
+        # Position of a coin ID in the universe, or None if it is not part of it
+        if coin_id in self._index:
+            return self._index[coin_id]
+        prefix, _, index = coin_id.rpartition("-")
+        if prefix == "synthetic-asset" and index.isdigit() and int(index) < self.extra_assets and str(int(index)) == index:
+            return len(self.coins) + int(index)
+        return None
+
+    def get_coins_markets(self, vs_currency="usd", ids=None, per_page=100, page=1):
+        if self.latency:
+            time.sleep(self.latency)
+        if ids:
+            wanted = ids.split(",") if isinstance(ids, str) else ids
+            positions = sorted({position for position in map(self.position, wanted) if position is not None})
+        else:
+            positions = range(len(self.coins) + self.extra_assets)
+        start = (max(page, 1) - 1) * per_page
+        return [self.coin(position) for position in positions[start:start + per_page]]
+
+
+def create_provider(config):
+    """
+    Functionality: Builds the price provider selected by the PRICE_PROVIDER setting.
+
+    Input: The app config.
+    Output: A PriceProvider.
+
+    Errors:
+    - Raises ValueError if PRICE_PROVIDER is not one of PROVIDERS.
+    """
+    provider = config.get("PRICE_PROVIDER", "coingecko")
+    if provider == "coingecko":
+        return CoinGeckoProvider(
+            api_key=config.get("COINGECKO_API_KEY") or None,
+            connect_timeout=float(config.get("PRICE_PROVIDER_CONNECT_TIMEOUT", 3.05)),
+            read_timeout=float(config.get("PRICE_PROVIDER_READ_TIMEOUT", 10)),
+            retries=int(config.get("PRICE_PROVIDER_RETRIES", 2)),
+            backoff=float(config.get("PRICE_PROVIDER_BACKOFF", 0.5)),
+            pool_size=int(config.get("PRICE_PROVIDER_POOL_SIZE", 10)),
+            failure_threshold=int(config.get("PRICE_PROVIDER_FAILURE_THRESHOLD", 5)),
+            reset_timeout=float(config.get("PRICE_PROVIDER_RESET_TIMEOUT", 30)),
+            rate_limit=float(config.get("PRICE_PROVIDER_RATE_LIMIT", 30)),
+            burst=int(config.get("PRICE_PROVIDER_BURST", 10)),
+            max_wait=float(config.get("PRICE_PROVIDER_MAX_WAIT", 30))
+        )
+    if provider == "fake":
+        return FakePriceProvider(
+            extra_assets=int(config.get("PRICE_PROVIDER_FAKE_ASSETS", 0)),
+            latency=float(config.get("PRICE_PROVIDER_FAKE_LATENCY_MS", 0)) / 1000
+        )
+    raise ValueError(f"Unknown PRICE_PROVIDER '{provider}', expected one of: {', '.join(PROVIDERS)}.")
+
+
+class ConfiguredPriceProvider(PriceProvider):
+    """
+    Functionality: The app's price provider, selected from the app config when the app is created. It follows the same 'init_app' pattern as the other Flask extensions in 'init.py', so the price cache and controllers can hold it before the app exists. Until 'init_app' is called it uses CoinGecko with the default settings.
+
+    Input: The Metrics instance timing the provider calls (see services/metrics.py), or None.
+
+    Config:
+    - PRICE_PROVIDER: 'coingecko' (default) or 'fake' (see FakePriceProvider).
+    - COINGECKO_API_KEY: CoinGecko Pro API key, the public API is used without one.
+    - PRICE_PROVIDER_CONNECT_TIMEOUT, PRICE_PROVIDER_READ_TIMEOUT: Timeouts of CoinGecko requests, in seconds.
+    - PRICE_PROVIDER_RETRIES, PRICE_PROVIDER_BACKOFF: Retries of failed CoinGecko requests and their backoff factor.
+    - PRICE_PROVIDER_POOL_SIZE: Keep-alive connections kept open to CoinGecko.
+    - PRICE_PROVIDER_FAILURE_THRESHOLD, PRICE_PROVIDER_RESET_TIMEOUT: Consecutive failures opening the circuit breaker, and seconds before it lets a call through again.
+    - PRICE_PROVIDER_RATE_LIMIT, PRICE_PROVIDER_BURST, PRICE_PROVIDER_MAX_WAIT: CoinGecko calls allowed per minute (0 for no limit) and in a burst, and the most seconds a call waits for the rate limit.
+    - PRICE_PROVIDER_CHUNK_SIZE: Most coin IDs fetched per call by get_markets and coins per page by get_top_coins.
+    - PRICE_PROVIDER_WORKERS: Size of the thread pool fetching the chunks in parallel, so fetching thousands of coins takes about one round trip instead of one per chunk.
+    - PRICE_PROVIDER_FAKE_ASSETS, PRICE_PROVIDER_FAKE_LATENCY_MS: Made up coins served by the fake provider, and the latency it simulates.
+    """
+
+    def __init__(self, metrics=None, app=None):
+        self.metrics = metrics
+        self.backend = None
+        self.executor = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend = self.instrument(create_provider(app.config))
+        self.chunk_size = int(app.config.get("PRICE_PROVIDER_CHUNK_SIZE", self.chunk_size))
+        workers = int(app.config.get("PRICE_PROVIDER_WORKERS", 20))
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="price-provider") if workers > 1 else None
+        app.extensions["price_provider"] = self
+
+    def instrument(self, provider):
+        return self.metrics.instrument(provider) if self.metrics is not None else provider
+
+    def get_backend(self):
+        if self.backend is None:
+            with self._lock:
+                if self.backend is None:
+                    self.backend = self.instrument(CoinGeckoProvider())
+        return self.backend
+
+    @property
+    def name(self):
+        return self.get_backend().name
+
+    def get_coins_markets(self, vs_currency="usd", ids=None, per_page=100, page=1):
+        return self.get_backend().get_coins_markets(vs_currency=vs_currency, ids=ids, per_page=per_page, page=page)
+
+    def map_calls(self, fetch, calls):
+        # Fetch the chunks on the bounded pool, the provider's rate limiter spaces them out when needed
+        if self.executor is None or len(calls) < 2:
+            return [fetch(params) for params in calls]
+        return list(self.executor.map(fetch, calls))
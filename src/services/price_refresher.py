@@ -0,0 +1,74 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+
+class PriceRefresher:
+    """
+    Functionality: Keeps the prices stored in the 'assets' table fresh by refreshing them from the price provider on a background thread, so request handlers only ever read prices from the database instead of waiting on an upstream round trip.
+
+    The refresher follows the same 'init_app' pattern as the other Flask extensions in 'init.py'. The background thread is started lazily on the first request handled by the app, which keeps CLI commands such as 'flask db create' from starting a refresher.
+
+    Config:
+    - PRICE_REFRESH_INTERVAL: Number of seconds between refreshes. A value of 0 disables the background refresher.
+
+    Notes:
+    - Every gunicorn worker runs its own refresher. Before refreshing, a worker checks when the prices were last refreshed and skips the refresh if another worker already did it within the current interval.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.interval = 0
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Read refresh interval (in seconds) from the app config
+        self.app = app
+        self.interval = int(app.config.get("PRICE_REFRESH_INTERVAL") or 0)
+        app.extensions["price_refresher"] = self
+
+        # Only register the lazy start hook when the refresher is enabled
+        if self.interval > 0:
+            app.before_request(self.start)
+
+    def start(self):
+        # Start the background thread once, the first request to reach this hook wins
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._stop_event.clear()
+                self._thread = threading.Thread(target=self._run, name="price-refresher", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        # Signal the background thread to exit and wait for it to finish
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval)
+            self._thread = None
+
+    def refresh_due(self, last_refreshed):
+        # Prices that have never been refreshed are always due
+        if last_refreshed is None:
+            return True
+        return datetime.now(timezone.utc) - last_refreshed >= timedelta(seconds=self.interval)
+
+    def _run(self):
+        # Import here to avoid a circular import between init.py and the controllers
+        from controllers.assets_controller import update_asset_prices, get_last_price_refresh
+
+        while not self._stop_event.is_set():
+            with self.app.app_context():
+                try:
+                    # Skip the refresh if another worker refreshed the prices within this interval
+                    if self.refresh_due(get_last_price_refresh()):
+                        update_asset_prices()
+                except Exception:
+                    # Never let a failed refresh kill the background thread
+                    self.app.logger.exception("Background price refresh failed")
+            # Sleep until the next refresh, waking up early if stop() is called
+            self._stop_event.wait(self.interval)
@@ -0,0 +1,192 @@
+import csv
+import io
+import math
+import random
+from datetime import date, datetime, time, timedelta, timezone
+
+from sqlalchemy import text
+
+from services.lot_ledger import Position
+
+# Daily volatility of the simulated asset prices
+DAILY_VOLATILITY = 0.04
+# Share of the trades of a held asset that are sells
+SELL_SHARE = 0.35
+# Share of the portfolios using average cost accounting, the others use FIFO
+AVERAGE_COST_SHARE = 0.2
+# Largest quantity held of an asset, within the integer quantity columns
+MAX_QUANTITY = 1_000_000_000
+
+
+def copy_rows(cursor, table, columns, rows):
+    """
+    Functionality: Bulk loads rows into a table with COPY ... FROM STDIN, far faster than INSERT statements. None is loaded as NULL.
+
+    Input: A DB-API (psycopg2) cursor, the table name, the column names and an iterable of row tuples in column order.
+    Output: None.
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(rows)
+    buffer.seek(0)
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    cursor.copy_expert(f'COPY "{table}" ({column_list}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+def reserve_ids(conn, table, column, count):
+    # Take 'count' values of the table's ID sequence, so rows referencing each other can be loaded together
+    stmt = text("SELECT nextval(pg_get_serial_sequence(:table, :column)) FROM generate_series(1, :count)")
+    return conn.execute(stmt, {"table": f'"{table}"', "column": column, "count": count}).scalars().all()
+
+
+def round_price(price):
+    # Keep prices at 8 significant digits, as quoted by exchanges
+    return float(f"{price:.8g}")
+
+
+def price_paths(current_prices, days, rng):
+    # Daily closing prices of every asset over 'days' days, oldest first, a random walk ending at the current price
+    paths = []
+    for price in current_prices:
+        path = [price]
+        for _ in range(days - 1):
+            path.append(round_price(path[-1] * math.exp(rng.gauss(0, DAILY_VOLATILITY))))
+        path.reverse()
+        paths.append(path)
+    return paths
+
+
+def copy_new_rows(conn, cursor, table, columns, rows):
+    # COPY cannot skip existing rows, so load a temporary copy of the table and insert the rows it does not hold yet
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    conn.execute(text(f'CREATE TEMPORARY TABLE "new_{table}" (LIKE "{table}" INCLUDING DEFAULTS) ON COMMIT DROP'))
+    copy_rows(cursor, f"new_{table}", columns, rows)
+    conn.execute(text(f'INSERT INTO "{table}" ({column_list}) SELECT {column_list} FROM "new_{table}" ON CONFLICT DO NOTHING'))
+
+
+def seed_assets(conn, cursor, coins, count, rng):
+    """
+    Functionality: Adds the assets used by the synthetic trades: the coins of the market snapshot in rank order, followed by made up assets when more are requested than the snapshot holds. The made up assets are 'synthetic-asset-0', 'synthetic-asset-1', ..., the IDs served by the fake price provider (see FakePriceProvider). Assets already in the database are kept with their current price.
+
+    Input: A SQLAlchemy connection and its DB-API cursor, the market snapshot (see utils/fixtures.py), the number of assets and the random generator.
+    Output: A list of (assetID, symbol, name, current price) tuples.
+    """
+    snapshot = coins[:count]
+    rows = [(coin["id"], coin["market_cap_rank"], coin["symbol"].upper(), coin["name"], coin["current_price"]) for coin in snapshot]
+    # Made up assets are numbered from 0 and ranked after the snapshot, the universe served by the fake price provider
+    rows += [
+        (f"synthetic-asset-{index}", len(snapshot) + index + 1, f"SYN{index}", f"Synthetic Asset {index}", round_price(rng.lognormvariate(0, 2)))
+        for index in range(count - len(snapshot))
+    ]
+    now = datetime.now(timezone.utc)
+    copy_new_rows(conn, cursor, "assets", ("assetID", "marketCapPos", "symbol", "name", "price", "lastUpdated"), [row + (now,) for row in rows])
+    stmt = text('SELECT "assetID", symbol, name, price FROM assets WHERE "assetID" = ANY(:ids)')
+    existing = {row[0]: tuple(row) for row in conn.execute(stmt, {"ids": [row[0] for row in rows]})}
+    return [existing[row[0]] for row in rows]
+
+
+def generate(conn, coins, users, trades, assets, password_hash, days=365, batch_size=10000, seed=0, echo=print):
+    """
+    Functionality: Bulk loads a synthetic but internally consistent data set for load testing: assets with a daily price history, users with one portfolio each, and their transactions, owned assets and cost basis lots. Trades are simulated in date order per portfolio at the day's price, sells never exceed the quantity held, realized P&L and lots follow the portfolio's cost method (see services/lot_ledger.py), owned assets are priced at their average cost and holdings are the total cost of the transactions, so 'flask db rebuild-holdings' finds nothing to correct. The output only depends on 'seed'.
+
+    Users are loaded in batches of 'batch_size' users with COPY, each batch committed on its own, and every user gets the same precomputed password hash so bcrypt is not run per user.
+
+    Input:
+    - conn: A SQLAlchemy connection of its own (not the session's), committed after every batch.
+    - coins: The market snapshot (see utils/fixtures.py) providing the assets and their current prices.
+    - users, trades, assets: The number of users (and portfolios), transactions and assets to create.
+    - password_hash: The bcrypt hash set as every user's password.
+    - days: The number of days of price history the trades are spread over, ending today.
+    - batch_size: The number of users loaded per batch.
+    - seed: Seed of the random generator.
+    - echo: A function called with a progress line after every batch.
+
+    Output: A dictionary of the number of rows created per table.
+    """
+    rng = random.Random(seed)
+    today = date.today()
+    dates = [today - timedelta(days=days - 1 - day) for day in range(days)]
+    counts = dict.fromkeys(("assets", "priceHistory", "users", "portfolios", "transactions", "ownedAssets", "lots"), 0)
+
+    # Bulk loads may run longer than requests are allowed to
+    conn.execute(text("SET statement_timeout = 0"))
+    cursor = conn.connection.cursor()
+
+    # Assets and their daily price history, ending at their current price
+    asset_rows = seed_assets(conn, cursor, coins, assets, rng)
+    paths = price_paths([row[3] for row in asset_rows], days, rng)
+    history = [
+        (asset_id, datetime.combine(day, time(), timezone.utc), price)
+        for (asset_id, *_), path in zip(asset_rows, paths)
+        for day, price in zip(dates, path)
+    ]
+    copy_new_rows(conn, cursor, "priceHistory", ("assetID", "timestamp", "price"), history)
+    conn.commit()
+    counts["assets"], counts["priceHistory"] = len(asset_rows), len(history)
+
+    # Spread the trades unevenly over the portfolios, a few very active ones and many quiet ones
+    weights = [rng.expovariate(1) for _ in range(users)]
+    scale = trades / sum(weights) if users else 0
+    trade_counts = [int(weight * scale) for weight in weights]
+    for index in rng.sample(range(users), min(users, trades - sum(trade_counts))):
+        trade_counts[index] += 1
+    # Popular assets (by market cap) are traded more often
+    popularity = [1 / (rank + 1) ** 0.8 for rank in range(len(asset_rows))]
+
+    for batch_start in range(0, users, batch_size):
+        batch_counts = trade_counts[batch_start:batch_start + batch_size]
+        user_ids = reserve_ids(conn, "users", "userID", len(batch_counts))
+        portfolio_ids = reserve_ids(conn, "portfolios", "portfolioID", len(batch_counts))
+        user_rows, portfolio_rows, transaction_rows, owned_rows, lot_rows = [], [], [], [], []
+
+        for user_id, portfolio_id, trade_count in zip(user_ids, portfolio_ids, batch_counts):
+            method = "average" if rng.random() < AVERAGE_COST_SHARE else "fifo"
+            traded = list(set(rng.choices(range(len(asset_rows)), weights=popularity, k=1 + int(rng.expovariate(1 / 3)))))
+            trade_days = sorted(rng.randrange(days) for _ in range(trade_count))
+            positions = {}
+            holdings = 0.0
+
+            for day in trade_days:
+                asset = rng.choice(traded)
+                position = positions.setdefault(asset, Position(method))
+                price = paths[asset][day]
+                if position.quantity and (rng.random() < SELL_SHARE or position.quantity == MAX_QUANTITY):
+                    transaction_type, quantity = "sell", rng.randint(1, position.quantity)
+                    realized = position.sell(quantity, price)
+                else:
+                    # Trade sizes are a budget in USD, so expensive assets are bought in small quantities
+                    transaction_type, quantity = "buy", min(MAX_QUANTITY - position.quantity, max(1, round(rng.lognormvariate(6, 1.5) / price)))
+                    realized = None
+                    position.buy(quantity, price, dates[day])
+                total_cost = price * quantity
+                holdings += total_cost
+                transaction_rows.append((transaction_type, quantity, price, total_cost, dates[day], realized, asset_rows[asset][0], portfolio_id))
+
+            for asset, position in positions.items():
+                if not position.quantity:
+                    continue
+                asset_id, symbol, name, _ = asset_rows[asset]
+                owned_rows.append((symbol, name, position.quantity, position.average_price, asset_id, portfolio_id))
+                lot_rows.extend((quantity, price, day, asset_id, portfolio_id) for quantity, price, day in position.changes()[0])
+
+            user_rows.append((user_id, f"user{user_id}@synthetic.test", password_hash, False, 0))
+            opened = dates[trade_days[0]] if trade_days else dates[rng.randrange(days)]
+            portfolio_rows.append((portfolio_id, f"Portfolio {user_id}", "Synthetic load testing portfolio.", holdings, opened, method, user_id))
+
+        # Load the batch, parents first for the foreign keys
+        copy_rows(cursor, "users", ("userID", "email", "password", "is_admin", "tokenVersion"), user_rows)
+        copy_rows(cursor, "portfolios", ("portfolioID", "name", "description", "holdings", "date", "costMethod", "userID"), portfolio_rows)
+        copy_rows(cursor, "transactions", ("transactionType", "quantity", "price", "totalCost", "date", "realizedPnL", "assetID", "portfolioID"), transaction_rows)
+        copy_rows(cursor, "ownedAssets", ("symbol", "name", "quantity", "price", "assetID", "portfolioID"), owned_rows)
+        copy_rows(cursor, "lots", ("quantity", "price", "date", "assetID", "portfolioID"), lot_rows)
+        conn.commit()
+
+        counts["users"] += len(user_rows)
+        counts["portfolios"] += len(portfolio_rows)
+        counts["transactions"] += len(transaction_rows)
+        counts["ownedAssets"] += len(owned_rows)
+        counts["lots"] += len(lot_rows)
+        echo(f"Loaded {counts['users']}/{users} users, {counts['transactions']} transactions.")
+
+    conn.execute(text("RESET statement_timeout"))
+    conn.commit()
+    return counts
@@ -0,0 +1,75 @@
+import numpy as np
+
+
+def value_portfolios(portfolio_ids, asset_ids, quantities, cost_prices, market_prices):
+    """
+    Functionality: Marks positions to market for any number of portfolios at once. Every input is a column of the positions, sorted by portfolio ID, and the valuation is computed on whole NumPy arrays: each position's market value, cost basis, unrealized P&L and weight, and every portfolio's totals (summed with np.add.reduceat over the contiguous runs of each portfolio), without a Python loop over the positions.
+
+    Input:
+    - portfolio_ids: The portfolio ID of every position, sorted so each portfolio's positions are contiguous.
+    - asset_ids: The asset ID of every position.
+    - quantities: The quantity held of every position.
+    - cost_prices: The average price paid for every position (the owned asset price).
+    - market_prices: The current price of every position's asset.
+
+    Output: A list of dictionaries, one per portfolio in input order, each with the 'portfolioID', its 'marketValue', 'costBasis' and 'unrealizedPnL', and 'assets', the list of its positions with their 'assetID', 'quantity', 'averagePrice', 'price', 'marketValue', 'costBasis', 'unrealizedPnL' and 'weight' (share of the portfolio's market value, 0 if the portfolio is worth nothing).
+    """
+    portfolio_ids = np.asarray(portfolio_ids, dtype=np.int64)
+    if portfolio_ids.size == 0:
+        return []
+    held = quantities
+    quantities = np.asarray(quantities, dtype=np.float64)
+    cost_prices = np.asarray(cost_prices, dtype=np.float64)
+    market_prices = np.asarray(market_prices, dtype=np.float64)
+
+    # Position values
+    market_values = quantities * market_prices
+    cost_bases = quantities * cost_prices
+    pnl = market_values - cost_bases
+
+    # Start index of every portfolio's run of positions, and the portfolio totals
+    starts = np.flatnonzero(np.r_[True, portfolio_ids[1:] != portfolio_ids[:-1]])
+    total_market = np.add.reduceat(market_values, starts)
+    total_cost = np.add.reduceat(cost_bases, starts)
+    total_pnl = total_market - total_cost
+
+    # Weight of every position in its portfolio
+    run_lengths = np.diff(np.r_[starts, portfolio_ids.size])
+    position_totals = np.repeat(total_market, run_lengths)
+    weights = np.divide(market_values, position_totals, out=np.zeros_like(market_values), where=position_totals != 0)
+
+    # Build the output from plain lists, converting the arrays once
+    positions = [
+        {
+            "assetID": asset_id,
+            "quantity": quantity,
+            "averagePrice": cost_price,
+            "price": market_price,
+            "marketValue": market_value,
+            "costBasis": cost_basis,
+            "unrealizedPnL": position_pnl,
+            "weight": weight
+        }
+        for asset_id, quantity, cost_price, market_price, market_value, cost_basis, position_pnl, weight in zip(
+            asset_ids, held, cost_prices.tolist(), market_prices.tolist(),
+            market_values.tolist(), cost_bases.tolist(), pnl.tolist(), weights.tolist()
+        )
+    ]
+    bounds = np.r_[starts, portfolio_ids.size].tolist()
+    return [
+        {
+            "portfolioID": portfolio_id,
+            "marketValue": market_value,
+            "costBasis": cost_basis,
+            "unrealizedPnL": portfolio_pnl,
+            "assets": positions[start:end]
+        }
+        for portfolio_id, market_value, cost_basis, portfolio_pnl, start, end in zip(
+            portfolio_ids[starts].tolist(), total_market.tolist(), total_cost.tolist(), total_pnl.tolist(), bounds[:-1], bounds[1:]
+        )
+    ]
+
+
+def empty_valuation(portfolio_id):
+    # The valuation of a portfolio without positions
+    return {"portfolioID": portfolio_id, "marketValue": 0.0, "costBasis": 0.0, "unrealizedPnL": 0.0, "assets": []}
@@ -0,0 +1,19 @@
+import json
+import os
+
+# Folder holding the data bundled with the app for offline use
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fixtures")
+
+# Snapshot of the top coins by market cap, in the format of CoinGecko's /coins/markets endpoint
+MARKETS_FIXTURE = os.path.join(FIXTURES_DIR, "coins_markets.json")
+
+
+def load_markets_fixture():
+    """
+    Functionality: Loads the bundled market data snapshot, used instead of CoinGecko when seeding offline. The prices are a fixed snapshot, not current prices.
+
+    Input: None.
+    Output: A list of coin dictionaries with the 'id', 'symbol', 'name', 'market_cap_rank' and 'current_price' keys, ordered by market cap rank.
+    """
+    with open(MARKETS_FIXTURE, encoding="utf-8") as file:
+        return json.load(file)
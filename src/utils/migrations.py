@@ -0,0 +1,201 @@
+import importlib.util
+import os
+import re
+
+from init import db
+
+# Folder holding the migration scripts, named '<revision>_<description>.py'
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+
+# Single row table recording the revision the database schema is at
+schema_version = db.Table(
+    "schema_version",
+    db.Column("revision", db.String(32), primary_key=True)
+)
+
+
+class MigrationError(Exception):
+    """Raised when the migration scripts or the requested revision are invalid."""
+
+
+def load_migrations():
+    """
+    Functionality: Loads the migration scripts from the migrations folder, ordered by revision.
+
+    Every script is a module named '<revision>_<description>.py' defining:
+    - upgrade(conn) and downgrade(conn): Apply and revert the migration using the given connection.
+    - transactional (optional, default True): Set to False for migrations that cannot run inside a transaction, such as CREATE INDEX CONCURRENTLY. These run on an autocommit connection and must be safe to re-run if they fail halfway.
+
+    Input: None.
+    Output: A list of (revision, module) tuples in the order they are applied.
+    """
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = re.fullmatch(r"(\d+)_\w+\.py", filename)
+        if not match:
+            continue
+        spec = importlib.util.spec_from_file_location(f"migrations.{filename[:-3]}", os.path.join(MIGRATIONS_DIR, filename))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        migrations.append((match.group(1), module))
+    return migrations
+
+
+def get_current_revision():
+    """
+    Functionality: Returns the revision the database schema is at.
+
+    Input: None.
+    Output: The current revision, or None if no migration has been applied (or the database has not been stamped yet).
+    """
+    with db.engine.connect() as conn:
+        if not db.inspect(conn).has_table(schema_version.name):
+            return None
+        return conn.scalar(db.select(schema_version.c.revision))
+
+
+def _set_revision(conn, revision):
+    conn.execute(db.delete(schema_version))
+    if revision is not None:
+        conn.execute(db.insert(schema_version).values(revision=revision))
+
+
+def stamp(revision):
+    """
+    Functionality: Records a revision as the current one without running any migration, for example after creating the tables from the models with 'flask db create'.
+
+    Input: The revision to record.
+    Output: None.
+    """
+    with db.engine.begin() as conn:
+        schema_version.create(conn, checkfirst=True)
+        _set_revision(conn, revision)
+
+
+def head_revision():
+    # The latest revision available
+    migrations = load_migrations()
+    return migrations[-1][0] if migrations else None
+
+
+def _run(module, direction, revision_after):
+    fn = getattr(module, direction)
+    if getattr(module, "transactional", True):
+        # Apply the migration and record the new revision atomically
+        with db.engine.begin() as conn:
+            # Migrations may run longer than the statement timeout applied to API requests
+            conn.execute(db.text("SET LOCAL statement_timeout = 0"))
+            fn(conn)
+            _set_revision(conn, revision_after)
+    else:
+        # Run statements such as CREATE INDEX CONCURRENTLY outside of a transaction
+        with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(db.text("SET statement_timeout = 0"))
+            try:
+                fn(conn)
+            finally:
+                conn.execute(db.text("RESET statement_timeout"))
+        with db.engine.begin() as conn:
+            _set_revision(conn, revision_after)
+
+
+def upgrade(target=None, echo=print):
+    """
+    Functionality: Applies every migration after the current revision, up to and including the target revision.
+
+    Input:
+    - target: The revision to upgrade to, defaults to the latest revision.
+    - echo: Function used to report each applied migration.
+
+    Output: The list of revisions applied.
+
+    Errors:
+    - Raises MigrationError if the target revision does not exist or is older than the current revision.
+    """
+    migrations = load_migrations()
+    revisions = [revision for revision, _ in migrations]
+    target = target or (revisions[-1] if revisions else None)
+    if target is not None and target not in revisions:
+        raise MigrationError(f"Unknown revision '{target}'")
+
+    with db.engine.begin() as conn:
+        schema_version.create(conn, checkfirst=True)
+    current = get_current_revision()
+    if current is not None and current not in revisions:
+        raise MigrationError(f"The database is at revision '{current}', which has no migration script")
+    start = revisions.index(current) + 1 if current else 0
+    end = revisions.index(target) + 1 if target else 0
+    if end < start:
+        raise MigrationError(f"Target revision '{target}' is older than the current revision '{current}', use downgrade instead")
+
+    applied = []
+    for revision, module in migrations[start:end]:
+        echo(f"Upgrading to {revision}: {(module.__doc__ or '').strip()}")
+        _run(module, "upgrade", revision)
+        applied.append(revision)
+    return applied
+
+
+def downgrade(target=None, echo=print):
+    """
+    Functionality: Reverts migrations, newest first, until the database is at the target revision.
+
+    Input:
+    - target: The revision to downgrade to, 'base' to revert every migration. Defaults to the revision before the current one.
+    - echo: Function used to report each reverted migration.
+
+    Output: The list of revisions reverted.
+
+    Errors:
+    - Raises MigrationError if the target revision does not exist or is newer than the current revision.
+    """
+    migrations = load_migrations()
+    revisions = [revision for revision, _ in migrations]
+    current = get_current_revision()
+    if current is None:
+        return []
+    if current not in revisions:
+        raise MigrationError(f"The database is at revision '{current}', which has no migration script")
+    position = revisions.index(current)
+    if target is None:
+        target_position = position - 1
+    elif target == "base":
+        target_position = -1
+    elif target in revisions:
+        target_position = revisions.index(target)
+    else:
+        raise MigrationError(f"Unknown revision '{target}'")
+    if target_position > position:
+        raise MigrationError(f"Target revision '{target}' is newer than the current revision '{current}', use upgrade instead")
+
+    reverted = []
+    for index in range(position, target_position, -1):
+        revision, module = migrations[index]
+        echo(f"Downgrading {revision}: {(module.__doc__ or '').strip()}")
+        _run(module, "downgrade", revisions[index - 1] if index > 0 else None)
+        reverted.append(revision)
+    return reverted
+
+
+def create_index_concurrently(conn, name, table, columns, unique=False):
+    """
+    Functionality: Builds an index without blocking writes to the table, so it can be added to a populated, live database. A failed concurrent build leaves an invalid index behind, which is dropped and rebuilt here, so the migration can simply be re-run.
+
+    Input: An autocommit connection, the index name, the table name, the list of column names and whether the index is unique.
+    Output: None.
+    """
+    valid = conn.scalar(
+        db.text("SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"),
+        {"name": name}
+    )
+    if valid:
+        return
+    if valid is not None:
+        conn.execute(db.text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    conn.execute(db.text(f'CREATE {"UNIQUE " if unique else ""}INDEX CONCURRENTLY "{name}" ON "{table}" ({column_list})'))
+
+
+def drop_index_concurrently(conn, name):
+    # Drop an index without blocking writes to its table
+    conn.execute(db.text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
@@ -0,0 +1,94 @@
+import base64
+import binascii
+import json
+
+from flask import request, abort
+
+from init import db
+
+# Number of rows returned per page when the request does not specify a 'limit'
+DEFAULT_PAGE_LIMIT = 100
+# Largest 'limit' a client may request
+MAX_PAGE_LIMIT = 1000
+
+
+def encode_cursor(value):
+    """
+    Functionality: Encodes the key of the last row of a page into an opaque, URL safe cursor string.
+
+    Input: The key value (for example a primary key) of the last row returned.
+    Output: A URL safe base64 string to be passed back by the client as the 'cursor' query parameter.
+    """
+    return base64.urlsafe_b64encode(json.dumps(value).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """
+    Functionality: Decodes a cursor created by encode_cursor back into the key value it holds.
+
+    Input: The cursor string received in the 'cursor' query parameter.
+    Output: The key value stored in the cursor.
+
+    Errors:
+    - Aborts with a 400 Bad Request error if the cursor is not a valid cursor.
+    """
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, UnicodeError, binascii.Error):
+        abort(400, description=f"Invalid cursor '{cursor}'")
+
+
+def get_page_limit():
+    """
+    Functionality: Reads and validates the 'limit' query parameter of the current request.
+
+    Input: None. The 'limit' query parameter is read from the current request.
+    Output: The requested page size, or DEFAULT_PAGE_LIMIT if no limit was given.
+
+    Errors:
+    - Aborts with a 400 Bad Request error if the limit is not an integer between 1 and MAX_PAGE_LIMIT.
+    """
+    limit = request.args.get("limit", DEFAULT_PAGE_LIMIT)
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        limit = 0
+    if not 1 <= limit <= MAX_PAGE_LIMIT:
+        abort(400, description=f"'limit' must be an integer between 1 and {MAX_PAGE_LIMIT}")
+    return limit
+
+
+def paginate_keyset(stmt, key_column, *, scalars):
+    """
+    Functionality: Applies keyset (cursor) pagination to a select statement using the 'limit' and 'cursor' query parameters of the current request. Rows are ordered by the key column and each page starts directly after the key of the last row of the previous page, so the database seeks straight to the page through the key's index. Fetching a deep page costs the same as fetching the first one, unlike OFFSET pagination.
+
+    Input:
+    - stmt: A select statement returning ORM entities, or columns including the key column.
+    - key_column: A unique, indexed column to paginate on, such as the primary key.
+    - scalars: True if 'stmt' selects ORM entities, which are returned as objects, False to return the rows as tuples.
+
+    Output: A tuple of the list of rows in the page, and the cursor of the next page (None if this is the last page).
+
+    Errors:
+    - Aborts with a 400 Bad Request error if the 'limit' or 'cursor' query parameters are invalid.
+    """
+    limit = get_page_limit()
+    cursor = request.args.get("cursor")
+
+    # Continue directly after the last row of the previous page
+    if cursor:
+        last_key = decode_cursor(cursor)
+        if not isinstance(last_key, key_column.type.python_type):
+            abort(400, description=f"Invalid cursor '{cursor}'")
+        stmt = stmt.where(key_column > last_key)
+
+    # Fetch one extra row to know if there is a next page
+    stmt = stmt.order_by(key_column).limit(limit + 1)
+    result = db.session.execute(stmt)
+    rows = (result.scalars() if scalars else result).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(getattr(rows[-1], key_column.key))
+    return rows, next_cursor
@@ -0,0 +1,141 @@
+import math
+from datetime import date, datetime
+from functools import cached_property
+
+from flask import Response, current_app
+from flask.json.provider import DefaultJSONProvider
+
+from init import db
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, responses are then encoded by Flask's JSON provider
+    orjson = None
+
+
+def _is_exact_float(value):
+    # orjson and the standard library format floats identically, except when Python's repr would switch to
+    # exponent notation (below 1e-4 or from 1e16 on) and for NaN and infinity
+    return value == 0 or (1e-4 <= abs(value) < 1e16 and math.isfinite(value))
+
+
+class RowSerializer:
+    """
+    Functionality: A fast alternative to dumping flat models (models without nested fields) through their marshmallow schema. Only the columns the schema serializes are selected, and the output is built straight from the result tuples instead of walking the schema for every object. The JSON is then encoded with orjson when it is installed.
+
+    The response is byte for byte the one the schema and Flask's JSON provider would produce: the same fields (attributes missing from the model are skipped, as marshmallow does), dates and datetimes as ISO 8601 strings, keys sorted, compact separators, non-ASCII characters escaped and a trailing newline. Whenever orjson would format a value differently (a float in exponent notation, NaN, or a non-ASCII character), or the app's JSON provider is customised or pretty-printing, the response is encoded by Flask instead.
+
+    The fast path is enabled by the FAST_JSON_SERIALIZATION config, otherwise the model is loaded and dumped through the schema as usual.
+    """
+
+    def __init__(self, model, schema):
+        self.model = model
+        self.schema = schema
+
+    @cached_property
+    def _layout(self):
+        # Resolved on first use, once every model has been imported and the mappers can be configured
+        column_attrs = db.inspect(self.model).column_attrs
+        fields = [name for name in self.schema.dump_fields if name in column_attrs]
+        columns = [getattr(self.model, name) for name in fields]
+        # Positions of the columns needing conversion or a check before encoding
+        types = [column_attrs[name].columns[0].type.python_type for name in fields]
+        temporal = [index for index, python_type in enumerate(types) if issubclass(python_type, (date, datetime))]
+        floats = [index for index, python_type in enumerate(types) if python_type is float]
+        return fields, columns, temporal, floats
+
+    @staticmethod
+    def enabled():
+        return current_app.config.get("FAST_JSON_SERIALIZATION", False)
+
+    def select(self):
+        """
+        Functionality: Builds the select statement to filter, order and paginate.
+
+        Input: None.
+        Output: A select of the serialized columns if the fast path is enabled, otherwise a select of the model.
+        """
+        if self.enabled():
+            return db.select(*self._layout[1])
+        return db.select(self.model)
+
+    def selects_entities(self):
+        # select() returns model objects when the fast path is disabled, column tuples otherwise
+        return not self.enabled()
+
+    def all(self, stmt):
+        """
+        Functionality: Runs a statement built from select() and returns its rows, in the form list_response() and page_response() expect.
+
+        Input: The select statement.
+        Output: A list of model objects, or of column tuples if the fast path is enabled.
+        """
+        result = db.session.execute(stmt)
+        return (result.scalars() if self.selects_entities() else result).all()
+
+    def list_response(self, rows, status=200, headers=None):
+        """
+        Functionality: Serializes the rows returned by select() as a JSON array.
+
+        Input: The rows, the HTTP status code and optional response headers.
+        Output: A response (or a view return value) containing the serialized rows.
+        """
+        if not self.enabled():
+            return self.schema.dump(rows, many=True), status, headers or {}
+        items, exact = self._dump(rows)
+        return self._response(items, exact, status, headers)
+
+    def page_response(self, rows, next_cursor, status=200, headers=None):
+        """
+        Functionality: Serializes a page of rows returned by select() as a JSON object with 'data', the serialized rows, and 'next_cursor'.
+
+        Input: The rows, the cursor of the next page, the HTTP status code and optional response headers.
+        Output: A response (or a view return value) containing the serialized page.
+        """
+        if not self.enabled():
+            return {"data": self.schema.dump(rows, many=True), "next_cursor": next_cursor}, status, headers or {}
+        items, exact = self._dump(rows)
+        return self._response({"data": items, "next_cursor": next_cursor}, exact, status, headers)
+
+    def _dump(self, rows):
+        fields, _, temporal, floats = self._layout
+        exact = True
+        items = []
+        for row in rows:
+            if temporal:
+                row = list(row)
+                for index in temporal:
+                    if row[index] is not None:
+                        row[index] = row[index].isoformat()
+            if exact:
+                exact = all(row[index] is None or _is_exact_float(row[index]) for index in floats)
+            items.append(dict(zip(fields, row)))
+        return items, exact
+
+    def _response(self, payload, exact, status, headers):
+        # Values orjson would format differently must go through Flask's encoder
+        if not exact:
+            return current_app.json.response(payload), status, headers or {}
+        return json_response(payload, status, headers)
+
+
+def json_response(payload, status=200, headers=None, exact=True):
+    """
+    Functionality: Encodes a JSON response with orjson when it is installed and FAST_JSON_SERIALIZATION is enabled, otherwise with Flask's JSON provider. Keys are sorted and separators compact, as Flask does.
+
+    Input:
+    - payload: The data to encode, made of dictionaries, lists, strings, numbers, booleans and None.
+    - status, headers: The HTTP status code and optional response headers.
+    - exact: True if the bytes must be exactly the ones Flask would produce, in which case the caller must make sure no float would be formatted differently (see _is_exact_float) and non-ASCII text falls back to Flask. False if any valid JSON encoding of the same data will do: orjson then writes non-ASCII characters as UTF-8, floats in its own notation and NaN as null.
+
+    Output: A response (or a view return value) containing the encoded payload.
+    """
+    provider = current_app.json
+    # Only match the default provider in its compact form
+    compact = not ((provider.compact is None and current_app.debug) or provider.compact is False)
+    if orjson is not None and current_app.config.get("FAST_JSON_SERIALIZATION", False) and compact and type(provider) is DefaultJSONProvider:
+        body = orjson.dumps(payload, option=orjson.OPT_SORT_KEYS if provider.sort_keys else 0)
+        # The standard library escapes non-ASCII characters and DEL, orjson writes them as they are
+        if not exact or (provider.ensure_ascii and body.isascii() and b"\x7f" not in body):
+            return Response(body + b"\n", status=status, headers=headers, mimetype=provider.mimetype)
+    return provider.response(payload), status, headers or {}